@@ -1,6 +1,9 @@
 import coeffstore
 import expressions
 import caching
+import formtable
+import tape
+import liveness
 import libadjoint
 from dolfin_adjoint import backend
 if backend.__name__ == "dolfin":
@@ -63,10 +66,11 @@ def adj_reset_cache():
   if backend.parameters["adjoint"]["debug_cache"]:
     backend.info_blue("Resetting solver cache")
 
-  caching.assembled_fwd_forms.clear()
-  caching.assembled_adj_forms.clear()
+  caching.assembly_cache.clear()
   caching.lu_solvers.clear()
   caching.localsolvers.clear()
+  caching.projection_operators.clear()
+  caching.krylov_solvers.clear()
 
   caching.pis_fwd_to_tlm.clear()
   caching.pis_fwd_to_adj.clear()
@@ -91,6 +95,11 @@ def adj_reset():
   adj_variables.__init__()
   function_names.__init__()
   adj_reset_cache()
+  caching.assembly_cache.forget_forward()
+  caching.replay_cache.clear()
+  formtable.clear()
+  tape.clear()
+  liveness.clear()
   backend.parameters["adjoint"]["stop_annotating"] = False
 
 # Map from FunctionSpace to LUSolver that has factorised the fsp mass matrix
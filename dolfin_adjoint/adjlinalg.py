@@ -7,6 +7,16 @@ import os.path
 import misc
 import caching
 import compatibility
+import scheduling
+import numpy
+from telemetry import telemetry
+from inexactness import inexactness
+
+# The random number generator for Vector.set_random. It is advanced identically on all
+# processes, so that random vectors are reproducible and independent of the partitioning.
+# Reseed it with random_state.seed(n). The entries are drawn in blocks of random_block_size.
+random_state = numpy.random.RandomState(0)
+random_block_size = 4096
 
 class Vector(libadjoint.Vector):
   '''This class implements the libadjoint.Vector abstract base class for the Dolfin adjoint.
@@ -31,6 +41,76 @@ class Vector(libadjoint.Vector):
     if fn_space is not None:
       self.fn_space = fn_space
 
+  # The data of a Vector is a Function, a Form or None. When many contributions are added
+  # up with axpy (e.g. the right-hand side of an adjoint equation coupled to many others),
+  # they are not summed up eagerly. Instead, the form-valued terms are collected in the
+  # buffer self.terms, a list of each distinct form with its accumulated coefficient (found
+  # by the key of the form in self.term_index, see term_key), and the Function-valued
+  # terms are added up in vector space in self.function. The data is
+  # only combined when it is asked for: the buffered forms are summed into one form (with
+  # each distinct form appearing once), and if there is a Function part the sum is
+  # assembled in one pass and added to it. Terms whose coefficients cancel are dropped.
+  # Distinct forms with the same structure but different coefficients are not fused into
+  # one term: that needs the form to be linear in those coefficients, which is not known
+  # here, so they are only combined by the single assembly of the summed form.
+
+  def get_data(self):
+    if self.freed:
+      raise libadjoint.exceptions.LibadjointErrorNeedValue("This value was freed by the liveness analysis, as it was not expected to be needed again.")
+
+    if not self.terms:
+      return self.function
+
+    if self.form is None:
+      self.form = sum_terms(self.terms)
+
+    if self.function is None:
+      return self.form
+
+    self.function.vector().axpy(1.0, backend.assemble(self.form))
+    self.terms = []
+    self.term_index = {}
+    self.form = None
+    return self.function
+
+  def set_data(self, data):
+    self.function = None
+    self.terms = []
+    self.term_index = {}
+    self.form = None
+    self.freed = False
+
+    if isinstance(data, ufl.form.Form):
+      self.add_term(1.0, data)
+    else:
+      self.function = data
+
+  data = property(get_data, set_data)
+
+  def free(self):
+    '''Release the data of a stored value that is not needed any more (see liveness.py).'''
+    self.function = None
+    self.terms = []
+    self.term_index = {}
+    self.form = None
+    self.freed = True
+
+  def add_term(self, alpha, form):
+    key = term_key(form)
+    i = self.term_index.get(key)
+    if i is None:
+      self.term_index[key] = len(self.terms)
+      self.terms.append((form, alpha))
+    else:
+      (term, coefficient) = self.terms[i]
+      if coefficient + alpha != 0.0:
+        self.terms[i] = (term, coefficient + alpha)
+      else:
+        # The term has cancelled: drop it, so that it is neither kept alive nor assembled
+        del self.terms[i]
+        self.term_index = dict((term_key(term), j) for (j, (term, c)) in enumerate(self.terms))
+    self.form = None
+
   def duplicate(self):
 
     if isinstance(self.data, ufl.form.Form):
@@ -58,69 +138,56 @@ class Vector(libadjoint.Vector):
       self.nonlinear_u = x.nonlinear_u
       self.nonlinear_bcs = x.nonlinear_bcs
       self.nonlinear_J = x.nonlinear_J
+      if hasattr(x, 'nonlinear_rhs'):
+        self.nonlinear_rhs = x.nonlinear_rhs
 
     if x.zero:
       return
 
-    if (self.data is None):
-      # self is an empty form.
-      if isinstance(x.data, backend.Function):
-        self.data = backend.Function(x.data)
-        self.data.vector()._scale(alpha)
+    # Add the buffered form terms of x without combining them first
+    if x.terms:
+      if self.terms:
+        sargs = ufl.algorithms.extract_arguments(self.terms[0][0])
       else:
-        self.data=alpha*x.data
+        sargs = None
 
-    elif x.data is None:
-      pass
-    elif isinstance(self.data, backend.Coefficient):
-      if isinstance(x.data, backend.Coefficient):
-        self.data.vector().axpy(alpha, x.data.vector())
-      else:
-        # This occurs when adding a RHS derivative to an adjoint equation
-        # corresponding to the initial conditions.
-        self.data.vector().axpy(alpha, backend.assemble(x.data))
-        self.data.form = alpha * x.data
-    elif isinstance(x.data, ufl.form.Form) and isinstance(self.data, ufl.form.Form):
-
-      # Let's do a bit of argument shuffling, shall we?
-      xargs = ufl.algorithms.extract_arguments(x.data)
-      sargs = ufl.algorithms.extract_arguments(self.data)
-
-      if xargs != sargs:
-        # OK, let's check that all of the function spaces are happy and so on.
-        for i in range(len(xargs)):
-          assert xargs[i].element() == sargs[i].element()
-          assert xargs[i].function_space() == sargs[i].function_space()
-
-        # Now that we are happy, let's replace the xargs with the sargs ones.
-        x_form = backend.replace(x.data, dict(zip(xargs, sargs)))
-      else:
-        x_form = x.data
-
-      self.data+=alpha*x_form
-    elif isinstance(self.data, ufl.form.Form) and isinstance(x.data, backend.Function):
-      #print "axpy assembling FormFunc. self.data is a %s; x.data is a %s" % (self.data.__class__, x.data.__class__)
-      x_vec = x.data.vector().copy()
-      self_vec = backend.assemble(self.data)
-      self_vec.axpy(alpha, x_vec)
-      new_fn = backend.Function(x.data.function_space())
-      new_fn.vector()[:] = self_vec
-      self.data = new_fn
-      self.fn_space = self.data.function_space()
+      for (form, coefficient) in x.terms:
+        if sargs is None:
+          sargs = ufl.algorithms.extract_arguments(form)
 
-    else:
-      print "self.data.__class__: ", self.data.__class__
-      print "x.data.__class__: ", x.data.__class__
-      assert False
+        # Let's do a bit of argument shuffling, shall we?
+        xargs = ufl.algorithms.extract_arguments(form)
 
-    self.zero = False
+        if xargs != sargs:
+          # OK, let's check that all of the function spaces are happy and so on.
+          for i in range(len(xargs)):
+            assert xargs[i].element() == sargs[i].element()
+            assert xargs[i].function_space() == sargs[i].function_space()
+
+          # Now that we are happy, let's replace the xargs with the sargs ones.
+          form = backend.replace(form, dict(zip(xargs, sargs)))
+
+        self.add_term(alpha*coefficient, form)
+
+    if x.function is not None:
+      if self.function is None:
+        if self.terms:
+          # The form terms will be assembled and added to the Function
+          self.fn_space = x.function.function_space()
+        self.function = backend.Function(x.function)
+        self.function.vector()._scale(alpha)
+      else:
+        self.function.vector().axpy(alpha, x.function.vector())
+
+    # The form terms may all have cancelled
+    self.zero = self.function is None and not self.terms
 
   def norm(self):
 
     if isinstance(self.data, backend.Function):
       return (abs(backend.assemble(backend.inner(self.data, self.data)*backend.dx)))**0.5
     elif isinstance(self.data, ufl.form.Form):
-      return backend.assemble(self.data).norm("l2")
+      return self.assembled().norm("l2")
 
   def dot_product(self,y):
 
@@ -128,48 +195,73 @@ class Vector(libadjoint.Vector):
       return backend.assemble(backend.inner(self.data, y.data)*backend.dx)
     elif isinstance(self.data, backend.Function):
       if isinstance(y.data, ufl.form.Form):
-        other = backend.assemble(y.data)
+        other = y.assembled()
       else:
         other = y.data.vector()
       return self.data.vector().inner(other)
     else:
       raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to dot anything else.")
 
+  def assembled(self):
+    '''Return the assembled vector of a form-valued Vector. The result is cached for as
+    long as the form is not changed.'''
+
+    assert isinstance(self.data, ufl.form.Form)
+
+    if getattr(self, "assembled_form", None) is not self.data:
+      self.assembled_vec = backend.assemble(self.data)
+      self.assembled_form = self.data
+    return self.assembled_vec
+
   def set_random(self):
     assert isinstance(self.data, backend.Function) or hasattr(self, "fn_space")
 
     if self.data is None:
       self.data = backend.Function(self.fn_space)
 
+    # The entries are drawn in blocks of global indices, each from its own generator seeded
+    # with a seed shared by all processes and the number of the block. Each process draws
+    # only the blocks that overlap its owned range, and the values do not depend on the
+    # partitioning.
     vec = self.data.vector()
-    for i in range(len(vec)):
-      vec[i] = random.random()
+    seed = random_state.randint(2**31 - 1)
+    (start, end) = vec.local_range()
+    blocks = range(start // random_block_size, (end - 1) // random_block_size + 1) if end > start else []
+    values = [numpy.random.RandomState([seed, block]).random_sample(random_block_size) for block in blocks]
+    offset = start - (start // random_block_size) * random_block_size
+    values = numpy.concatenate(values)[offset:offset + end - start] if values else numpy.zeros(0)
+    vec.set_local(values)
+    vec.apply("insert")
 
     self.zero = False
 
   def size(self):
-    if hasattr(self, "fn_space") and self.data is None:
-      self.data = backend.Function(self.fn_space)
-
     if isinstance(self.data, backend.Function):
       return self.data.vector().local_size()
 
     if isinstance(self.data, ufl.form.Form):
-      return backend.assemble(self.data).local_size()
+      # The size of the vector is that of the space of the test function; no need to assemble
+      fn_space = ufl.algorithms.extract_arguments(self.data)[0].function_space()
+    elif hasattr(self, "fn_space"):
+      fn_space = self.fn_space
+    else:
+      raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to get the size.")
 
-    raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to get the size.")
+    (start, end) = fn_space.dofmap().ownership_range()
+    return end - start
 
   def set_values(self, array):
+    if isinstance(self.data, ufl.form.Form):
+      # The values replace the form
+      self.data = backend.Function(ufl.algorithms.extract_arguments(self.data)[0].function_space())
+    elif self.data is None and hasattr(self, 'fn_space'):
+      self.data = backend.Function(self.fn_space)
+
     if isinstance(self.data, backend.Function):
       vec = self.data.vector()
-      vec.set_local(array)
+      vec.set_local(numpy.asarray(array, dtype='d'))
       vec.apply("insert")
 
-      self.zero = False
-    elif self.data is None and hasattr(self, 'fn_space'):
-      self.data = backend.Function(self.fn_space)
-      vec = self.data.vector()
-      vec.set_local(array)
       self.zero = False
     else:
       raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to set values.")
@@ -177,14 +269,19 @@ class Vector(libadjoint.Vector):
   def get_values(self, array):
     if isinstance(self.data, backend.Function):
       vec = self.data.vector()
-      try:
-        vec.get_local(array)
-      except NotImplementedError:
-        array[:] = vec.get_local()
-
+    elif isinstance(self.data, ufl.form.Form):
+      vec = self.assembled()
+    elif self.data is None and hasattr(self, 'fn_space'):
+      array[:] = 0.0
+      return
     else:
       raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to get values.")
 
+    try:
+      vec.get_local(array)
+    except NotImplementedError:
+      array[:] = vec.get_local()
+
   def write(self, var):
     filename = str(var)
     suffix = "xml"
@@ -239,20 +336,27 @@ class Matrix(libadjoint.Matrix):
 
     self.cache = cache
 
-  def assemble_data(self):
+  def assemble_data(self, bcs=()):
+    '''Assemble the matrix and apply the boundary conditions bcs. If self.cache is set,
+    the matrix is looked up in (and added to) the assembly cache, with bcs as part of its key.'''
     assert not isinstance(self.data, IdentityMatrix)
     if not self.cache:
-      return backend.assemble(self.data)
+      M = backend.assemble(self.data)
+      [bc.apply(M) for bc in bcs]
+      return M
     else:
-      if self.data in caching.assembled_adj_forms:
+      M = caching.assembly_cache.get(self.data, bcs)
+      if M is not None:
         if backend.parameters["adjoint"]["debug_cache"]:
           backend.info_green("Got an assembly cache hit")
-        return caching.assembled_adj_forms[self.data]
+        telemetry.count("cache_hits")
+        return M
       else:
         if backend.parameters["adjoint"]["debug_cache"]:
           backend.info_red("Got an assembly cache miss")
         M = backend.assemble(self.data)
-        caching.assembled_adj_forms[self.data] = M
+        [bc.apply(M) for bc in bcs]
+        caching.assembly_cache.add(self.data, M, bcs)
         return M
 
   def basic_solve(self, var, b):
@@ -281,28 +385,51 @@ class Matrix(libadjoint.Matrix):
         backend.info_red("Warning: got zero RHS for the solve associated with variable %s" % var)
       elif isinstance(b.data, backend.Function):
 
-        assembled_lhs = self.assemble_data()
-        [bc.apply(assembled_lhs) for bc in bcs]
         assembled_rhs = backend.Function(b.data).vector()
         [bc.apply(assembled_rhs) for bc in bcs]
 
-        wrap_solve(assembled_lhs, x.data.vector(), assembled_rhs, self.solver_parameters)
+        # A cached matrix is shared with the other threads of a concurrent reverse sweep
+        with caching.lock_if(self.cache):
+          assembled_lhs = self.assemble_data(bcs)
+        scheduling.linear_solve(lambda: wrap_solve(assembled_lhs, x.data.vector(), assembled_rhs, self.solver_parameters), cached=self.cache)
       else:
         if hasattr(b, 'nonlinear_form'): # was a nonlinear solve
           x.data.vector()[:] = b.nonlinear_u.vector()
           F = backend.replace(b.nonlinear_form, {b.nonlinear_u: x.data})
           J = backend.replace(b.nonlinear_J, {b.nonlinear_u: x.data})
-          compatibility.solve(F == 0, x.data, b.nonlinear_bcs, J=J, solver_parameters=self.solver_parameters)
+
+          solver_parameters = inexactness.relax(self.solver_parameters, nonlinear=True)
+
+          # The solution of the last replay of this solve (to warm start the next one with)
+          # and the Jacobian factorisation are kept in the replay cache
+          rhs = getattr(b, 'nonlinear_rhs', None)
+          warm_start = backend.parameters["adjoint"]["warm_start_replay"]
+          reuse_jacobian = backend.parameters["adjoint"]["reuse_jacobian"]
+          entry = None
+          if rhs is not None and (warm_start or reuse_jacobian):
+            entry = caching.replay_cache.get(rhs)
+
+          converged = False
+          if entry is not None and reuse_jacobian:
+            converged = modified_newton_solve(F, x.data, b.nonlinear_bcs, J, entry, solver_parameters)
+          if not converged:
+            compatibility.solve(F == 0, x.data, b.nonlinear_bcs, J=J, solver_parameters=solver_parameters)
+
+          if entry is not None and warm_start:
+            if "solution" not in entry:
+              entry["solution"] = backend.Function(x.data)
+            else:
+              entry["solution"].assign(x.data, annotate=False)
         else:
-          assembled_lhs = self.assemble_data()
-          [bc.apply(assembled_lhs) for bc in bcs]
           assembled_rhs = wrap_assemble(b.data, test)
           [bc.apply(assembled_rhs) for bc in bcs]
 
+          with caching.lock_if(self.cache):
+            assembled_lhs = self.assemble_data(bcs)
           if backend.__name__ == "dolfin":
-            wrap_solve(assembled_lhs, x.data.vector(), assembled_rhs, self.solver_parameters)
+            scheduling.linear_solve(lambda: wrap_solve(assembled_lhs, x.data.vector(), assembled_rhs, self.solver_parameters), cached=self.cache)
           else:
-            wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters)
+            scheduling.linear_solve(lambda: wrap_solve(assembled_lhs, x.data, assembled_rhs, self.solver_parameters), cached=self.cache)
 
     return x
 
@@ -332,24 +459,26 @@ class Matrix(libadjoint.Matrix):
             assembled_rhs = b.data.vector()
         [bc.apply(assembled_rhs) for bc in bcs]
 
-        if not var in caching.lu_solvers:
-          if backend.parameters["adjoint"]["debug_cache"]:
-            backend.info_red("Got a cache miss for %s" % var)
+        with caching.lock:
+          if not var in caching.lu_solvers:
+            if backend.parameters["adjoint"]["debug_cache"]:
+              backend.info_red("Got a cache miss for %s" % var)
 
-          if backend.parameters["adjoint"]["symmetric_bcs"] and backend.__version__ > '1.2.0':
-            assembled_lhs = backend.Matrix()
-            assembler.assemble(assembled_lhs)
-          else:
-            assembled_lhs = self.assemble_data()
-            [bc.apply(assembled_lhs) for bc in bcs]
+            if backend.parameters["adjoint"]["symmetric_bcs"] and backend.__version__ > '1.2.0':
+              assembled_lhs = backend.Matrix()
+              assembler.assemble(assembled_lhs)
+            else:
+              assembled_lhs = self.assemble_data(bcs)
 
-          caching.lu_solvers[var] = backend.LUSolver(assembled_lhs, "mumps")
-          caching.lu_solvers[var].parameters["reuse_factorization"] = True
-        else:
-          if backend.parameters["adjoint"]["debug_cache"]:
-            backend.info_green("Got a cache hit for %s" % var)
+            caching.lu_solvers[var] = backend.LUSolver(assembled_lhs, "mumps")
+            caching.lu_solvers[var].parameters["reuse_factorization"] = True
+          else:
+            if backend.parameters["adjoint"]["debug_cache"]:
+              backend.info_green("Got a cache hit for %s" % var)
+            telemetry.count("cache_hits")
+          solver = caching.lu_solvers[var]
 
-        caching.lu_solvers[var].solve(output.data.vector(), assembled_rhs)
+        scheduling.linear_solve(lambda: solver.solve(output.data.vector(), assembled_rhs), cached=True)
 
     return output
 
@@ -399,6 +528,88 @@ class Matrix(libadjoint.Matrix):
 
     return ufl.algorithms.extract_arguments(self.data)[-1]
 
+def term_key(form):
+  '''A key that identifies a form in the buffer of a Vector. The signature of a form is
+  cached by UFL, but numbers the coefficients in the order they appear in, so the
+  coefficients themselves are part of the key.'''
+
+  return (form.signature(),
+          tuple(c.count() for c in ufl.algorithms.extract_coefficients(form)),
+          tuple(ufl.algorithms.extract_arguments(form)))
+
+def sum_terms(terms):
+  '''Sum up a non-empty list of (form, coefficient) pairs into one form.'''
+
+  out = None
+  for (form, coefficient) in terms:
+    if coefficient != 1.0:
+      form = coefficient*form
+    if out is None:
+      out = form
+    else:
+      out = out + form
+  return out
+
+def modified_newton_solve(F, u, bcs, J, cache, solver_parameters):
+  '''Solve F(u) = 0 with a modified Newton method, starting from the value of u. The LU
+  factorisation of the Jacobian J is kept in the dictionary cache and reused across
+  iterations and calls for as long as it makes the residual contract by the factor
+  parameters["adjoint"]["jacobian_reuse_contraction"]; otherwise the step is undone and
+  the Jacobian is refactorised at the current iterate.
+
+  The tolerances are taken from the newton_solver solver parameters. Returns whether the
+  iteration converged; if not, u holds the last iterate.'''
+
+  newton_parameters = solver_parameters.get("newton_solver", {})
+  atol = newton_parameters.get("absolute_tolerance", 1.0e-10)
+  rtol = newton_parameters.get("relative_tolerance", 1.0e-9)
+  maxit = newton_parameters.get("maximum_iterations", 50)
+  contraction = backend.parameters["adjoint"]["jacobian_reuse_contraction"]
+
+  [bc.apply(u.vector()) for bc in bcs]
+  hbcs = [backend.homogenize(bc) for bc in bcs if isinstance(bc, backend.DirichletBC)] + [bc for bc in bcs if not isinstance(bc, backend.DirichletBC)]
+
+  def residual():
+    b = backend.assemble(F)
+    [bc.apply(b) for bc in hbcs]
+    return b
+
+  def factorize():
+    A = backend.assemble(J)
+    [bc.apply(A) for bc in hbcs]
+    cache["solver"] = backend.LUSolver(A)
+    cache["solver"].parameters["reuse_factorization"] = True
+
+  fresh = "solver" not in cache
+  if fresh:
+    factorize()
+
+  b = residual()
+  r0 = r = b.norm("l2")
+  du = u.vector().copy()
+
+  for it in range(maxit):
+    if r <= atol or r <= rtol*r0:
+      return True
+
+    cache["solver"].solve(du, b)
+    u.vector().axpy(-1.0, du)
+    b = residual()
+    r_new = b.norm("l2")
+
+    if r_new > contraction*r and not fresh:
+      # The stored Jacobian is too stale: undo the step and refactorise
+      u.vector().axpy(1.0, du)
+      factorize()
+      fresh = True
+      b = residual()
+      continue
+
+    fresh = False
+    r = r_new
+
+  return r <= atol or r <= rtol*r0
+
 class IdentityMatrix(object):
   '''Placeholder object for identity matrices'''
   pass
@@ -410,6 +621,9 @@ def wrap_solve(A, x, b, solver_parameters):
    # Comment. Why does list_lu_solver_methods() not return, a, uhm, list?
    lu_solvers = ["lu", "mumps", "umfpack", "spooles", "superlu", "superlu_dist", "pastix", "petsc"]
 
+   # Relax the tolerances of iterative solvers, if the inexactness control is active
+   solver_parameters = inexactness.relax(solver_parameters)
+
    if backend.__name__ == "dolfin":
      # dolfin's API for expressing linear_solvers and preconditioners has changed in 1.4. Here I try
      # to support both.
@@ -4,6 +4,7 @@ import ufl
 import ufl.algorithms
 import adjglobals
 import adjlinalg
+import caching
 
 def find_previous_variable(var):
   ''' Returns the previous instance of the given variable. '''
@@ -185,6 +186,9 @@ class NonlinearRHS(RHS):
         else:
           replace_map[self.coeffs[i]] = values[j].data
 
+    if backend.parameters["adjoint"]["warm_start_replay"] and caching.replay_cache.solution(self) is not None:
+      ic = caching.replay_cache.solution(self)
+
     current_F    = backend.replace(self.F, replace_map)
     current_J    = backend.replace(self.J, replace_map)
     u = backend.Function(ic)
@@ -196,6 +200,7 @@ class NonlinearRHS(RHS):
     vec.nonlinear_u = u
     vec.nonlinear_bcs = self.bcs
     vec.nonlinear_J = current_J
+    vec.nonlinear_rhs = self
 
     return vec
 
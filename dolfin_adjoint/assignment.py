@@ -5,6 +5,8 @@ import libadjoint
 import adjlinalg
 import adjglobals
 import utils
+import tape
+import liveness
 
 def register_assign(new, old, op=None):
 
@@ -21,6 +23,9 @@ def register_assign(new, old, op=None):
   rhs = IdentityRHS(old, fn_space, op)
   register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()), linear=True)
   initial_eq = libadjoint.Equation(dep, blocks=[identity_block], targets=[dep], rhs=rhs)
+  if isinstance(old, backend.Function):
+    tape.record_copy(new, old, dep)
+  liveness.record(rhs.dependencies())
   cs = adjglobals.adjointer.register_equation(initial_eq)
 
   do_checkpoint(cs, dep, rhs)
@@ -1,6 +1,14 @@
 import re
+import hashlib
+import collections
+import threading
+import weakref
 import ufl.algorithms
-from backend import Constant
+import numpy
+import expressions
+import misc
+import backend
+from backend import Constant, Function, Expression, DirichletBC, parameters
 
 ### A general dictionary that applies a key function before lookup
 class KeyedDict(dict):
@@ -20,6 +28,27 @@ class KeyedDict(dict):
   def __contains__(self, x):
     return dict.__contains__(self, self.keyfunc(x))
 
+### Concurrent use of the caches
+
+# When the adjoint equations are solved concurrently (see scheduling.py), the caches below are
+# shared by the threads. The cached solvers keep state from one solve to the next (the
+# factorization, the operators and the initial guess), so a solve that uses a cached solver holds
+# this lock until it is done: such solves run one after the other, the others concurrently.
+lock = threading.RLock()
+
+class NoLock(object):
+  def __enter__(self):
+    pass
+
+  def __exit__(self, *args):
+    pass
+
+def lock_if(cached):
+  '''Return the lock of the caches if cached, or a lock that does nothing.'''
+  if cached:
+    return lock
+  return NoLock()
+
 ### Stuff for LU caching
 
 soa_to_adj = re.compile(r'\[(?P<func>Functional:.*?):.*\]')
@@ -47,12 +76,184 @@ def form_constants(form):
   constants = tuple([float(x) for x in ufl.algorithms.extract_coefficients(form) if isinstance(x, Constant)])
   return constants
 
-def form_key(form):
-  constants = form_constants(form)
-  return (form, constants)
+# The digests of the values of Functions, with the state of their vectors when they were computed,
+# and the digests of the dofs of boundary conditions
+function_digests = weakref.WeakKeyDictionary()
+bc_digests = weakref.WeakKeyDictionary()
+
+def vector_state(vec):
+  # The state counter of a PETSc vector, which PETSc increases whenever its values change (on all
+  # processes, for the collective changes dolfin makes), or None if it is not available.
+  try:
+    return backend.as_backend_type(vec).vec().stateGet()
+  except Exception:
+    return None
+
+def coefficient_digest(coeff):
+  # A key for the current value of a coefficient. It must be the same on all processes,
+  # as it decides whether a (collective) assembly happens.
+  if isinstance(coeff, Constant):
+    return ("Constant",) + tuple(coeff.values())
+  elif isinstance(coeff, Function):
+    vec = coeff.vector()
+    state = (id(vec), vector_state(vec))
+    try:
+      (cached_state, digest) = function_digests[coeff]
+      if state[1] is not None and cached_state == state:
+        return digest
+    except (KeyError, TypeError):
+      pass
+
+    content = hashlib.sha1(vec.array().tostring()).hexdigest()
+    if misc.size() > 1:
+      content = collective_digest(content)
+    digest = ("Function", coeff.function_space().id(), content)
+    try:
+      function_digests[coeff] = (state, digest)
+    except TypeError:
+      pass
+    return digest
+  elif isinstance(coeff, Expression):
+    attrs = expressions.expression_attrs.get(coeff, ())
+    return ("Expression", id(coeff)) + tuple((attr, repr(getattr(coeff, attr))) for attr in sorted(attrs))
+  else:
+    return (coeff.__class__.__name__, id(coeff))
+
+def collective_digest(local):
+  # Combine the digests of the local parts of a vector into one that is the same on all
+  # processes: the digest of each process, salted with its rank, is split into 32 bit words,
+  # which are summed over the processes (exactly, in double precision).
+  salted = hashlib.sha1("%d:%s" % (misc.rank(), local)).hexdigest()
+  words = [float(int(salted[i:i+8], 16)) for i in range(0, len(salted), 8)]
+  return tuple(int(misc.mpi_sum(word)) for word in words)
+
+def bc_digest(bc):
+  # The rows of an assembled matrix that a boundary condition changes depend only on its dofs,
+  # which are fixed for the lifetime of the boundary condition
+  if isinstance(bc, DirichletBC):
+    try:
+      return bc_digests[bc]
+    except (KeyError, TypeError):
+      pass
+
+    dofs = numpy.array(sorted(bc.get_boundary_values().keys()), dtype='i')
+    digest = ("DirichletBC", bc.function_space().id(), hashlib.sha1(dofs.tostring()).hexdigest())
+    try:
+      bc_digests[bc] = digest
+    except TypeError:
+      pass
+    return digest
+  else:
+    return (bc.__class__.__name__, id(bc))
+
+class AssemblyCache(object):
+  '''A cache of assembled tensors. The key of a form is its signature (which is independent
+  of the particular objects it involves) together with a digest of the values of its
+  coefficients, so that the assembly of a form rebuilt with replace on the same values
+  is found in the cache.
+
+  The cache holds at most parameters["adjoint"]["assembly_cache_size"] tensors; when it is
+  full, the least recently used tensor is evicted. The number of hits, misses and evictions
+  is recorded in the attributes of the same name.
+
+  It also remembers the signatures of the forms assembled by the user in the forward
+  model: by default, the operators of the blocks whose forms have such a signature are
+  cached on the way backwards. They are kept until the annotation is reset.'''
+
+  def __init__(self):
+    self.tensors = collections.OrderedDict()
+    self.forward_signatures = set()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def key(self, form, bcs=()):
+    return (form.signature(),
+            tuple(coefficient_digest(c) for c in ufl.algorithms.extract_coefficients(form)),
+            tuple(sorted(set(bc_digest(bc) for bc in bcs))))
+
+  def get(self, form, bcs=()):
+    '''Return the cached tensor of form with the boundary conditions bcs applied, or None.'''
+    key = self.key(form, bcs)
+    with lock:
+      try:
+        tensor = self.tensors.pop(key)
+      except KeyError:
+        self.misses += 1
+        return None
 
-assembled_fwd_forms = set()
-assembled_adj_forms = KeyedDict(keyfunc=form_key)
+      # Move the tensor to the most recently used end
+      self.tensors[key] = tensor
+      self.hits += 1
+      return tensor
+
+  def add(self, form, tensor, bcs=()):
+    key = self.key(form, bcs)
+    with lock:
+      self.tensors.pop(key, None)
+      self.tensors[key] = tensor
+
+      while len(self.tensors) > max(0, parameters["adjoint"]["assembly_cache_size"]):
+        self.tensors.popitem(last=False)
+        self.evictions += 1
+
+  def record_forward(self, form):
+    self.forward_signatures.add(form.signature())
+
+  def assembled_in_forward(self, form):
+    return form.signature() in self.forward_signatures
+
+  def statistics(self):
+    return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.tensors)}
+
+  def clear(self):
+    '''Forget the cached tensors. The signatures of the forward forms are kept, as a replay
+    of the forward model does not assemble them again.'''
+    with lock:
+      self.tensors.clear()
+
+  def forget_forward(self):
+    self.forward_signatures.clear()
+
+assembly_cache = AssemblyCache()
+
+### Stuff for warm started replays of nonlinear solves
+
+class ReplayCache(object):
+  '''Maps the NonlinearRHS of an annotated nonlinear solve to a dictionary holding the
+  solution of its last replay ("solution") and the LU factorisation of its Jacobian ("solver"),
+  which are kept across replays. Each entry costs a Function and, with
+  parameters["adjoint"]["reuse_jacobian"], a sparse LU factorisation, so at most
+  parameters["adjoint"]["replay_cache_size"] solves get an entry: the first ones to be
+  replayed. Evicting entries in a time loop, which replays its solves in the same order every
+  time, would only make the entries of later timesteps replace those of earlier ones.
+  The entries are released when the annotation is reset.'''
+
+  def __init__(self):
+    self.entries = {}
+
+  def get(self, rhs):
+    '''Return the entry of rhs, creating it if the cache is not full, or None.'''
+    with lock:
+      entry = self.entries.get(rhs)
+      if entry is None and len(self.entries) < parameters["adjoint"]["replay_cache_size"]:
+        entry = self.entries[rhs] = {}
+      return entry
+
+  def solution(self, rhs):
+    '''Return the solution of the last replay of rhs, or None.'''
+    return self.entries.get(rhs, {}).get("solution")
+
+  def clear(self):
+    with lock:
+      self.entries.clear()
+
+replay_cache = ReplayCache()
+
+### Stuff for Krylov solver reuse
+# Maps the structure of the operators of a tangent linear or adjoint Krylov solve
+# to their assembled values, the configured solver and the previous solution
+krylov_solvers = {}
 
 ### Stuff for PointIntegralSolver caching
 pis_fwd_to_tlm = {}
@@ -60,3 +261,6 @@ pis_fwd_to_adj = {}
 
 # LocalSolver Cache
 localsolvers = {}
+
+# Projection mass matrix cache
+projection_operators = {}
@@ -6,9 +6,13 @@ import adjglobals
 import backend
 import constant
 import adjresidual
+import adjlinalg
 import ufl.algorithms
 from enlisting import enlist, delist
 from numpy import ndarray
+from telemetry import telemetry
+import liveness
+import scheduling
 
 def replay_dolfin(forget=False, tol=0.0, stop=False):
 
@@ -47,13 +51,15 @@ def compute_adjoint(functional, forget=True, ignore=[]):
   for i in range(adjglobals.adjointer.timestep_count):
     adjglobals.adjointer.set_functional_dependencies(functional, i)
 
+  telemetry.count("adjoint_sweeps")
   for i in range(adjglobals.adjointer.equation_count)[::-1]:
       fwd_var = adjglobals.adjointer.get_forward_variable(i)
       if fwd_var in ignorelist:
         info("Ignoring the adjoint equation for %s" % fwd_var)
         continue
 
-      (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, functional)
+      with telemetry.phase("adjoint"):
+        (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, functional)
       if output.data:
         if backend.__name__ == "dolfin":
           output.data.rename(str(adj_var) , "a Function from dolfin-adjoint")
@@ -81,8 +87,10 @@ def compute_tlm(parameter, forget=False):
   if isinstance(parameter, (list, tuple)):
     parameter = ListControl(parameter)
 
+  telemetry.count("tlm_sweeps")
   for i in range(adjglobals.adjointer.equation_count):
-      (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, parameter)
+      with telemetry.phase("tlm"):
+        (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, parameter)
       if output.data:
         output.data.rename(str(tlm_var), "a Function from dolfin-adjoint")
 
@@ -124,42 +132,146 @@ def compute_gradient(J, param, forget=True, ignore=[], callback=lambda var, outp
   for i in range(adjglobals.adjointer.timestep_count):
     adjglobals.adjointer.set_functional_dependencies(J, i)
 
-  for i in range(adjglobals.adjointer.equation_count)[::-1]:
-    fwd_var = adjglobals.adjointer.get_forward_variable(i)
-    if fwd_var in ignorelist:
-      info("Ignoring the adjoint equation for %s" % fwd_var)
-      continue
+  # Skip the adjoint equations whose solution is zero, and free the forward values as
+  # soon as the reverse sweep is done with them
+  analysis = None
+  if liveness.active() and adjglobals.adjointer.get_checkpoint_strategy() is None:
+    analysis = liveness.LivenessAnalysis(J, param)
+
+  # Solve the adjoint equations that do not need each other concurrently, if asked to
+  levels = None
+  threads = scheduling.threads()
+  if threads > 1:
+    levels = scheduling.adjoint_levels()
+
+  telemetry.count("adjoint_sweeps")
+  with telemetry.phase("adjoint"):
+    if levels is not None:
+      dJdparam = _concurrent_adjoint_sweep(J, param, dJdparam, last_timestep, ignorelist, callback, forget, analysis, levels, threads)
+      rename(J, dJdparam, param)
+      return postprocess(dJdparam, project, list_type=enlisted_controls)
 
-    (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, J)
+    for i in range(adjglobals.adjointer.equation_count)[::-1]:
+      fwd_var = adjglobals.adjointer.get_forward_variable(i)
+      if fwd_var in ignorelist:
+        info("Ignoring the adjoint equation for %s" % fwd_var)
+        continue
 
-    callback(adj_var, output.data)
+      zero = analysis is not None and analysis.zero_adjoint(i)
+      if zero:
+        (adj_var, output) = _zero_adjoint_solution(i, J)
+      else:
+        (adj_var, output) = adjglobals.adjointer.get_adjoint_solution(i, J)
 
-    storage = libadjoint.MemoryStorage(output)
-    storage.set_overwrite(True)
-    adjglobals.adjointer.record_variable(adj_var, storage)
-    fwd_var = libadjoint.Variable(adj_var.name, adj_var.timestep, adj_var.iteration)
+      callback(adj_var, output.data)
 
-    out = param.equation_partial_derivative(adjglobals.adjointer, output.data, i, fwd_var)
-    dJdparam = _add(dJdparam, out)
+      storage = libadjoint.MemoryStorage(output)
+      storage.set_overwrite(True)
+      adjglobals.adjointer.record_variable(adj_var, storage)
+      fwd_var = libadjoint.Variable(adj_var.name, adj_var.timestep, adj_var.iteration)
 
-    if last_timestep > adj_var.timestep:
-      # We have hit a new timestep, and need to compute this timesteps' \partial J/\partial m contribution
-      out = param.functional_partial_derivative(adjglobals.adjointer, J, adj_var.timestep)
-      dJdparam = _add(dJdparam, out)
+      if not zero:
+        out = param.equation_partial_derivative(adjglobals.adjointer, output.data, i, fwd_var)
+        dJdparam = _add(dJdparam, out)
 
-    last_timestep = adj_var.timestep
+      if last_timestep > adj_var.timestep:
+        # We have hit a new timestep, and need to compute this timesteps' \partial J/\partial m contribution
+        out = param.functional_partial_derivative(adjglobals.adjointer, J, adj_var.timestep)
+        dJdparam = _add(dJdparam, out)
 
-    if forget is None:
-      pass
-    elif forget:
-      adjglobals.adjointer.forget_adjoint_equation(i)
-    else:
-      adjglobals.adjointer.forget_adjoint_values(i)
+      last_timestep = adj_var.timestep
+
+      if forget is None:
+        pass
+      elif forget:
+        adjglobals.adjointer.forget_adjoint_equation(i)
+        if analysis is not None:
+          analysis.free_after_adjoint(i)
+      else:
+        adjglobals.adjointer.forget_adjoint_values(i)
 
   rename(J, dJdparam, param)
 
   return postprocess(dJdparam, project, list_type=enlisted_controls)
 
+def _concurrent_adjoint_sweep(J, param, dJdparam, last_timestep, ignorelist, callback, forget, analysis, levels, threads):
+  '''The reverse sweep of compute_gradient, with the linear systems of the adjoint equations of
+  each level solved concurrently. The equations are assembled, and the results committed, in
+  the main thread and in the order of the sequential sweep.'''
+  adjointer = adjglobals.adjointer
+
+  def assemble(i):
+    # The adjoint solutions the liveness analysis found to be zero are not solved for: the
+    # forward values their equations need may have been freed by the replay
+    zero = analysis is not None and analysis.zero_adjoint(i)
+    if zero:
+      (adj_var, output) = _zero_adjoint_solution(i, J)
+    else:
+      (adj_var, output) = adjointer.get_adjoint_solution(i, J)
+    return (adj_var, output, zero)
+
+  results = {}
+  frontier = adjointer.equation_count - 1
+  scheduler = scheduling.AdjointScheduler(threads)
+  try:
+    for level in levels:
+      equations = []
+      for i in level:
+        fwd_var = adjointer.get_forward_variable(i)
+        if fwd_var in ignorelist:
+          info("Ignoring the adjoint equation for %s" % fwd_var)
+          results[i] = None
+        else:
+          equations.append(i)
+
+      for (i, result) in zip(equations, scheduler.assemble(assemble, equations)):
+        (adj_var, output, zero) = result
+        storage = libadjoint.MemoryStorage(output)
+        storage.set_overwrite(True)
+        adjointer.record_variable(adj_var, storage)
+        results[i] = result
+
+      # Commit the equations that the sequential sweep would have reached by now
+      while frontier >= 0 and frontier in results:
+        i = frontier
+        frontier -= 1
+        result = results.pop(i)
+        if result is None:
+          continue
+
+        (adj_var, output, zero) = result
+        callback(adj_var, output.data)
+
+        if not zero:
+          fwd_var = libadjoint.Variable(adj_var.name, adj_var.timestep, adj_var.iteration)
+          out = param.equation_partial_derivative(adjointer, output.data, i, fwd_var)
+          dJdparam = _add(dJdparam, out)
+
+        if last_timestep > adj_var.timestep:
+          out = param.functional_partial_derivative(adjointer, J, adj_var.timestep)
+          dJdparam = _add(dJdparam, out)
+
+        last_timestep = adj_var.timestep
+
+        if forget is None:
+          pass
+        elif forget:
+          adjointer.forget_adjoint_equation(i)
+          if analysis is not None:
+            analysis.free_after_adjoint(i)
+        else:
+          adjointer.forget_adjoint_values(i)
+  finally:
+    scheduler.close()
+
+  return dJdparam
+
+def _zero_adjoint_solution(i, J):
+  '''The adjoint solution of equation i, which the liveness analysis found to be zero.'''
+  fwd_var = adjglobals.adjointer.get_forward_variable(i)
+  fn_space = adjglobals.adj_variables.str_to_coeff[fwd_var.name].function_space()
+  return (fwd_var.to_adjoint(J), adjlinalg.Vector(backend.Function(fn_space)))
+
 def rename(J, dJdparam, param):
   if isinstance(dJdparam, list):
     [rename(J, dJdm, m) for (dJdm, m) in zip(dJdparam, param.controls)]
@@ -221,6 +333,7 @@ class BasicHessian(libadjoint.Matrix):
   def __call__(self, m_dot, project=False):
 
     hess_action_timer = backend.Timer("Hessian action")
+    telemetry.count("soa_sweeps")
 
     m_p = self.m.set_perturbation(m_dot)
     last_timestep = adjglobals.adjointer.timestep_count
@@ -247,7 +360,8 @@ class BasicHessian(libadjoint.Matrix):
         adj = adjglobals.adjointer.get_variable_value(adj_var)
       except (libadjoint.exceptions.LibadjointErrorHashFailed, libadjoint.exceptions.LibadjointErrorNeedValue):
         adj_timer = backend.Timer("Hessian action (ADM)")
-        adj = adjglobals.adjointer.get_adjoint_solution(i, self.J)[1]
+        with telemetry.phase("adjoint"):
+          adj = adjglobals.adjointer.get_adjoint_solution(i, self.J)[1]
         adj_timer.stop()
 
         storage = libadjoint.MemoryStorage(adj)
@@ -256,7 +370,8 @@ class BasicHessian(libadjoint.Matrix):
       adj = adj.data
 
       soa_timer = backend.Timer("Hessian action (SOA)")
-      (soa_var, soa_vec) = adjglobals.adjointer.get_soa_solution(i, self.J, m_p)
+      with telemetry.phase("soa"):
+        (soa_var, soa_vec) = adjglobals.adjointer.get_soa_solution(i, self.J, m_p)
       soa_timer.stop()
       soa = soa_vec.data
 
@@ -0,0 +1,117 @@
+"""
+A side table of the annotation metadata of assembled tensors.
+
+When a matrix or vector is assembled, dolfin-adjoint needs to remember the form it came from
+(and the boundary conditions applied to it, and for the vector of a Function, the Function
+itself), so that a later call to the lower-level :py:data:`solve(A, x, b)` can be annotated.
+Instead of attaching these as attributes to the tensors, they are kept in this table, keyed by
+the identity of the tensor. The metadata belongs to the annotation: the whole table is emptied
+by :py:func:`adj_reset`, which releases the forms, their coefficients and the boundary
+conditions of all tensors, also of those that are still alive. Before that, an entry is dropped
+as soon as its tensor is garbage collected, as the table only holds weak references to the
+tensors. While annotation is paused (i.e. parameters["adjoint"]["stop_annotating"] is set), no
+metadata is recorded at all.
+
+The Function a vector belongs to is looked up separately, as Function.vector returns a new
+wrapper of the same vector every time it is called: recording it costs a dictionary lookup
+per call, keyed by the id of the underlying vector.
+
+The metadata of a tensor is a dictionary with any of the keys
+
+  - form -- the form the tensor was assembled from
+  - bcs -- the list of boundary conditions applied to the tensor
+  - assemble_system -- whether the tensor was assembled with assemble_system
+  - function -- the Function whose vector the tensor is
+  - function_factor -- a scalar factor multiplying the Function
+"""
+
+import weakref
+import backend
+
+table = {}
+
+# Maps the ids of the vectors of Functions to the Functions
+functions = weakref.WeakValueDictionary()
+
+def active():
+  '''Whether metadata is being recorded, i.e. whether annotation is not paused.'''
+  return not backend.parameters["adjoint"]["stop_annotating"]
+
+def lookup(tensor):
+  '''Return the metadata dictionary of tensor, or None if nothing is recorded for it.'''
+  try:
+    (ref, metadata) = table[id(tensor)]
+  except KeyError:
+    return None
+
+  if ref() is not tensor:
+    return None
+  return metadata
+
+def get(tensor, key, default=None):
+  '''Return the metadata entry key of tensor, or default.'''
+  metadata = lookup(tensor)
+  if metadata is not None and key in metadata:
+    return metadata[key]
+  if key == "function":
+    function = function_of(tensor)
+    if function is not None:
+      return function
+  return default
+
+def has(tensor, key):
+  return get(tensor, key) is not None
+
+def record_function(vec, function):
+  '''Record that vec is the vector of function.'''
+  try:
+    key = vec.id()
+  except AttributeError:
+    record(vec, function=function)
+    return
+
+  if key not in functions:
+    functions[key] = function
+
+def function_of(vec):
+  '''Return the Function recorded with record_function whose vector is vec, or None.'''
+  try:
+    key = vec.id()
+  except AttributeError:
+    return None
+  return functions.get(key)
+
+def record(tensor, **kwargs):
+  '''Record metadata entries for tensor, and return its metadata dictionary.'''
+  metadata = lookup(tensor)
+
+  if metadata is None:
+    key = id(tensor)
+
+    def forget(ref, key=key):
+      if key in table and table[key][0] is ref:
+        del table[key]
+
+    metadata = {}
+    table[key] = (weakref.ref(tensor, forget), metadata)
+
+  metadata.update(kwargs)
+  return metadata
+
+def append_bc(tensor, bc):
+  bcs = record(tensor).setdefault("bcs", [])
+  bcs.append(bc)
+
+def copy(source, target):
+  '''Copy the metadata of source to target.'''
+  metadata = lookup(source)
+  if metadata is not None:
+    metadata = dict(metadata)
+    if "bcs" in metadata:
+      metadata["bcs"] = list(metadata["bcs"])
+    record(target, **metadata)
+
+def clear():
+  '''Drop all entries, when the annotation is reset.'''
+  table.clear()
+  functions.clear()
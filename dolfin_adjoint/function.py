@@ -7,6 +7,8 @@ import adjlinalg
 import adjglobals
 import utils
 import compatibility
+import tape
+import liveness
 
 dolfin_assign = backend.Function.assign
 dolfin_split  = backend.Function.split
@@ -69,6 +71,13 @@ def dolfin_adjoint_assign(self, other, annotate=None, *args, **kwargs):
     adjglobals.adj_variables.forget(self)
 
   out = dolfin_assign(self, other, *args, **kwargs)
+  annotate_assign(self, functions, weights)
+
+  return out
+
+def annotate_assign(self, functions, weights):
+  '''Annotate the assignment of the linear combination of the functions with the given
+  weights to self, which already holds the assigned value.'''
 
   fn_space = self.function_space()
   identity_block = utils.get_identity_block(fn_space)
@@ -80,12 +89,12 @@ def dolfin_adjoint_assign(self, other, annotate=None, *args, **kwargs):
   rhs = LinComRHS(functions, weights, fn_space)
   register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()), linear=True)
   initial_eq = libadjoint.Equation(dep, blocks=[identity_block], targets=[dep], rhs=rhs)
+  tape.record_assign(self, functions, weights, dep)
+  liveness.record(rhs.dependencies())
   cs = adjglobals.adjointer.register_equation(initial_eq)
 
   do_checkpoint(cs, dep, rhs)
 
-  return out
-
 def dolfin_adjoint_split(self, *args, **kwargs):
   out = dolfin_split(self, *args, **kwargs)
   for i, fn in enumerate(out):
@@ -346,12 +355,12 @@ class LinComRHS(libadjoint.RHS):
     self.deps = [adjglobals.adj_variables[function] for function in functions]
 
   def __call__(self, dependencies, values):
-    # Want to write
-    # expr = sum(weight*value.data for (weight, value) in zip(self.weights, values))
-    agh = [weight*value.data for (weight, value) in zip(self.weights, values)]
-    expr = sum(agh[1:], agh[0])
+    # Accumulate the combination directly in the vector of the output, rather than
+    # building and interpreting the expression sum(weight*value.data)
     out = backend.Function(self.fn_space)
-    out.assign(expr)
+    vec = out.vector()
+    for (weight, value) in zip(self.weights, values):
+      vec.axpy(float(weight), value.data.vector())
     return adjlinalg.Vector(out)
 
   def derivative_action(self, dependencies, values, variable, contraction_vector, hermitian):
@@ -390,7 +399,7 @@ class LinComRHS(libadjoint.RHS):
       out = (backend.inner(riesz, v)*backend.dx)
     else:
       out = backend.Function(self.fn_space)
-      out.assign(self.weights[idx] * contraction_vector.data)
+      out.vector().axpy(float(self.weights[idx]), contraction_vector.data.vector())
 
     return adjlinalg.Vector(out)
 
@@ -404,4 +413,4 @@ class LinComRHS(libadjoint.RHS):
     return self.functions
 
   def __str__(self):
-    return "LinComRHS(%s)" % str(self.dep)
+    return "LinComRHS(%s)" % str(self.deps)
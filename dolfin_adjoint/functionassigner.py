@@ -4,6 +4,9 @@ import adjglobals
 import solving
 import libadjoint
 import adjlinalg
+import misc
+import liveness
+import numpy
 
 if hasattr(backend, 'FunctionAssigner'):
   class FunctionAssigner(backend.FunctionAssigner):
@@ -14,6 +17,9 @@ if hasattr(backend, 'FunctionAssigner'):
         # The adjoint function assigner with swapped FunctionSpace arguments
         self.adj_function_assigner = backend.FunctionAssigner(args[1], args[0])
 
+        # Dof index maps for the annotated assignments, computed on demand
+        self.index_maps = {}
+
     def assign(self, receiving, giving, annotate=None):
 
       out = backend.FunctionAssigner.assign(self, receiving, giving)
@@ -37,6 +43,7 @@ if hasattr(backend, 'FunctionAssigner'):
           adjglobals.adjointer.record_variable(receiving_dep, libadjoint.MemoryStorage(adjlinalg.Vector(receiving_super)))
 
         eq = libadjoint.Equation(receiving_dep, blocks=[receiving_identity], targets=[receiving_dep], rhs=rhs)
+        liveness.record(rhs.dependencies())
         cs = adjglobals.adjointer.register_equation(eq)
 
         solving.do_checkpoint(cs, receiving_dep, rhs)
@@ -60,7 +67,32 @@ if hasattr(backend, 'FunctionAssigner'):
       self.giving_idxs     = [get_super_idx(giver) for giver in giving]
       self.giving_deps     = [adjglobals.adj_variables[giver] for giver in self.giving_supers]
 
+      # In serial, replay and derivatives are scatter/gather operations on index maps
+      # between the dofs of each giving function and the dofs of the receiving function
+      # they are assigned to. The maps are shared by all assignments of the assigner.
+      if misc.size() == 1 and hasattr(function_assigner, 'index_maps'):
+        if self.giving_list:
+          chains = [(self.receiving_idx + [i], self.giving_idxs[i]) for i in range(len(self.giving_supers))]
+        else:
+          chains = [(self.receiving_idx, self.giving_idxs[0])]
+
+        self.maps = []
+        for (giving_super, (receiving_chain, giving_chain)) in zip(self.giving_supers, chains):
+          key = (tuple(receiving_chain), tuple(giving_chain))
+          if key not in function_assigner.index_maps:
+            function_assigner.index_maps[key] = index_map(receiving_super.function_space(), receiving_chain,
+                                                          giving_super.function_space(), giving_chain)
+          self.maps.append(function_assigner.index_maps[key])
+      else:
+        self.maps = None
+
     def __call__(self, dependencies, values):
+      if self.maps is not None:
+        out = values[0].data.vector().array()
+        for ((receiving_dofs, giving_dofs), value) in zip(self.maps, values[1:]):
+          out[receiving_dofs] = value.data.vector().array()[giving_dofs]
+        return self.vector(self.receiving_super, out)
+
       receiving_super = backend.Function(values[0].data) # make a copy of the OLD value of what we're assigning to
       receiving_sub = receiving_super
       for idx in self.receiving_idx:
@@ -84,6 +116,9 @@ if hasattr(backend, 'FunctionAssigner'):
       return adjlinalg.Vector(receiving_super)
 
     def derivative_action(self, dependencies, values, variable, contraction_vector, hermitian):
+      if self.maps is not None:
+        return self.mapped_derivative_action(variable, contraction_vector, hermitian)
+
       if not hermitian:
         # FunctionAssigner.assign is linear, which makes the tangent linearisation equivalent to
         # just calling it with the right args.
@@ -122,8 +157,11 @@ if hasattr(backend, 'FunctionAssigner'):
             # Now, are we assigning all components to a mixed function, or one component to a subfunction?
             if self.giving_list:
               # We need to figure out the index of this component in order to decide what to split.
-              idx = giving_deps.index(giving_dep)
-              out = backend.Function(contraction_vector.data.sub(idx))
+              idx = self.giving_deps.index(giving_dep)
+              in_ = contraction_vector.data
+              for receiving_idx in self.receiving_idx:
+                in_ = in_.sub(receiving_idx)
+              out = backend.Function(in_.sub(idx))
               return adjlinalg.Vector(out)
 
             # OR, we were assigning to a subfunction, in which case the index
@@ -149,7 +187,7 @@ if hasattr(backend, 'FunctionAssigner'):
           # Here, the derivative is the identity for all components EXCEPT that which we've changed,
           # where it's zero.
           # If we've changed all components, the derivative is zero:
-          if self.giving_list:
+          if self.overwrites_all():
             return adjlinalg.Vector(None)
 
           # So we can call ourself with the right values, and we should get the right effect.
@@ -162,6 +200,55 @@ if hasattr(backend, 'FunctionAssigner'):
 
           return self.__call__(dependencies, new_values)
 
+    def mapped_derivative_action(self, variable, contraction_vector, hermitian):
+      c = contraction_vector.data.vector().array()
+
+      if not hermitian:
+        # Assign the contraction where it enters, and zero elsewhere. The dofs of the
+        # receiving function that are not assigned to pass on the background value.
+        if variable == self.receiving_dep:
+          out = c.copy()
+          for (receiving_dofs, giving_dofs) in self.maps:
+            out[receiving_dofs] = 0.0
+        else:
+          out = numpy.zeros(self.receiving_super.vector().local_size())
+
+        for ((receiving_dofs, giving_dofs), giving_dep) in zip(self.maps, self.giving_deps):
+          if variable == giving_dep:
+            out[receiving_dofs] = c[giving_dofs]
+
+        return self.vector(self.receiving_super, out)
+
+      else:
+        # The adjoint of a pack is a split: gather the components of the contraction that
+        # were assigned from the variable, and pass on those that were not overwritten
+        if variable == self.receiving_dep:
+          if self.overwrites_all():
+            return adjlinalg.Vector(None)
+          out = c.copy()
+          for (receiving_dofs, giving_dofs) in self.maps:
+            out[receiving_dofs] = 0.0
+          return self.vector(self.receiving_super, out)
+
+        for (giving_super, giving_dep) in zip(self.giving_supers, self.giving_deps):
+          if variable == giving_dep:
+            out = numpy.zeros(giving_super.vector().local_size())
+            for ((receiving_dofs, giving_dofs), dep) in zip(self.maps, self.giving_deps):
+              if dep == variable:
+                out[giving_dofs] += c[receiving_dofs]
+            return self.vector(giving_super, out)
+
+    def overwrites_all(self):
+      # Assigning a list of functions to the whole receiving function overwrites all of its
+      # components; assigning to a subfunction leaves the others as they were
+      return self.giving_list and len(self.receiving_idx) == 0
+
+    def vector(self, function, array):
+      out = backend.Function(function.function_space())
+      out.vector().set_local(array)
+      out.vector().apply("insert")
+      return adjlinalg.Vector(out)
+
     def dependencies(self):
       # This depends on the OLD value of the receiving function -- why?
       # Because: if we only update v.sub(0), v_new's other components
@@ -189,3 +276,25 @@ if hasattr(backend, 'FunctionAssigner'):
 
     return list(reversed(indices))
 
+
+  def index_map(receiving_space, receiving_idx, giving_space, giving_idx):
+    '''Return the arrays (receiving_dofs, giving_dofs) of the local dofs of the subspace
+    receiving_space.sub(receiving_idx[0]).sub(...) and the corresponding dofs of the subspace
+    of giving_space, so that the assignment is receiving[receiving_dofs] = giving[giving_dofs].'''
+
+    receiving_sub = receiving_space
+    for idx in receiving_idx:
+      receiving_sub = receiving_sub.sub(idx)
+    giving_sub = giving_space
+    for idx in giving_idx:
+      giving_sub = giving_sub.sub(idx)
+
+    receiving_dofmap = receiving_sub.dofmap()
+    giving_dofmap = giving_sub.dofmap()
+    ncells = receiving_space.mesh().num_cells()
+
+    receiving_dofs = numpy.concatenate([receiving_dofmap.cell_dofs(cell) for cell in range(ncells)])
+    giving_dofs = numpy.concatenate([giving_dofmap.cell_dofs(cell) for cell in range(ncells)])
+
+    (receiving_dofs, first) = numpy.unique(receiving_dofs, return_index=True)
+    return (receiving_dofs, giving_dofs[first])
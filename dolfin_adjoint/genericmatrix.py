@@ -1,12 +1,13 @@
 import dolfin
 import solving
+import formtable
 
 dolfin_genericmatrix_add = dolfin.GenericMatrix.__add__
 
 def adjoint_genericmatrix_add(self, other):
   out = dolfin_genericmatrix_add(self, other)
-  if hasattr(self, 'form') and hasattr(other, 'form'):
-    out.form = self.form + other.form
+  if formtable.active() and formtable.has(self, 'form') and formtable.has(other, 'form'):
+    formtable.record(out, form=formtable.get(self, 'form') + formtable.get(other, 'form'))
 
   return out
 
@@ -16,14 +17,15 @@ dolfin_genericmatrix_mul = dolfin.GenericMatrix.__mul__
 
 def adjoint_genericmatrix_mul(self, other):
   out = dolfin_genericmatrix_mul(self, other)
-  if hasattr(self, 'form') and isinstance(other, dolfin.GenericVector):
-    if hasattr(other, 'form'):
-      out.form = dolfin.action(self.form, other.form)
-    elif hasattr(other, 'function'):
-      if hasattr(other, 'function_factor'):
-        out.form = dolfin.action(other.function_factor*self.form, other.function)
+  if formtable.active() and formtable.has(self, 'form') and isinstance(other, dolfin.GenericVector):
+    form = formtable.get(self, 'form')
+    if formtable.has(other, 'form'):
+      formtable.record(out, form=dolfin.action(form, formtable.get(other, 'form')))
+    elif formtable.has(other, 'function'):
+      if formtable.has(other, 'function_factor'):
+        formtable.record(out, form=dolfin.action(formtable.get(other, 'function_factor')*form, formtable.get(other, 'function')))
       else:
-        out.form = dolfin.action(self.form, other.function)
+        formtable.record(out, form=dolfin.action(form, formtable.get(other, 'function')))
 
   return out
 
@@ -33,10 +35,11 @@ dolfin_genericmatrix_copy = dolfin.GenericMatrix.copy
 
 def adjoint_genericmatrix_copy(self):
   out = dolfin_genericmatrix_copy(self)
-  if hasattr(self, 'form'):
-    out.form = self.form
-  if hasattr(self, 'assemble_system'):
-    out.assemble_system = self.assemble_system
+  if formtable.active():
+    metadata = formtable.lookup(self)
+    if metadata is not None:
+      copied = dict((key, metadata[key]) for key in ('form', 'assemble_system') if key in metadata)
+      formtable.record(out, **copied)
 
   return out
 
@@ -1,14 +1,15 @@
 import dolfin
+import formtable
 
 dolfin_genericvector_neg = dolfin.GenericVector.__neg__
 
 def adjoint_genericvector_neg(self):
   out = dolfin_genericvector_neg(self)
-  if hasattr(self, 'form'):
-    out.form = -self.form
-  if hasattr(self, 'function'):
-    out.function = self.function
-    out.function_factor = -1.0
+  if formtable.active():
+    if formtable.has(self, 'form'):
+      formtable.record(out, form=-formtable.get(self, 'form'))
+    if formtable.has(self, 'function'):
+      formtable.record(out, function=formtable.get(self, 'function'), function_factor=-1.0)
 
   return out
 
@@ -1,9 +1,14 @@
 import adjglobals
 import adjlinalg
 import libadjoint
+import liveness
 import backend
 import controls
+import drivers
 import math
+import numpy
+import ufl.algorithms
+from backend import info_red
 
 def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1):
   '''This function computes the generalised stability analysis of a simulation.
@@ -95,6 +100,256 @@ def compute_propagator_matrix(gst):
 
   return mat
 
+class LowRankPropagator(object):
+  r'''A low-rank approximation
+
+  .. math::
+
+    L \approx \sum_i \sigma_i u_i v_i^*
+
+  of the propagator L, as computed by :py:func:`compute_gst_randomized`. Here
+  :math:`v_i^* x = v_i^T I x` for the norm matrix I of the input space. The
+  u_i are orthonormal in the norm of the output space and the v_i are orthonormal
+  in the norm of the input space.
+
+  The object mirrors the interface of the handle returned by :py:func:`compute_gst`:
+
+  .. code-block:: python
+
+    gst = compute_gst_randomized("State", "State", nsv=10)
+    for i in range(gst.ncv):
+      (sigma, u, v) = gst.get_gst(i, return_vectors=True)
+  '''
+
+  def __init__(self, sigma, u, v, ic, final, ic_norm, final_norm):
+    self.sigma = sigma
+    self.u = u
+    self.v = v
+    self.ic = ic
+    self.final = final
+    self.ic_norm = ic_norm
+    self.final_norm = final_norm
+    self.residuals = {}
+
+  @property
+  def ncv(self):
+    '''The number of computed singular triplets.'''
+    return len(self.sigma)
+
+  def get_gst(self, i, return_vectors=False, return_residual=False):
+    '''Return the i-th singular value, optionally with the output and input singular
+    vectors and the norm of the residual L v - sigma u. Computing the residual costs one
+    tangent linear sweep, whose result is cached.'''
+
+    retvals = [self.sigma[i]]
+    if return_vectors:
+      retvals += [self.u[i], self.v[i]]
+    if return_residual:
+      retvals.append(self.residual(i))
+
+    if len(retvals) == 1:
+      return retvals[0]
+    return retvals
+
+  def residual(self, i):
+    '''Return the norm of L v_i - sigma_i u_i in the output space.'''
+
+    if i not in self.residuals:
+      r = _tlm_action(self.ic, self.final, self.v[i]).vector()
+      r.axpy(-self.sigma[i], self.u[i].vector())
+      self.residuals[i] = self.final_norm.norm(r)
+    return self.residuals[i]
+
+  def action(self, x):
+    '''Apply the low-rank propagator to the Function x in the input space.'''
+
+    Ix = self.ic_norm.mult(x.vector())
+    coeffs = [s * v.vector().inner(Ix) for (s, v) in zip(self.sigma, self.v)]
+    return _combine(self.u, numpy.array(coeffs).reshape(-1, 1))[0]
+
+  def adjoint_action(self, y):
+    '''Apply the adjoint (with respect to the norms) of the low-rank propagator to the
+    Function y in the output space.'''
+
+    Fy = self.final_norm.mult(y.vector())
+    coeffs = [s * u.vector().inner(Fy) for (s, u) in zip(self.sigma, self.u)]
+    return _combine(self.v, numpy.array(coeffs).reshape(-1, 1))[0]
+
+def compute_gst_randomized(ic, final, nsv, ic_norm="mass", final_norm="mass", oversampling=5, power_iterations=2, seed=None, cache_factorizations=True):
+  '''This function computes the generalised stability analysis of a simulation with
+  a randomized block singular value decomposition, instead of the Krylov-Schur method
+  of SLEPc used by :py:func:`compute_gst`.
+
+  The propagator is applied to a block of nsv + oversampling random perturbations,
+  followed by power_iterations applications of its adjoint and the propagator itself to
+  sharpen the spectrum. Each application costs one tangent linear (or adjoint) sweep per
+  vector of the block, but no Krylov iteration ever waits on another: all sweeps of a block
+  linearise about the same recorded forward run, so that with cache_factorizations the
+  factorizations of the first sweep are reused by all the others. The total cost is
+  (nsv + oversampling) * (2*power_iterations + 2) sweeps.
+
+  - :py:data:`ic` -- the input of the propagator
+  - :py:data:`final` -- the output of the propagator
+  - :py:data:`nsv` -- the number of optimal perturbations to compute
+  - :py:data:`ic_norm` -- a symmetric positive-definite bilinear form that defines the norm on the input space
+  - :py:data:`final_norm` -- a symmetric positive-definite bilinear form that defines the norm on the output space
+  - :py:data:`oversampling` -- the number of additional random vectors in the block
+  - :py:data:`power_iterations` -- the number of power iterations
+  - :py:data:`seed` -- the seed of the random number generator
+  - :py:data:`cache_factorizations` -- cache the factorizations of the tangent linear and adjoint solves during the sweeps
+
+  As for :py:func:`compute_gst`, "mass" selects the mass matrix of a space and None the
+  Euclidean norm of the degrees of freedom. Returns a :py:class:`LowRankPropagator`.'''
+
+  ic_var = adjglobals.adj_variables[ic]; ic_var.c_object.timestep = 0; ic_var.c_object.iteration = 0
+  final_var = adjglobals.adj_variables[final]
+
+  ic_fnsp = adjglobals.adjointer.get_variable_value(ic_var).data.function_space()
+  final_fnsp = adjglobals.adjointer.get_variable_value(final_var).data.function_space()
+  ic_norm = _Norm(ic_fnsp, ic_norm)
+  final_norm = _Norm(final_fnsp, final_norm)
+
+  rng = numpy.random.RandomState(seed)
+  block = []
+  for j in range(nsv + oversampling):
+    x = backend.Function(ic_fnsp)
+    x.vector().set_local(rng.standard_normal(x.vector().local_size()))
+    x.vector().apply("insert")
+    block.append(x)
+
+  # The adjoint of L with respect to the norms, I^{-1} L^T F
+  def adjoint(y):
+    z = backend.Function(ic_fnsp)
+    z.vector()[:] = ic_norm.solve(_adjoint_action(ic, final_var, final_norm.mult(y.vector()), final_fnsp))
+    return z
+
+  cached = backend.parameters["adjoint"]["cache_factorizations"]
+  if cache_factorizations:
+    backend.parameters["adjoint"]["cache_factorizations"] = True
+
+  try:
+    Q = _orthonormalise([_tlm_action(ic, final_var, x) for x in block], final_norm)
+    for k in range(power_iterations):
+      Z = _orthonormalise([adjoint(q) for q in Q], ic_norm)
+      Q = _orthonormalise([_tlm_action(ic, final_var, z) for z in Z], final_norm)
+
+    # Z = L^# Q = P R with P I-orthonormal, so that Q^* L = R^T P^*
+    Z = [adjoint(q) for q in Q]
+  finally:
+    backend.parameters["adjoint"]["cache_factorizations"] = cached
+
+  P = _orthonormalise(Z, ic_norm)
+  R = _inner_products(P, Z, ic_norm)
+  (U, sigma, Wt) = numpy.linalg.svd(R.T)
+
+  nsv = min(nsv, len(sigma))
+  u = _combine(Q, U[:, :nsv])
+  v = _combine(P, Wt.T[:, :nsv])
+  return LowRankPropagator(list(sigma[:nsv]), u, v, ic, final_var, ic_norm, final_norm)
+
+class _Norm(object):
+  '''The inner product of a function space, given by an assembled matrix or the identity.'''
+
+  def __init__(self, fnsp, norm):
+    if norm == "mass":
+      u = backend.TrialFunction(fnsp)
+      v = backend.TestFunction(fnsp)
+      norm = backend.inner(u, v)*backend.dx
+    if norm is not None and not isinstance(norm, backend.GenericMatrix):
+      norm = backend.assemble(norm)
+
+    self.matrix = norm
+    self.solver = None
+
+  def mult(self, x):
+    y = x.copy()
+    if self.matrix is not None:
+      self.matrix.mult(x, y)
+    return y
+
+  def norm(self, x):
+    return math.sqrt(abs(x.inner(self.mult(x))))
+
+  def solve(self, b):
+    x = b.copy()
+    if self.matrix is not None:
+      if self.solver is None:
+        self.solver = backend.LUSolver(self.matrix)
+        self.solver.parameters["reuse_factorization"] = True
+      self.solver.solve(x, b)
+    return x
+
+class _PropagatorFunctional(libadjoint.Functional):
+  '''The linear functional J = g^T final, for a vector g in the dual of the output space.
+  An adjoint sweep for this functional applies the transpose of the propagator to g.'''
+
+  def __init__(self, var, source):
+    self.var = var
+    self.source = source
+
+  def __call__(self, adjointer, timestep, dependencies, values):
+    if self.var in dependencies:
+      return self.source.vector().inner(values[dependencies.index(self.var)].data.vector())
+    return 0.0
+
+  def derivative(self, adjointer, variable, dependencies, values):
+    if variable == self.var:
+      return adjlinalg.Vector(backend.Function(self.source))
+    return adjlinalg.Vector(None)
+
+  def dependencies(self, adjointer, timestep):
+    if timestep == self.var.timestep:
+      return [self.var]
+    return []
+
+  def __str__(self):
+    return "PropagatorFunctional(%s)" % self.var
+
+def _tlm_action(ic, final_var, x):
+  '''Apply the propagator to x with a tangent linear sweep.'''
+
+  param = controls.FunctionControl(ic, perturbation=x)
+  for (output, tlm_var) in drivers.compute_tlm(param, forget=False):
+    if (tlm_var.name, tlm_var.timestep, tlm_var.iteration) == (final_var.name, final_var.timestep, final_var.iteration):
+      return backend.Function(output)
+
+  raise libadjoint.exceptions.LibadjointErrorInvalidInputs("The propagator output %s was not found in the tangent linear sweep" % final_var)
+
+def _adjoint_action(ic, final_var, g, final_fnsp):
+  '''Apply the transpose of the propagator to the dual vector g with an adjoint sweep.'''
+
+  source = backend.Function(final_fnsp)
+  source.vector()[:] = g
+  J = _PropagatorFunctional(final_var, source)
+  dJ = drivers.compute_gradient(J, controls.FunctionControl(ic), forget=False)
+  return dJ.vector()
+
+def _inner_products(X, Y, norm):
+  NY = [norm.mult(y.vector()) for y in Y]
+  return numpy.array([[x.vector().inner(ny) for ny in NY] for x in X])
+
+def _combine(X, coeffs):
+  '''Return the linear combinations sum_i coeffs[i, j] X[i] of the Functions X.'''
+
+  out = []
+  for j in range(coeffs.shape[1]):
+    f = backend.Function(X[0].function_space())
+    for i in range(len(X)):
+      f.vector().axpy(coeffs[i, j], X[i].vector())
+    out.append(f)
+  return out
+
+def _orthonormalise(X, norm):
+  '''Orthonormalise the block of Functions X with respect to the norm,
+  dropping numerically dependent directions. Two passes of the Gram eigendecomposition
+  restore the orthogonality lost to round-off in the first.'''
+
+  for sweep in range(2):
+    (evals, evecs) = numpy.linalg.eigh(_inner_products(X, X, norm))
+    keep = evals > max(evals.max(), 0.0) * 1.0e-12
+    X = _combine(X, evecs[:, keep] / numpy.sqrt(evals[keep]))
+  return X
+
 def perturbed_replay(parameter, perturbation, perturbation_scale, observation, perturbation_norm="mass", observation_norm="mass", callback=None, forget=False):
   r"""Perturb the forward run and compute
 
@@ -189,3 +444,158 @@ def perturbed_replay(parameter, perturbation, perturbation_scale, observation, p
   else:
     return growths
 
+
+def perturbed_replay_batch(parameter, perturbations, perturbation_scale, observation, perturbation_norm="mass", observation_norm="mass", callback=None, forget=False):
+  r"""Perturb the forward run in each of a list of directions and compute
+
+  .. math::
+
+    \frac{
+    \left|\left| \delta \mathrm{observation} \right|\right|
+    }{
+    \left|\left| \delta \mathrm{input} \right| \right|
+    }
+
+  as a function of time for all of them, in a single replay of the tape.
+
+  The arguments are those of :py:func:`perturbed_replay`, except that
+
+  :py:data:`perturbations` -- a list of Functions giving the perturbation directions
+  :py:data:`callback` -- a function f(j, var, perturbed, unperturbed), called for each direction j
+
+  Each equation is fetched once and all perturbed copies are advanced through it in turn.
+  Where the operator of a linear equation does not depend on the perturbed variables, its
+  factorization is computed once and shared by all copies. The norms are computed with Gram
+  matrices that are assembled once.
+
+  As the replay proceeds, the recorded values are overwritten with perturbed ones. As for
+  :py:func:`perturbed_replay`, the forward values are kept by default; with forget=True they
+  are forgotten as soon as they are no longer needed. Only the perturbed values an equation
+  depends on are swapped in before it is solved, and each is dropped after its last use.
+
+  Returns a numpy array whose (j, n)-th entry is the growth of direction j at the n-th
+  observation.
+  """
+
+  if not backend.parameters["adjoint"]["record_all"]:
+    info_red("Warning: your replay test will be much more effective with backend.parameters['adjoint']['record_all'] = True.")
+
+  assert isinstance(parameter, controls.FunctionControl)
+
+  p_norm = _Norm(perturbations[0].function_space(), perturbation_norm)
+  o_norm = None
+  scales = [perturbation_scale/p_norm.norm(p.vector()) for p in perturbations]
+
+  # For each direction, the perturbed values of the variables computed so far
+  perturbed = [dict() for p in perturbations]
+  growths = [[] for p in perturbations]
+
+  # Where the dependencies of every equation are known, only those of the equation being
+  # solved are swapped in, and each perturbed value is dropped after its last use
+  equation_count = adjglobals.adjointer.equation_count
+  known = len(liveness.equations) == equation_count
+  last_use = {}
+  if known:
+    for (i, dependencies) in enumerate(liveness.equations):
+      for dep in dependencies:
+        last_use[_key(dep)] = i
+
+  for i in range(equation_count):
+    fwd_var = adjglobals.adjointer.get_forward_variable(i)
+    unperturbed = backend.Function(adjglobals.adjointer.get_variable_value(fwd_var).data)
+
+    if fwd_var.name == observation and o_norm is None:
+      o_norm = _Norm(unperturbed.function_space(), observation_norm)
+
+    factorization = {}
+    for (j, values) in enumerate(perturbed):
+      if fwd_var == parameter.var: # we've hit the initial condition we want to perturb
+        output = backend.Function(unperturbed)
+        output.vector().axpy(scales[j], perturbations[j].vector())
+      elif len(values) == 0:
+        # Nothing upstream of this equation is perturbed yet
+        output = unperturbed
+      else:
+        swapped = _swap_in(values, liveness.equations[i] if known else None)
+        output = _forward_solve(i, swapped, factorization)
+
+      if output is not unperturbed:
+        values[_key(fwd_var)] = (fwd_var, output)
+
+      if fwd_var.name == observation: # we've hit something we want to observe
+        diff = output.vector() - unperturbed.vector()
+        growths[j].append(o_norm.norm(diff)/perturbation_scale)
+
+      if callback is not None:
+        callback(j, fwd_var, output, unperturbed)
+
+    if known:
+      for values in perturbed:
+        for key in [key for key in values if last_use.get(key, -1) <= i]:
+          del values[key]
+
+    if forget:
+      adjglobals.adjointer.forget_forward_equation(i)
+
+  growths = numpy.array(growths)
+
+  # can happen if we initialised a nonlinear solve with a constant zero guess
+  if growths.shape[1] > 0 and (growths[:, 0] == 0.0).all():
+    return growths[:, 1:]
+  else:
+    return growths
+
+def _key(var):
+  return (var.name, var.timestep, var.iteration)
+
+def _swap_in(values, dependencies=None):
+  '''Record the perturbed values of one direction that are among the given dependencies (all
+  of them if None), dropping those the adjointer has forgotten. Returns the ids of the recorded
+  Functions.'''
+
+  if dependencies is None:
+    keys = list(values.keys())
+  else:
+    keys = [_key(dep) for dep in dependencies if _key(dep) in values]
+
+  swapped = set()
+  for key in keys:
+    (var, value) = values[key]
+    if not adjglobals.adjointer.variable_known(var):
+      del values[key]
+      continue
+
+    storage = libadjoint.MemoryStorage(adjlinalg.Vector(value))
+    storage.set_compare(tol=None)
+    storage.set_overwrite(True)
+    adjglobals.adjointer.record_variable(var, storage)
+    swapped.add(id(adjglobals.adjointer.get_variable_value(var).data))
+
+  return swapped
+
+def _forward_solve(i, swapped, factorization):
+  '''Solve the i-th forward equation with the values currently recorded. A linear operator
+  that does not depend on the swapped-in values is the same for all directions, so its
+  factorization is kept in the dictionary factorization for the next direction.'''
+
+  (fwd_var, lhs, rhs) = adjglobals.adjointer.get_forward_equation(i)
+
+  linear = isinstance(lhs.data, ufl.Form) and isinstance(rhs.data, ufl.Form) and not hasattr(rhs, 'nonlinear_form')
+  if not linear or backend.parameters["adjoint"]["symmetric_bcs"]:
+    return lhs.solve(fwd_var, rhs).data
+
+  if any(id(c) in swapped for c in ufl.algorithms.extract_coefficients(lhs.data)):
+    return lhs.solve(fwd_var, rhs).data
+
+  test = lhs.test_function()
+  if "solver" not in factorization:
+    A = backend.assemble(lhs.data)
+    [bc.apply(A) for bc in lhs.bcs]
+    factorization["solver"] = backend.LUSolver(A)
+    factorization["solver"].parameters["reuse_factorization"] = True
+
+  b = adjlinalg.wrap_assemble(rhs.data, test)
+  [bc.apply(b) for bc in lhs.bcs]
+  x = backend.Function(test.function_space())
+  factorization["solver"].solve(x.vector(), b)
+  return x
@@ -0,0 +1,140 @@
+"""
+Adaptive accuracy for the solves of replays, tangent linear and adjoint sweeps.
+
+Far from the optimum, the optimisation algorithm does not need an exact functional value or
+gradient. When the inexactness control is active, the relative tolerances of the iterative
+(Krylov and Newton) solvers recorded at annotation time are relaxed to
+
+.. math::
+
+  \\max\\left(\\mathrm{rtol}_{\\mathrm{recorded}}, \\min\\left(\\mathrm{max\\_tolerance}, \\kappa \\mu\\right)\\right),
+
+where the measure of progress :math:`\\mu` is the gradient norm relative to the first gradient
+norm (updated with every gradient computed by :py:class:`ReducedFunctionalNumPy`), or a trust
+region radius relative to the first one (updated by the user with :py:meth:`InexactnessController.update`).
+As the optimisation converges, :math:`\\mu` decreases and the tolerances are tightened
+automatically back to the recorded ones, so that the converged result does not change.
+
+.. code-block:: python
+
+  start_inexactness_control(kappa=0.1, max_tolerance=1.0e-3)
+  minimize(rf)
+  history = stop_inexactness_control()
+
+Each evaluation is recorded in the history, with the target tolerance and the relative
+tolerances the iterative solvers of its solves were actually relaxed to.
+"""
+
+import copy
+from backend import info
+
+# Direct solvers, whose accuracy cannot be relaxed
+lu_methods = ["lu", "mumps", "umfpack", "spooles", "superlu", "superlu_dist", "pastix", "petsc", "default"]
+
+# The dolfin defaults for the relative tolerances, if none were recorded
+default_tolerances = {"krylov_solver": 1.0e-6, "newton_solver": 1.0e-9}
+
+class InexactnessController(object):
+  '''Relaxes the relative tolerances of the iterative solvers according to the progress
+  of the optimisation.'''
+
+  def __init__(self):
+    self.active = False
+    self.kappa = 0.1
+    self.max_tolerance = 1.0e-3
+    self.verbose = False
+    self.reset()
+
+  def reset(self):
+    self.reference = None
+    self.measure = 1.0
+    self.history = []
+
+  def start(self, kappa=0.1, max_tolerance=1.0e-3, verbose=False):
+    self.active = True
+    self.kappa = kappa
+    self.max_tolerance = max_tolerance
+    self.verbose = verbose
+    self.reset()
+
+  def stop(self):
+    self.active = False
+
+  def update(self, gradient_norm=None, radius=None):
+    '''Update the measure of progress from a gradient norm or a trust region radius. The
+    first value passed is the reference the later values are measured against.'''
+    if not self.active:
+      return
+
+    value = gradient_norm if gradient_norm is not None else radius
+    if value is None:
+      return
+
+    if self.reference is None or self.reference == 0.0:
+      self.reference = value
+    self.measure = value / self.reference if self.reference > 0.0 else 0.0
+
+  def tolerance(self):
+    '''The relative tolerance the iterative solvers are relaxed to.'''
+    return min(self.max_tolerance, self.kappa * self.measure)
+
+  def record(self, evaluation):
+    '''Start the record of an evaluation (e.g. "replay", "adjoint" or "tlm"). The solves
+    relaxed until the next evaluation add their effective tolerances to its "solves".'''
+    if not self.active:
+      return
+
+    record = {"evaluation": evaluation, "measure": self.measure, "target_tolerance": self.tolerance(), "solves": []}
+    self.history.append(record)
+    if self.verbose:
+      info("Inexact %(evaluation)s with target relative solver tolerance %(target_tolerance)g" % record)
+
+  def relax(self, solver_parameters, nonlinear=False):
+    '''Return a copy of solver_parameters with the relative tolerances of the iterative
+    solvers relaxed. Both the solver_parameters dictionaries of solve and the flat
+    parameter dictionaries of a KrylovSolver are understood. If nonlinear is True, the
+    parameters are those of a Newton solve.'''
+    if not self.active or solver_parameters is None:
+      return solver_parameters
+
+    out = copy.deepcopy(solver_parameters)
+    target = self.tolerance()
+    # The effective relative tolerances of the solve, by solver
+    tolerances = {}
+
+    if "relative_tolerance" in out:
+      out["relative_tolerance"] = max(out["relative_tolerance"], target)
+      tolerances["krylov_solver"] = out["relative_tolerance"]
+
+    if out.get("linear_solver", "default") not in lu_methods:
+      tolerances["krylov_solver"] = self.__relax_sub(out, "krylov_solver", target)
+
+    if nonlinear or "newton_solver" in out:
+      tolerances["newton_solver"] = self.__relax_sub(out, "newton_solver", target)
+      newton = out["newton_solver"]
+      if newton.get("linear_solver", "default") not in lu_methods:
+        tolerances["newton_solver/krylov_solver"] = self.__relax_sub(newton, "krylov_solver", target)
+
+    if len(tolerances) > 0 and len(self.history) > 0:
+      self.history[-1]["solves"].append(tolerances)
+
+    return out
+
+  def __relax_sub(self, parameters, name, target):
+    sub = parameters.setdefault(name, {})
+    sub["relative_tolerance"] = max(sub.get("relative_tolerance", default_tolerances[name]), target)
+    return sub["relative_tolerance"]
+
+inexactness = InexactnessController()
+
+def start_inexactness_control(kappa=0.1, max_tolerance=1.0e-3, verbose=False):
+  '''Start relaxing the tolerances of the iterative solvers of replays, tangent linear and
+  adjoint solves to min(max_tolerance, kappa*(relative gradient norm)). Returns the
+  :py:class:`InexactnessController`.'''
+  inexactness.start(kappa, max_tolerance, verbose)
+  return inexactness
+
+def stop_inexactness_control():
+  '''Stop relaxing the solver tolerances, and return the history of the tolerances used.'''
+  inexactness.stop()
+  return inexactness.history
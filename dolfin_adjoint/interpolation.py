@@ -5,6 +5,7 @@ import ufl
 import adjglobals
 import adjlinalg
 import utils
+import liveness
 
 def interpolate(v, V, annotate=None, name=None):
   '''The interpolate call changes Function data, and so it too must be annotated so that the
@@ -35,6 +36,7 @@ def interpolate(v, V, annotate=None, name=None):
         adjglobals.adjointer.record_variable(dep, libadjoint.MemoryStorage(adjlinalg.Vector(out)))
 
       initial_eq = libadjoint.Equation(dep, blocks=[identity_block], targets=[dep], rhs=rhs)
+      liveness.record(rhs.dependencies())
       cs = adjglobals.adjointer.register_equation(initial_eq)
 
       solving.do_checkpoint(cs, dep, rhs)
@@ -6,6 +6,11 @@ import adjlinalg
 import adjglobals
 import misc
 import utils
+import formtable
+import caching
+import scheduling
+from telemetry import telemetry
+from inexactness import inexactness
 
 class KrylovSolver(dolfin.KrylovSolver):
   '''This object is overloaded so that solves using this class are automatically annotated,
@@ -54,21 +59,16 @@ class KrylovSolver(dolfin.KrylovSolver):
         x = args[0]
         b = args[1]
 
-      bcs = []
-      if hasattr(A, 'bcs'):
-        bcs += A.bcs
-      if hasattr(b, 'bcs'):
-        bcs += b.bcs
-      bcs = misc.uniq(bcs)
+      bcs = misc.uniq(formtable.get(A, 'bcs', []) + formtable.get(b, 'bcs', []))
 
-      assemble_system = A.assemble_system
+      assemble_system = formtable.get(A, 'assemble_system')
 
-      A = A.form
-      u = x.function
-      b = b.form
+      A = formtable.get(A, 'form')
+      u = formtable.get(x, 'function')
+      b = formtable.get(b, 'form')
 
       if self.operators[1] is not None:
-        P = self.operators[1].form
+        P = formtable.get(self.operators[1], 'form')
       else:
         P = None
 
@@ -118,19 +118,21 @@ class KrylovSolver(dolfin.KrylovSolver):
           else:
             operators = self.operators
 
-          solver = dolfin.KrylovSolver(*solver_parameters)
-          solver.parameters.update(parameters)
-
           if self.adjoint:
             # swap nullspaces
             (nsp_, tnsp_) = (tnsp, nsp)
           else:
             (nsp_, tnsp_) = (nsp, tnsp)
 
-          if nsp_ is not None:
-            solver.set_nullspace(nsp_)
-          if tnsp_ is not None and hasattr(solver, 'set_transpose_nullspace'):
-            solver.set_transpose_nullspace(tnsp_)
+          def make_solver():
+            solver = dolfin.KrylovSolver(*solver_parameters)
+            solver.parameters.update(inexactness.relax(parameters))
+
+            if nsp_ is not None:
+              solver.set_nullspace(nsp_)
+            if tnsp_ is not None and hasattr(solver, 'set_transpose_nullspace'):
+              solver.set_transpose_nullspace(tnsp_)
+            return solver
 
           x = dolfin.Function(fn_space)
           if self.initial_guess is not None and var.type == 'ADJ_FORWARD':
@@ -143,6 +145,14 @@ class KrylovSolver(dolfin.KrylovSolver):
           if var.type in ['ADJ_TLM', 'ADJ_ADJOINT']:
             self.bcs = [dolfin.homogenize(bc) for bc in self.bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in self.bcs if not isinstance(bc, dolfin.cpp.DirichletBC)]
 
+            # The operators of the tangent linear and adjoint solves are often the same in every
+            # timestep: reuse the assembled operators and the solver.
+            key = ('krylov', var.type, repr(solver_parameters), repr(parameters), id(nsp), id(tnsp_))
+            reuse_solve(key, operators, self.bcs, b, x, make_solver, assemble_system, tnsp_, parameters)
+            return adjlinalg.Vector(x)
+
+          solver = make_solver()
+
           # This is really hideous. Sorry.
           if isinstance(b.data, dolfin.Function):
             rhs = b.data.vector().copy()
@@ -201,6 +211,71 @@ class KrylovSolver(dolfin.KrylovSolver):
 
     return out
 
+def reuse_solve(key, operators, bcs, b, x, make_solver, assemble_system, tnsp=None, parameters=None):
+  '''Solve a tangent linear or adjoint system with the operators (A, P), reusing the assembled
+  operators and the configured solver of a previous solve with the same structure (key, the
+  form signatures and the boundary conditions) if the coefficients of the operators have not
+  changed since. The previous solution is used as the initial guess. The (homogeneous)
+  boundary conditions are applied to the right-hand side b, which is then solved for into the
+  Function x. The tolerances of the reused solver are reset from parameters.'''
+
+  op_keys = [caching.assembly_cache.key(op, bcs) for op in operators if op is not None]
+  structure = key + tuple((op_key[0], op_key[2]) for op_key in op_keys)
+  values = tuple(op_key[1] for op_key in op_keys)
+
+  with caching.lock:
+    entry = caching.krylov_solvers.get(structure)
+    if entry is not None and entry["values"] == values:
+      telemetry.count("cache_hits")
+      if dolfin.parameters["adjoint"]["debug_cache"]:
+        dolfin.info_green("Got a Krylov solver cache hit")
+    else:
+      if dolfin.parameters["adjoint"]["debug_cache"]:
+        dolfin.info_red("Got a Krylov solver cache miss")
+
+      fn_space = x.function_space()
+      if assemble_system:
+        # The boundary conditions are homogeneous, so that the right-hand side does not matter
+        zero = dolfin.inner(dolfin.Function(fn_space), dolfin.TestFunction(fn_space))*dolfin.dx
+        assembled = [dolfin.assemble_system(op, zero, bcs)[0] for op in operators if op is not None]
+      else:
+        assembled = [dolfin.assemble(op) for op in operators if op is not None]
+        [bc.apply(op) for op in assembled for bc in bcs]
+
+      solver = make_solver()
+      if len(assembled) == 2:
+        solver.set_operators(assembled[0], assembled[1])
+      else:
+        solver.set_operator(assembled[0])
+
+      guess = entry["guess"] if entry is not None else None
+      entry = {"values": values, "operators": assembled, "solver": solver, "guess": guess}
+      caching.krylov_solvers[structure] = entry
+
+    if isinstance(b.data, dolfin.Function):
+      rhs = b.data.vector().copy()
+    else:
+      rhs = dolfin.assemble(b.data)
+    [bc.apply(rhs) for bc in bcs]
+
+    if tnsp is not None:
+      tnsp.orthogonalize(rhs)
+
+  def solve():
+    solver = entry["solver"]
+    if parameters is not None:
+      solver.parameters.update(inexactness.relax(parameters))
+    if entry["guess"] is not None and "nonzero_initial_guess" in solver.parameters.keys():
+      x.vector()[:] = entry["guess"]
+      [bc.apply(x.vector()) for bc in bcs]
+      solver.parameters["nonzero_initial_guess"] = True
+
+    solver.solve(x.vector(), rhs)
+    entry["guess"] = x.vector().copy()
+
+  # The solver and the initial guess are shared with the other solves of the same structure
+  scheduling.linear_solve(solve, cached=True)
+
 def transpose_operators(operators):
   out = [None, None]
 
@@ -211,10 +286,11 @@ def transpose_operators(operators):
       out[i] = None
     elif isinstance(op, dolfin.cpp.GenericMatrix):
       out[i] = op.__class__()
-      dolfin.assemble(dolfin.adjoint(op.form), tensor=out[i])
+      dolfin.assemble(dolfin.adjoint(formtable.get(op, 'form')), tensor=out[i])
 
-      if hasattr(op, 'bcs'):
-        adjoint_bcs = [dolfin.homogenize(bc) for bc in op.bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in op.bcs if not isinstance(bc, dolfin.DirichletBC)]
+      if formtable.has(op, 'bcs'):
+        op_bcs = formtable.get(op, 'bcs')
+        adjoint_bcs = [dolfin.homogenize(bc) for bc in op_bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in op_bcs if not isinstance(bc, dolfin.DirichletBC)]
         [bc.apply(out[i]) for bc in adjoint_bcs]
 
     elif isinstance(op, dolfin.Form) or isinstance(op, ufl.form.Form):
@@ -6,6 +6,9 @@ import adjlinalg
 import adjglobals
 import misc
 import utils
+import formtable
+from krylov_solver import reuse_solve
+from inexactness import inexactness
 
 class LinearSolver(dolfin.LinearSolver):
   '''This object is overloaded so that solves using this class are automatically annotated,
@@ -49,21 +52,16 @@ class LinearSolver(dolfin.LinearSolver):
         x = args[0]
         b = args[1]
 
-      bcs = []
-      if hasattr(A, 'bcs'):
-        bcs += A.bcs
-      if hasattr(b, 'bcs'):
-        bcs += b.bcs
-      bcs = misc.uniq(bcs)
+      bcs = misc.uniq(formtable.get(A, 'bcs', []) + formtable.get(b, 'bcs', []))
 
-      assemble_system = A.assemble_system
+      assemble_system = formtable.get(A, 'assemble_system')
 
-      A = A.form
-      u = x.function
-      b = b.form
+      A = formtable.get(A, 'form')
+      u = formtable.get(x, 'function')
+      b = formtable.get(b, 'form')
 
       if self.operators[1] is not None:
-        P = self.operators[1].form
+        P = formtable.get(self.operators[1], 'form')
       else:
         P = None
 
@@ -101,15 +99,19 @@ class LinearSolver(dolfin.LinearSolver):
           else:
             operators = self.operators
 
-          solver = dolfin.LinearSolver(*solver_parameters)
-          solver.parameters.update(parameters)
+          tnsp_ = None
 
-          if nsp is not None and self.adjoint is False:
-            solver.set_nullspace(nsp)
-          if nsp is not None and self.adjoint:
-            # maybe add a LinearSolver.set_adjoint_nullspace?
-            dolfin.info_red("Warning: setting nullspace for adjoint solve to be the same for the forward solve. May not be the actual basis for the nullspace.")
-            solver.set_nullspace(nsp)
+          def make_solver():
+            solver = dolfin.LinearSolver(*solver_parameters)
+            solver.parameters.update(inexactness.relax(parameters))
+
+            if nsp is not None and self.adjoint is False:
+              solver.set_nullspace(nsp)
+            if nsp is not None and self.adjoint:
+              # maybe add a LinearSolver.set_adjoint_nullspace?
+              dolfin.info_red("Warning: setting nullspace for adjoint solve to be the same for the forward solve. May not be the actual basis for the nullspace.")
+              solver.set_nullspace(nsp)
+            return solver
 
           x = dolfin.Function(fn_space)
           if self.initial_guess is not None and var.type == 'ADJ_FORWARD':
@@ -122,6 +124,14 @@ class LinearSolver(dolfin.LinearSolver):
           if var.type in ['ADJ_TLM', 'ADJ_ADJOINT']:
             self.bcs = [dolfin.homogenize(bc) for bc in self.bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in self.bcs if not isinstance(bc, dolfin.cpp.DirichletBC)]
 
+            # The operators of the tangent linear and adjoint solves are often the same in every
+            # timestep: reuse the assembled operators and the solver.
+            key = ('linear', var.type, repr(solver_parameters), repr(parameters), id(nsp), id(tnsp_))
+            reuse_solve(key, operators, self.bcs, b, x, make_solver, assemble_system, tnsp_, parameters)
+            return adjlinalg.Vector(x)
+
+          solver = make_solver()
+
           # This is really hideous. Sorry.
           if isinstance(b.data, dolfin.Function):
             rhs = b.data.vector().copy()
@@ -187,10 +197,11 @@ def transpose_operators(operators):
       out[i] = None
     elif isinstance(op, dolfin.cpp.GenericMatrix):
       out[i] = op.__class__()
-      dolfin.assemble(dolfin.adjoint(op.form), tensor=out[i])
+      dolfin.assemble(dolfin.adjoint(formtable.get(op, 'form')), tensor=out[i])
 
-      if hasattr(op, 'bcs'):
-        adjoint_bcs = [dolfin.homogenize(bc) for bc in op.bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in op.bcs if not isinstance(bc, dolfin.DirichletBC)]
+      if formtable.has(op, 'bcs'):
+        op_bcs = formtable.get(op, 'bcs')
+        adjoint_bcs = [dolfin.homogenize(bc) for bc in op_bcs if isinstance(bc, dolfin.cpp.DirichletBC)] + [bc for bc in op_bcs if not isinstance(bc, dolfin.DirichletBC)]
         [bc.apply(out[i]) for bc in adjoint_bcs]
 
     elif isinstance(op, dolfin.Form) or isinstance(op, ufl.form.Form):
@@ -0,0 +1,178 @@
+"""
+Liveness analysis of the stored forward values.
+
+With record_all, every forward value recorded during a replay stays in memory until libadjoint
+decides it is dead on the way backwards. When parameters["adjoint"]["free_dead_values"] is set,
+dolfin-adjoint instead works out, for the given functional and controls, at which equation each
+stored forward value is last needed:
+
+  - on the replay: the last forward equation that depends on it, or the last evaluation of the
+    functional at the end of a timestep that depends on it;
+  - on the reverse sweep: the last (i.e. lowest numbered) adjoint equation that needs it. The
+    adjoint equation of the variable solved for by equation i assembles the block of equation
+    i and the derivatives of the equations that depend on that variable, and the derivative of
+    the functional at the neighbouring timesteps. The adjoint solution of a variable that the
+    functional does not depend on, directly or through the equations that depend on it, is
+    zero: its adjoint equation is not solved at all, and needs no forward values.
+
+Values that neither the functional nor the adjoint ever touch are dropped on the replay right
+after their last forward use, and the others are dropped on the reverse sweep of
+:py:func:`compute_gradient` (with forget=True) right after their last use. The values of the
+controls are always kept. Peak memory then approaches that of checkpointing, without any
+recomputation. The forward values that are dropped are not available for tangent linear or
+Hessian computations that follow the replay.
+
+The dependencies of each equation are recorded here as the equation is registered.
+"""
+
+import backend
+
+import adjglobals
+
+# The dependencies of each registered equation, in order
+equations = []
+
+# Whether the block of each registered equation depends on other variables, in which case
+# the derivative of the block also needs the value of the variable solved for
+nonlinear_blocks = []
+
+def record(dependencies, nonlinear_block=False):
+  '''Record the dependencies (the variables whose values the blocks and the right-hand side
+  need) of the equation that is about to be registered.'''
+  equations.append(list(dependencies))
+  nonlinear_blocks.append(nonlinear_block)
+
+def clear():
+  del equations[:]
+  del nonlinear_blocks[:]
+
+def active():
+  return backend.parameters["adjoint"]["free_dead_values"]
+
+def free(var):
+  '''Release the stored value of the forward variable var.'''
+  try:
+    value = adjglobals.adjointer.get_variable_value(var)
+  except Exception:
+    return
+
+  if hasattr(value, "free"):
+    value.free()
+
+class LivenessAnalysis(object):
+  '''The equations after which each stored forward value can be freed, on the replay and on the
+  reverse sweep, for a functional and its controls.'''
+
+  def __init__(self, functional, controls):
+    adjointer = adjglobals.adjointer
+
+    #: equation_count: the number of equations the analysis was made for.
+    self.equation_count = adjointer.equation_count
+
+    #: valid: whether the dependencies of every equation are known. Nothing is freed otherwise.
+    self.valid = len(equations) == self.equation_count
+
+    self.replay_frees = {}
+    self.adjoint_frees = {}
+    #: adjoint_nonzero: whether the adjoint solution of each equation can be nonzero.
+    self.adjoint_nonzero = [True] * self.equation_count
+    if not self.valid:
+      return
+
+    variables = {}
+    def name(var):
+      variables[str(var)] = var
+      return str(var)
+
+    n = self.equation_count
+    fwd = [name(adjointer.get_forward_variable(i)) for i in range(n)]
+    timesteps = [variables[fwd[i]].timestep for i in range(n)]
+    deps = [[name(dep) for dep in equations[i]] for i in range(n)]
+
+    functional_deps = {}
+    for timestep in range(adjointer.timestep_count):
+      functional_deps[timestep] = [name(dep) for dep in functional.dependencies(adjointer, timestep)]
+    observed = set(dep for timestep_deps in functional_deps.values() for dep in timestep_deps)
+
+    keep = set(str(var) for var in control_variables(controls))
+
+    # The last equation of the replay that uses each value
+    last_forward = {}
+    for i in range(n):
+      last_forward[fwd[i]] = i
+      for dep in deps[i]:
+        last_forward[dep] = i
+
+      if i == adjointer.timestep_end_equation(timesteps[i]):
+        for dep in functional_deps[timesteps[i]]:
+          last_forward[dep] = i
+
+    # The equations that depend on each value
+    dependants = {}
+    for j in range(n):
+      for dep in deps[j]:
+        if dep != fwd[j]:
+          dependants.setdefault(dep, []).append(j)
+
+    # The adjoint solution of equation i can only be nonzero if the functional depends on its
+    # variable, directly or through the equations that depend on it. The adjoints of the
+    # controls are always solved for, as they are part of the gradient.
+    for i in reversed(range(n)):
+      self.adjoint_nonzero[i] = fwd[i] in observed or fwd[i] in keep or \
+                                any(self.adjoint_nonzero[j] for j in dependants.get(fwd[i], []))
+
+    # The last equation of the reverse sweep that uses each value. Adjoint equations whose
+    # solution is zero are not solved, and use nothing.
+    last_adjoint = {}
+    for i in reversed(range(n)):
+      needed = set()
+      for timestep in (timesteps[i] - 1, timesteps[i], timesteps[i] + 1):
+        needed.update(functional_deps.get(timestep, []))
+
+      if self.adjoint_nonzero[i]:
+        # The block and right-hand side of equation i, for its adjoint and for the derivative
+        # with respect to the controls, and the derivatives of the equations that depend on
+        # its variable, which need the variable they solve for if their block is nonlinear
+        needed.update(deps[i])
+        for j in dependants.get(fwd[i], []):
+          needed.update(deps[j])
+          if nonlinear_blocks[j]:
+            needed.add(fwd[j])
+
+      for dep in needed:
+        last_adjoint[dep] = i
+
+    for (var, i) in last_forward.items():
+      if var not in last_adjoint and var not in keep:
+        self.replay_frees.setdefault(i, []).append(variables[var])
+
+    for (var, i) in last_adjoint.items():
+      if var not in keep:
+        self.adjoint_frees.setdefault(i, []).append(variables[var])
+
+  def zero_adjoint(self, i):
+    '''Whether the adjoint solution of equation i is zero, so that it need not be solved for.'''
+    return self.valid and not self.adjoint_nonzero[i]
+
+  def free_after_replay(self, i):
+    '''Free the values that are dead after equation i of the replay.'''
+    for var in self.replay_frees.get(i, []):
+      free(var)
+
+  def free_after_adjoint(self, i):
+    '''Free the forward values that are dead after the adjoint equation i.'''
+    for var in self.adjoint_frees.get(i, []):
+      free(var)
+
+def control_variables(controls):
+  '''The forward variables of the controls, whose values are never freed.'''
+  if not isinstance(controls, (list, tuple)):
+    controls = [controls]
+
+  out = []
+  for control in controls:
+    if hasattr(control, "controls"):
+      out += control_variables(control.controls)
+    elif getattr(control, "var", None) is not None:
+      out.append(control.var)
+  return out
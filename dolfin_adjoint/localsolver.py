@@ -1,4 +1,6 @@
 import dolfin
+import numpy
+import ufl.algorithms
 import solving
 import assembly
 import libadjoint
@@ -7,6 +9,8 @@ import adjlinalg
 import misc
 import utils
 import caching
+import formtable
+import scheduling
 
 class LocalSolverMatrix(adjlinalg.Matrix):
     def solve(self, var, b):
@@ -26,25 +30,159 @@ class LocalSolverMatrix(adjlinalg.Matrix):
         else:
             b_vec = dolfin.assemble(L)
 
-        # Next: if necessary, create a new solver and add to dictionary
-        idx = a.arguments()
-        if idx not in caching.localsolvers:
-            if dolfin.parameters["adjoint"]["debug_cache"]:
-                dolfin.info_red("Creating new LocalSolver")
-            newsolver = dolfin.LocalSolver(a, None, solver_type=self.solver_parameters["solver_type"])
-            if self.solver_parameters["factorize"] : newsolver.factorize()
-            caching.localsolvers[idx] = newsolver
-        else:
-            if dolfin.parameters["adjoint"]["debug_cache"]:
-                dolfin.info_green("Reusing LocalSolver")
+        # The adjoint operator is the transpose of the forward one, so undo the
+        # adjoint to share the forward factorization
+        transpose = var.type in ['ADJ_ADJOINT', 'ADJ_SOA']
+        if transpose:
+            a = dolfin.adjoint(a, reordered_arguments=ufl.algorithms.extract_arguments(a))
+
+        key = local_solver_key(a)
+        (signature, spaces, dependence) = key
+
+        if dependence == "constant":
+            # Next: if necessary, factorize the element matrices and add to dictionary. The
+            # factorization is redone when the values of the Constants have changed.
+            values = tuple(caching.coefficient_digest(c) for c in ufl.algorithms.extract_coefficients(a))
+            with caching.lock:
+                factorization = caching.localsolvers.get(key)
+                if factorization is None or factorization.values != values:
+                    if dolfin.parameters["adjoint"]["debug_cache"]:
+                        dolfin.info_red("Factorizing new local blocks")
+                    factorization = caching.localsolvers[key] = LocalFactorization(a, values)
+                else:
+                    if dolfin.parameters["adjoint"]["debug_cache"]:
+                        dolfin.info_green("Reusing local factorization")
 
-        # Get the right solver from the solver dictionary
-        solver = caching.localsolvers[idx]
-        solver.solve_local(x.vector(), b_vec, b.fn_space.dofmap())
+            # The factors are only read, so the solve does not need the lock
+            scheduling.linear_solve(lambda: factorization.solve(x.vector(), b_vec, transpose=transpose))
+        elif self.solver_parameters["factorize"]:
+            # The element matrices depend on coefficients that usually change from solve to
+            # solve (e.g. in every timestep): dolfin's LocalSolver assembles and factorizes
+            # them again when they have
+            key = ("dolfin",) + local_solver_key(self.data)
+            values = tuple(caching.coefficient_digest(c) for c in ufl.algorithms.extract_coefficients(self.data))
+            with caching.lock:
+                entry = caching.localsolvers.get(key)
+                if entry is None:
+                    solver = dolfin.LocalSolver(self.data, None, solver_type=self.solver_parameters["solver_type"])
+                    entry = caching.localsolvers[key] = {"solver": solver, "values": None}
+                if entry["values"] != values:
+                    if dolfin.parameters["adjoint"]["debug_cache"]:
+                        dolfin.info_red("Factorizing new local blocks")
+                    entry["solver"].factorize()
+                    entry["values"] = values
+                entry["solver"].solve_local(x.vector(), b_vec, b.fn_space.dofmap())
+        else:
+            # Assemble the element matrices afresh
+            solver = dolfin.LocalSolver(self.data, None, solver_type=self.solver_parameters["solver_type"])
+            solver.solve_local(x.vector(), b_vec, b.fn_space.dofmap())
 
         x_vec = adjlinalg.Vector(x)
         return x_vec
 
+def local_solver_key(a):
+    '''Return the key of a cell-local bilinear form in caching.localsolvers: its signature,
+    the function spaces of its arguments and whether it depends on coefficients other than
+    Constants ("variable") or not ("constant"). The values of the coefficients are not part
+    of the key, so that there is one factorization per form.'''
+
+    coeffs = ufl.algorithms.extract_coefficients(a)
+    if all(isinstance(c, dolfin.Constant) for c in coeffs):
+        dependence = "constant"
+    else:
+        dependence = "variable"
+
+    spaces = tuple(arg.function_space().id() for arg in ufl.algorithms.extract_arguments(a))
+    return (a.signature(), spaces, dependence)
+
+class LocalFactorization(object):
+    '''The LU factorizations (with partial pivoting) of the element matrices of a cell-local
+    bilinear form whose only coefficients are Constants, computed once for the values values.
+    The factors of all element matrices are stored in one contiguous (cells x dofs x dofs)
+    array, and the factorizations and the triangular solves with the operator or its transpose
+    are carried out for all cells at once, one row of the element matrices at a time.'''
+
+    def __init__(self, a, values):
+        (test, trial) = ufl.algorithms.extract_arguments(a)
+        mesh = test.function_space().mesh()
+        cells = [cell for cell in dolfin.cells(mesh)]
+
+        self.test_dofs = numpy.array([test.function_space().dofmap().cell_dofs(cell.index()) for cell in cells], dtype='intc')
+        self.trial_dofs = numpy.array([trial.function_space().dofmap().cell_dofs(cell.index()) for cell in cells], dtype='intc')
+
+        blocks = numpy.array([dolfin.assemble_local(a, cell) for cell in cells], dtype='d')
+        (self.lu, self.perm) = batched_lu(blocks)
+        self.values = values
+
+    def solve(self, x, b, transpose=False):
+        '''Solve A x = b, or A^T x = b if transpose, for the dolfin vectors x and b.'''
+
+        if transpose:
+            (in_dofs, out_dofs) = (self.trial_dofs, self.test_dofs)
+            solve = batched_lu_solve_transpose
+        else:
+            (in_dofs, out_dofs) = (self.test_dofs, self.trial_dofs)
+            solve = batched_lu_solve
+
+        rhs = b.get_local()[in_dofs]
+        out = numpy.zeros(x.local_size())
+        out[out_dofs] = solve(self.lu, self.perm, rhs)
+        x.set_local(out)
+        x.apply("insert")
+
+def batched_lu(A):
+    '''The LU factorizations with partial pivoting P_c A_c = L_c U_c of the stack of square
+    matrices A (of shape cells x n x n). Returns the array holding L (without its unit diagonal)
+    and U of each matrix, and the row permutations: (P_c A_c)[i] = A_c[perm[c, i]].'''
+
+    lu = numpy.array(A, dtype='d')
+    (m, n) = lu.shape[:2]
+    perm = numpy.tile(numpy.arange(n), (m, 1))
+    cells = numpy.arange(m)
+
+    for k in range(n):
+        # Swap the row with the largest pivot into row k
+        p = k + numpy.argmax(abs(lu[:, k:, k]), axis=1)
+        row = lu[cells, k, :].copy()
+        lu[cells, k, :] = lu[cells, p, :]
+        lu[cells, p, :] = row
+        index = perm[cells, k].copy()
+        perm[cells, k] = perm[cells, p]
+        perm[cells, p] = index
+
+        # Eliminate below the pivot
+        lu[:, k+1:, k] /= lu[:, k:k+1, k]
+        lu[:, k+1:, k+1:] -= lu[:, k+1:, k:k+1] * lu[:, k:k+1, k+1:]
+
+    return (lu, perm)
+
+def batched_lu_solve(lu, perm, b):
+    '''Solve A_c x_c = b_c for each row b_c of b, with the factorizations of batched_lu.'''
+
+    n = lu.shape[1]
+    x = b[numpy.arange(len(b))[:, None], perm]
+    for i in range(n):
+        x[:, i] -= numpy.einsum('cj,cj->c', lu[:, i, :i], x[:, :i])
+    for i in reversed(range(n)):
+        x[:, i] = (x[:, i] - numpy.einsum('cj,cj->c', lu[:, i, i+1:], x[:, i+1:])) / lu[:, i, i]
+    return x
+
+def batched_lu_solve_transpose(lu, perm, b):
+    '''Solve A_c^T x_c = b_c for each row b_c of b, with the factorizations of batched_lu.'''
+
+    n = lu.shape[1]
+    w = numpy.array(b, dtype='d')
+    # U^T z = b
+    for i in range(n):
+        w[:, i] = (w[:, i] - numpy.einsum('cj,cj->c', lu[:, :i, i], w[:, :i])) / lu[:, i, i]
+    # L^T w = z
+    for i in reversed(range(n)):
+        w[:, i] -= numpy.einsum('cj,cj->c', lu[:, i+1:, i], w[:, i+1:])
+    # P x = w
+    x = numpy.empty_like(w)
+    x[numpy.arange(len(w))[:, None], perm] = w
+    return x
+
 class LocalSolver(dolfin.LocalSolver):
     def __init__(self, a, L = None, solver_type = dolfin.LocalSolver.LU, **kwargs):
         dolfin.LocalSolver.__init__(self, a, L, solver_type)
@@ -57,10 +195,10 @@ class LocalSolver(dolfin.LocalSolver):
     def solve_local(self, x_vec, b_vec, b_dofmap, **kwargs):
         # Figure out whether to annotate or not
         to_annotate = utils.to_annotate(kwargs.pop("annotate", None))
-        x = x_vec.function
+        x = formtable.get(x_vec, 'function')
 
         if to_annotate:
-            L = b_vec.form
+            L = formtable.get(b_vec, 'form')
 
             # Set Matrix class for solving the adjoint systems
             solving.annotate(self.a == L, x, \
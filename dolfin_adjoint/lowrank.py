@@ -0,0 +1,207 @@
+import numpy as np
+from backend import info, Function, TestFunction, TrialFunction, LUSolver, assemble, inner, dx
+from reduced_functional import ReducedFunctional
+from reduced_functional_numpy import ReducedFunctionalNumPy, copy_data, get_global, set_local
+
+class ControlMassMatrix(object):
+    ''' The mass matrices of the controls of a reduced functional (the identity for Constant
+    controls), acting on the serialised control arrays of a :py:class:`ReducedFunctionalNumPy`.
+    This is the default prior (or preconditioner) of a :py:class:`LowRankHessian`.
+
+    A prior is any object with the methods apply(x) (the action of the prior precision),
+    solve(b) (the action of its inverse, the prior covariance) and sample(random_state)
+    (a sample of the prior distribution with zero mean). '''
+
+    def __init__(self, rf_np):
+        self.rf_np = rf_np
+
+        self.matrices = []
+        lumped = []
+        for p in rf_np.controls:
+            m = p.data()
+            if hasattr(m, "vector"):
+                V = m.function_space()
+                M = assemble(inner(TrialFunction(V), TestFunction(V))*dx)
+                solver = LUSolver(M)
+                solver.parameters["reuse_factorization"] = True
+
+                ones = Function(V)
+                ones.vector()[:] = 1.0
+                diagonal = Function(V)
+                M.mult(ones.vector(), diagonal.vector())
+
+                self.matrices.append((M, solver))
+                lumped.append(diagonal)
+            else:
+                self.matrices.append(None)
+                lumped.append(np.ones(m.value_size()))
+
+        #: lumped: the row sums of the mass matrices, as a serialised array.
+        self.lumped = get_global(lumped)
+
+    def __map(self, x, f):
+        m = [copy_data(p.data()) for p in self.rf_np.controls]
+        set_local(m, x)
+
+        out = []
+        for (mi, matrices) in zip(m, self.matrices):
+            if matrices is None:
+                out.append(mi)
+            else:
+                (M, solver) = matrices
+                y = Function(mi.function_space())
+                f(M, solver, mi.vector(), y.vector())
+                out.append(y)
+
+        return get_global(out)
+
+    def apply(self, x):
+        ''' The action of the mass matrix. '''
+        return self.__map(x, lambda M, solver, x, y: M.mult(x, y))
+
+    def solve(self, b):
+        ''' The action of the inverse of the mass matrix. '''
+        return self.__map(b, lambda M, solver, b, y: solver.solve(y, b))
+
+    def sample(self, random_state):
+        ''' A sample of the Gaussian distribution whose covariance is the inverse of the mass
+        matrix. The square root of the mass matrix is approximated by that of the lumped mass
+        matrix. '''
+        xi = random_state.standard_normal(len(self.lumped))
+        return self.solve(np.sqrt(self.lumped) * xi)
+
+class LowRankHessian(object):
+    ''' A low-rank approximation of the Hessian of a reduced functional at the current
+    control values,
+
+    .. math::
+
+        H \\approx R V \\Lambda V^T R, \\qquad V^T R V = I,
+
+    computed with a randomized (double pass) eigendecomposition of the Hessian preconditioned
+    by the prior precision (or mass matrix) R: the eigenpairs of the generalised eigenproblem
+    H v = \\lambda R v with the largest eigenvalues. Its construction costs 2*(rank + oversampling)
+    Hessian actions, that all reuse the same forward and adjoint solutions. Afterwards, the
+    approximation is applied, inverted and square-rooted at a cost of O(N*rank) operations
+    (and a solve with R for some of them), with no further PDE solves.
+
+    The arguments are
+
+      - :py:data:`rf` -- the :py:class:`ReducedFunctional` or :py:class:`ReducedFunctionalNumPy`, evaluated at the control values of interest
+      - :py:data:`rank` -- the number of eigenpairs to keep
+      - :py:data:`prior` -- the prior, by default the :py:class:`ControlMassMatrix` of the controls
+      - :py:data:`action` -- the Hessian action to approximate, a function from a serialised direction to the serialised action. By default the full Hessian of rf; pass a Gauss-Newton Hessian action to approximate that instead
+      - :py:data:`oversampling` -- the number of additional random directions
+      - :py:data:`seed` -- the seed of the random directions
+
+    It can be passed to the Newton-type optimisation algorithms instead of the exact Hessian action:
+
+    .. code-block:: python
+
+        H = LowRankHessian(rf, rank=20)
+        m_opt = minimize(rf, method="Newton-CG", hessp=H)
+
+    and, for a functional that is the negative log-likelihood of the data, it yields the
+    Gaussian approximation of the posterior:
+
+    .. code-block:: python
+
+        sample = H.posterior_sample()
+    '''
+
+    def __init__(self, rf, rank, prior=None, action=None, oversampling=10, seed=0):
+
+        if isinstance(rf, ReducedFunctional) and not isinstance(rf, ReducedFunctionalNumPy):
+            rf = ReducedFunctionalNumPy(rf)
+        self.rf_np = rf
+
+        if prior is None:
+            prior = ControlMassMatrix(rf)
+        self.prior = prior
+
+        if action is None:
+            action = lambda m_dot: rf.hessian(None, m_dot)
+
+        #: m: the control values the Hessian is approximated at.
+        self.m = rf.get_controls()
+        n = len(self.m)
+
+        self.random_state = np.random.RandomState(seed)
+        omega = self.random_state.standard_normal((n, min(rank + oversampling, n)))
+
+        # First pass: a basis for the range of R^{-1} H
+        Y = self.__columns(lambda x: prior.solve(action(x)), omega)
+        Q = self.__orthonormalise(Y)
+
+        # Second pass: the Hessian projected onto that basis
+        HQ = self.__columns(action, Q)
+        T = np.dot(Q.T, HQ)
+        (lamda, U) = np.linalg.eigh(0.5 * (T + T.T))
+
+        order = np.argsort(lamda)[::-1][:rank]
+
+        #: eigenvalues: the generalised eigenvalues, in descending order.
+        self.eigenvalues = lamda[order]
+
+        #: eigenvectors: the R-orthonormal generalised eigenvectors, as the columns of an array.
+        self.eigenvectors = np.dot(Q, U[:, order])
+        self.RV = self.__columns(prior.apply, self.eigenvectors)
+
+        info("Low-rank Hessian: eigenvalues %s" % self.eigenvalues)
+
+    def __columns(self, f, X):
+        out = np.zeros(X.shape)
+        for j in range(X.shape[1]):
+            out[:, j] = f(X[:, j])
+        return out
+
+    def __orthonormalise(self, Y):
+        # Orthonormalise the columns of Y in the R inner product, and drop the directions
+        # that are (numerically) linearly dependent
+        RY = self.__columns(self.prior.apply, Y)
+        (s, W) = np.linalg.eigh(np.dot(Y.T, RY))
+        keep = s > s.max() * 1.0e-12
+        return np.dot(Y, W[:, keep] / np.sqrt(s[keep]))
+
+    def __call__(self, m_array, m_dot_array):
+        ''' The Hessian action in direction m_dot_array, with the signature of
+        :py:meth:`ReducedFunctionalNumPy.hessian`. The Hessian is not updated if m_array
+        differs from the control values it was computed at. '''
+        return self.apply(m_dot_array)
+
+    def apply(self, x):
+        ''' The action of the approximate Hessian. '''
+        return np.dot(self.RV, self.eigenvalues * np.dot(self.RV.T, x))
+
+    def solve(self, b, shift=0.0):
+        ''' The action of the inverse of H + shift*R. With shift=1 and R the prior precision,
+        this is the action of the approximate posterior covariance. With shift=0, the
+        pseudo-inverse of the approximate Hessian is applied, and the components of b
+        outside the range of the approximation are discarded. '''
+        Vb = np.dot(self.eigenvectors.T, b)
+        if shift == 0.0:
+            lamda = self.eigenvalues
+            d = np.where(lamda != 0.0, 1.0 / np.where(lamda != 0.0, lamda, 1.0), 0.0)
+            return np.dot(self.eigenvectors, d * Vb)
+
+        d = 1.0 / (self.eigenvalues + shift) - 1.0 / shift
+        return np.dot(self.eigenvectors, d * Vb) + self.prior.solve(b) / shift
+
+    def sqrt(self, x):
+        ''' The action of the square root S of the approximate Hessian, that satisfies
+        S R^{-1} S = H. The eigenvalues must not be negative. '''
+        return np.dot(self.RV, np.sqrt(self.eigenvalues) * np.dot(self.RV.T, x))
+
+    def posterior_sample(self, mean=None, random_state=None):
+        ''' A sample of the Gaussian distribution with covariance (H + R)^{-1}, the Laplace
+        approximation of the posterior when the functional is the negative log-likelihood of
+        the data and R the precision of the prior. The mean defaults to the control values
+        the Hessian was computed at. '''
+        if mean is None:
+            mean = self.m
+        if random_state is None:
+            random_state = self.random_state
+
+        s = self.prior.sample(random_state)
+        p = 1.0 - 1.0 / np.sqrt(1.0 + self.eigenvalues)
+        return mean + s - np.dot(self.eigenvectors, p * np.dot(self.RV.T, s))
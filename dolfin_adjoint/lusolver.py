@@ -6,6 +6,9 @@ import adjglobals
 import adjlinalg
 import misc
 import utils
+import formtable
+import caching
+import scheduling
 
 lu_solvers = []
 adj_lu_solvers = []
@@ -22,21 +25,22 @@ def make_LUSolverMatrix(idx, reuse_factorization):
       else:
         bcs = self.bcs
 
-      if var.type in ['ADJ_FORWARD', 'ADJ_TLM']:
-        solver = lu_solvers[idx]
-        if solver is None:
-          A = assembly.assemble(self.data); [bc.apply(A) for bc in bcs]
-          lu_solvers[idx] = LUSolver(A)
-          lu_solvers[idx].parameters["reuse_factorization"] = True
-        solver = lu_solvers[idx]
+      with caching.lock:
+        if var.type in ['ADJ_FORWARD', 'ADJ_TLM']:
+          solver = lu_solvers[idx]
+          if solver is None:
+            A = assembly.assemble(self.data); [bc.apply(A) for bc in bcs]
+            lu_solvers[idx] = LUSolver(A)
+            lu_solvers[idx].parameters["reuse_factorization"] = True
+          solver = lu_solvers[idx]
 
-      else:
-        if adj_lu_solvers[idx] is None:
-          A = assembly.assemble(self.data); [bc.apply(A) for bc in bcs]
-          adj_lu_solvers[idx] = LUSolver(A)
-          adj_lu_solvers[idx].parameters["reuse_factorization"] = True
+        else:
+          if adj_lu_solvers[idx] is None:
+            A = assembly.assemble(self.data); [bc.apply(A) for bc in bcs]
+            adj_lu_solvers[idx] = LUSolver(A)
+            adj_lu_solvers[idx].parameters["reuse_factorization"] = True
 
-        solver = adj_lu_solvers[idx]
+          solver = adj_lu_solvers[idx]
 
       x = adjlinalg.Vector(dolfin.Function(self.test_function().function_space()))
 
@@ -52,7 +56,7 @@ def make_LUSolverMatrix(idx, reuse_factorization):
           b_vec = dolfin.assemble(b.data)
 
         [bc.apply(b_vec) for bc in bcs]
-        solver.solve(x.data.vector(), b_vec, annotate=False)
+        scheduling.linear_solve(lambda: solver.solve(x.data.vector(), b_vec, annotate=False), cached=True)
 
       return x
   return LUSolverMatrix
@@ -82,52 +86,35 @@ class LUSolver(dolfin.LUSolver):
 
     if to_annotate:
       if len(args) == 2:
-        try:
-          A = self.matrix.form
-        except AttributeError:
-          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your matrix A has to have the .form attribute: was it assembled after from dolfin_adjoint import *?")
-
-        try:
-          self.op_bcs = self.matrix.bcs
-        except AttributeError:
-          self.op_bcs = []
-
-        try:
-          x = args[0].function
-        except AttributeError:
-          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your solution x has to have a .function attribute; is it the .vector() of a Function?")
-
-        try:
-          b = args[1].form
-        except AttributeError:
-          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your RHS b has to have the .form attribute: was it assembled after from dolfin_adjoint import *?")
-
-        try:
-          eq_bcs = misc.uniq(self.op_bcs + args[1].bcs)
-        except AttributeError:
-          eq_bcs = self.op_bcs
+        A = formtable.get(self.matrix, 'form')
+        if A is None:
+          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your matrix A has to have a recorded form: was it assembled after from dolfin_adjoint import *?")
+
+        self.op_bcs = formtable.get(self.matrix, 'bcs', [])
+
+        x = formtable.get(args[0], 'function')
+        if x is None:
+          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your solution x has to have a recorded Function; is it the .vector() of a Function?")
+
+        b = formtable.get(args[1], 'form')
+        if b is None:
+          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your RHS b has to have a recorded form: was it assembled after from dolfin_adjoint import *?")
+
+        eq_bcs = misc.uniq(self.op_bcs + formtable.get(args[1], 'bcs', []))
 
       elif len(args) == 3:
-        A = args[0].form
-        try:
-          x = args[1].function
-        except AttributeError:
-          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your solution x has to have a .function attribute; is it the .vector() of a Function?")
-
-        try:
-          self.op_bcs = A.bcs
-        except AttributeError:
-          self.op_bcs = []
-
-        try:
-          b = args[2].form
-        except AttributeError:
-          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your RHS b has to have the .form attribute: was it assembled after from dolfin_adjoint import *?")
-
-        try:
-          eq_bcs = misc.uniq(self.op_bcs + args[2].bcs)
-        except AttributeError:
-          eq_bcs = self.op_bcs
+        A = formtable.get(args[0], 'form')
+        x = formtable.get(args[1], 'function')
+        if x is None:
+          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your solution x has to have a recorded Function; is it the .vector() of a Function?")
+
+        self.op_bcs = formtable.get(args[0], 'bcs', [])
+
+        b = formtable.get(args[2], 'form')
+        if b is None:
+          raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your RHS b has to have a recorded form: was it assembled after from dolfin_adjoint import *?")
+
+        eq_bcs = misc.uniq(self.op_bcs + formtable.get(args[2], 'bcs', []))
 
       else:
         raise libadjoint.exceptions.LibadjointErrorInvalidInputs("LUSolver.solve() must be called with either (A, x, b) or (x, b).")
@@ -8,6 +8,8 @@ import expressions
 import adjrhs
 import adjlinalg
 import adjglobals
+import formtable
+import liveness
 
 import hashlib
 import copy
@@ -16,19 +18,12 @@ import random
 def down_cast(*args, **kwargs):
   """When a form is assembled, the information about its nonlinear dependencies is lost,
   and it is no longer easy to manipulate. Therefore, dolfin_adjoint overloads the :py:func:`dolfin.down_cast`
-  function to *attach the form to the returned object*. This lets the automatic annotation work,
+  function to *copy the recorded form to the returned object* (see :py:mod:`formtable`). This lets the automatic annotation work,
   even when the user calls the lower-level :py:data:`solve(A, x, b)`.
   """
   dc = backend.down_cast(*args, **kwargs)
 
-  if hasattr(args[0], 'form'):
-    dc.form = args[0].form
-
-  if hasattr(args[0], 'function'):
-    dc.function = args[0].function
-
-  if hasattr(args[0], 'bcs'):
-    dc.bcs = args[0].bcs
+  formtable.copy(args[0], dc)
 
   return dc
 
@@ -113,16 +108,18 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
 
     if annotate:
       if not isinstance(A, AdjointKrylovMatrix):
-        try:
-          A = AdjointKrylovMatrix(A.form)
-        except AttributeError:
+        if not formtable.has(A, 'form'):
           raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your A has to either be an AdjointKrylovMatrix or have been assembled after backend_adjoint was imported.")
+        A = AdjointKrylovMatrix(formtable.get(A, 'form'))
 
-      if not hasattr(x, 'function'):
+      if not formtable.has(x, 'function'):
         raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your x has to come from code like down_cast(my_function.vector()).")
 
-      if not hasattr(b, 'form'):
-        raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your b has to have the .form attribute: was it assembled with from backend_adjoint import *?")
+      if not formtable.has(b, 'form'):
+        raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Your b has to have a recorded form: was it assembled with from backend_adjoint import *?")
+
+      x_fn = formtable.get(x, 'function')
+      b_bcs = formtable.get(b, 'bcs', [])
 
       if not hasattr(A, 'dependencies'):
         backend.info_red("A has no .dependencies method; assuming no nonlinear dependencies of the matrix-free operator.")
@@ -135,14 +132,14 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
       if len(dependencies) > 0:
         assert hasattr(A, "set_dependencies"), "Need a set_dependencies method to replace your values, if you have nonlinear dependencies ... "
 
-      rhs = adjrhs.RHS(b.form)
+      rhs = adjrhs.RHS(formtable.get(b, 'form'))
 
       diag_name = hashlib.md5(str(hash(A)) + str(random.random())).hexdigest()
       diag_block = libadjoint.Block(diag_name, dependencies=dependencies, test_hermitian=backend.parameters["adjoint"]["test_hermitian"], test_derivative=backend.parameters["adjoint"]["test_derivative"])
 
       solving.register_initial_conditions(zip(rhs.coefficients(),rhs.dependencies()) + zip(coeffs, dependencies), linear=False, var=None)
 
-      var = adjglobals.adj_variables.next(x.function)
+      var = adjglobals.adj_variables.next(x_fn)
 
       frozen_expressions_dict = expressions.freeze_dict()
       frozen_parameters = self.parameters.to_dict()
@@ -161,15 +158,15 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
 
         if hermitian:
           A_transpose = A.hermitian()
-          return (MatrixFree(A_transpose, fn_space=x.function.function_space(), bcs=A_transpose.bcs,
+          return (MatrixFree(A_transpose, fn_space=x_fn.function_space(), bcs=A_transpose.bcs,
                              solver_parameters=self.solver_parameters,
                              operators=transpose_operators(self.operators),
-                             parameters=frozen_parameters), adjlinalg.Vector(None, fn_space=x.function.function_space()))
+                             parameters=frozen_parameters), adjlinalg.Vector(None, fn_space=x_fn.function_space()))
         else:
-          return (MatrixFree(A, fn_space=x.function.function_space(), bcs=b.bcs,
+          return (MatrixFree(A, fn_space=x_fn.function_space(), bcs=b_bcs,
                              solver_parameters=self.solver_parameters,
                              operators=self.operators,
-                             parameters=frozen_parameters), adjlinalg.Vector(None, fn_space=x.function.function_space()))
+                             parameters=frozen_parameters), adjlinalg.Vector(None, fn_space=x_fn.function_space()))
       diag_block.assemble = diag_assembly_cb
 
       def diag_action_cb(dependencies, values, hermitian, coefficient, input, context):
@@ -200,6 +197,7 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
         diag_block.derivative_action = derivative_action
 
       eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
+      liveness.record(dependencies + rhs.dependencies(), nonlinear_block=len(dependencies) > 0)
       cs = adjglobals.adjointer.register_equation(eqn)
       solving.do_checkpoint(cs, var, rhs)
 
@@ -207,7 +205,7 @@ class AdjointPETScKrylovSolver(backend.PETScKrylovSolver):
 
     if annotate:
       if backend.parameters["adjoint"]["record_all"]:
-        adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.Vector(x.function)))
+        adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.Vector(x_fn)))
 
     timer.stop()
 
@@ -285,10 +283,11 @@ def transpose_operators(operators):
       out[i] = None
     elif isinstance(op, backend.cpp.GenericMatrix):
       out[i] = op.__class__()
-      backend.assemble(backend.adjoint(op.form), tensor=out[i])
+      backend.assemble(backend.adjoint(formtable.get(op, 'form')), tensor=out[i])
 
-      if hasattr(op, 'bcs'):
-        adjoint_bcs = [backend.homogenize(bc) for bc in op.bcs if isinstance(bc, backend.cpp.DirichletBC)] + [bc for bc in op.bcs if not isinstance(bc, backend.DirichletBC)]
+      if formtable.has(op, 'bcs'):
+        op_bcs = formtable.get(op, 'bcs')
+        adjoint_bcs = [backend.homogenize(bc) for bc in op_bcs if isinstance(bc, backend.cpp.DirichletBC)] + [bc for bc in op_bcs if not isinstance(bc, backend.DirichletBC)]
         [bc.apply(out[i]) for bc in adjoint_bcs]
 
     elif isinstance(op, backend.Form) or isinstance(op, ufl.form.Form):
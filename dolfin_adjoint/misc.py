@@ -23,3 +23,19 @@ def rank():
   except AttributeError:
     # Will be removed in DOLFIN 1.5:
     return backend.MPI.process_number()
+
+def size():
+  try:
+    # DOLFIN 1.4 and onwards
+    return backend.MPI.size(backend.mpi_comm_world())
+  except AttributeError:
+    # Will be removed in DOLFIN 1.5:
+    return backend.MPI.num_processes()
+
+def mpi_sum(value):
+  try:
+    # DOLFIN 1.4 and onwards
+    return backend.MPI.sum(backend.mpi_comm_world(), value)
+  except AttributeError:
+    # Will be removed in DOLFIN 1.5:
+    return backend.MPI.sum(value)
@@ -4,6 +4,7 @@ import libadjoint
 import adjglobals
 import adjlinalg
 import utils
+import formtable
 
 class NewtonSolver(dolfin.NewtonSolver):
   '''This object is overloaded so that solves using this class are automatically annotated,
@@ -23,10 +24,10 @@ class NewtonSolver(dolfin.NewtonSolver):
 
       factory.F(b=b, x=vec)
 
-      F = b.form
-      bcs = b.bcs
+      F = formtable.get(b, 'form')
+      bcs = formtable.get(b, 'bcs', [])
 
-      u = vec.function
+      u = formtable.get(vec, 'function')
       var = adjglobals.adj_variables[u]
 
       solving.annotate(F == 0, u, bcs, solver_parameters={"newton_solver": self.parameters.to_dict()})
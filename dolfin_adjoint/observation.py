@@ -0,0 +1,290 @@
+import libadjoint
+import backend
+import hashlib
+import numpy
+
+import adjglobals
+import adjlinalg
+import misc
+from functional import Functional, _time_levels
+from timeforms import FinishTimeConstant
+
+class ObservationFunctional(Functional):
+  '''This class implements a data misfit functional for pointwise observations of a field,
+  such as gauge time series:
+
+  .. math::
+
+    J = \\frac{1}{2} \\sum_k \\sum_i w_{ki} \\left( u(x_i, t_k) - d_{ki} \\right)^2
+
+  The interpolation from the degrees of freedom of the field to the observation locations
+  is precomputed as a sparse matrix H, so that evaluating the misfit and its derivatives
+  costs sparse matrix-vector products instead of form assemblies. Observation times that
+  fall between time levels are interpolated linearly in time.
+
+  The arguments are
+
+    - :py:data:`u` -- the observed Function
+    - :py:data:`points` -- the observation locations, as an array of shape (number of locations, geometric dimension)
+    - :py:data:`times` -- the observation times. FINISH_TIME may be used for the end of the simulation
+    - :py:data:`data` -- the observed values, as an array of shape (number of times, number of locations)
+    - :py:data:`weights` -- the weights w, a scalar or an array that broadcasts against data
+
+  For example:
+
+  .. code-block:: python
+
+    J = ObservationFunctional(u, gauges, times, measurements)
+    rf = ReducedFunctional(J, Control(m))
+
+  It can be combined with ordinary functionals, e.g. for regularisation:
+
+  .. code-block:: python
+
+    J = ObservationFunctional(u, gauges, times, measurements) + Functional(alpha*inner(grad(m), grad(m))*dx*dt[START_TIME])
+
+  The field must be scalar-valued, and the functional is only implemented in serial.'''
+
+  def __init__(self, u, points, times, data, weights=1.0, name=None):
+
+    if misc.size() > 1:
+      raise NotImplementedError, "ObservationFunctional is only implemented in serial"
+
+    self.u = u
+    self.points = numpy.array(points, dtype='d').reshape(-1, u.function_space().mesh().geometry().dim())
+    self.times = list(times)
+    self.data = numpy.array(data, dtype='d').reshape(len(self.times), len(self.points))
+    self.weights = numpy.ones(self.data.shape) * weights
+    self.name = name
+    self.verbose = False
+
+    #: H: the sparse interpolation matrix from the degrees of freedom of u to the observation locations.
+    self.H = interpolation_matrix(u.function_space(), self.points)
+    self.HT = self.H.T.tocsr()
+
+  def __add__(self, other):
+    return FunctionalSum([self, other])
+
+  def __radd__(self, other):
+    return FunctionalSum([other, self])
+
+  def __mul__(self, factor):
+    return ObservationFunctional(self.u, self.points, self.times, self.data, factor * self.weights, self.name)
+
+  __rmul__ = __mul__
+
+  def __div__(self, factor):
+    return self * (1.0 / factor)
+
+  def __neg__(self):
+    return self * -1.0
+
+  def __call__(self, adjointer, timestep, dependencies, values):
+
+    value = 0.0
+    for (k, theta, start, end) in self._observations(adjointer, timestep):
+      r = self._residual(k, theta, start, end, dependencies, values)
+      value += 0.5 * numpy.dot(self.weights[k] * r, r)
+
+    return value
+
+  def derivative(self, adjointer, variable, dependencies, values):
+
+    g = numpy.zeros(self.H.shape[1])
+    for timestep in self._derivative_timesteps(adjointer, variable):
+      for (k, theta, start, end) in self._observations(adjointer, timestep):
+        factor = self._factor(variable, theta, start, end)
+        if factor != 0.0:
+          r = self._residual(k, theta, start, end, dependencies, values)
+          g += factor * self.HT.dot(self.weights[k] * r)
+
+    return self._dual(g)
+
+  def second_derivative(self, adjointer, variable, dependencies, values, contraction):
+
+    if contraction.data is None:
+      return adjlinalg.Vector(None)
+
+    c = self.H.dot(contraction.data.vector().array())
+    g = numpy.zeros(self.H.shape[1])
+    for timestep in self._derivative_timesteps(adjointer, variable):
+      for (k, theta, start, end) in self._observations(adjointer, timestep):
+        factor = self._factor(variable, theta, start, end)
+        if factor != 0.0:
+          g += factor**2 * self.HT.dot(self.weights[k] * c)
+
+    return self._dual(g)
+
+  def dependencies(self, adjointer, timestep):
+
+    deps = {}
+    for (k, theta, start, end) in self._observations(adjointer, timestep):
+      if theta != 0.0:
+        deps[str(start)] = start
+      if theta != 1.0:
+        deps[str(end)] = end
+
+    return deps.values()
+
+  def get_form(self, adjointer, timestep):
+    # The misfit does not depend explicitly on any control
+    return None
+
+  def _observations(self, adjointer, timestep):
+    '''Return a list (k, theta, start, end) of the observations that belong to the given
+    timestep: the index k of the observation time, and the variables at the start and end
+    of the timestep, whose values are weighted with theta and 1 - theta.'''
+
+    if not adjointer.variable_known(adjglobals.adj_variables[self.u]):
+      return []
+
+    (start, end) = self.get_vars(adjointer, timestep, adjglobals.adj_variables[self.u].copy())
+    (t_start, t_end) = _time_levels(adjointer, timestep)
+    last = timestep == adjointer.timestep_count - 1
+
+    observations = []
+    for (k, t) in enumerate(self.times):
+      if isinstance(t, FinishTimeConstant):
+        if last:
+          observations.append((k, 0.0, start, end))
+      elif t_start < t <= t_end or (timestep == 0 and t == t_start):
+        theta = float(t_end - t)/float(t_end - t_start) if t_end != t_start else 0.0
+        observations.append((k, theta, start, end))
+
+    return observations
+
+  def _residual(self, k, theta, start, end, dependencies, values):
+    names = [str(dep) for dep in dependencies]
+
+    u = numpy.zeros(self.H.shape[1])
+    if theta != 0.0:
+      u += theta * values[names.index(str(start))].data.vector().array()
+    if theta != 1.0:
+      u += (1.0 - theta) * values[names.index(str(end))].data.vector().array()
+
+    return self.H.dot(u) - self.data[k]
+
+  def _factor(self, variable, theta, start, end):
+    factor = 0.0
+    if str(variable) == str(start):
+      factor += theta
+    if str(variable) == str(end):
+      factor += 1.0 - theta
+    return factor
+
+  def _dual(self, g):
+    out = backend.Function(self.u.function_space())
+    out.vector().set_local(g)
+    out.vector().apply("insert")
+    return adjlinalg.Vector(out)
+
+  def __str__(self):
+    if self.name is not None:
+      return "Functional:" + self.name
+    else:
+      return "Functional:" + hashlib.md5(str(self.u) + self.points.tostring() + self.data.tostring() + self.weights.tostring()).hexdigest()
+
+class FunctionalSum(Functional):
+  '''The sum of several functionals, for combining an :py:class:`ObservationFunctional`
+  with other functionals.'''
+
+  def __init__(self, terms, name=None):
+    self.terms = []
+    for term in terms:
+      if isinstance(term, FunctionalSum):
+        self.terms += term.terms
+      else:
+        self.terms.append(term)
+    self.name = name
+    self.verbose = False
+
+  def __add__(self, other):
+    return FunctionalSum([self, other])
+
+  def __radd__(self, other):
+    return FunctionalSum([other, self])
+
+  def __mul__(self, factor):
+    return FunctionalSum([factor * term for term in self.terms], self.name)
+
+  __rmul__ = __mul__
+
+  def __div__(self, factor):
+    return self * (1.0 / factor)
+
+  def __neg__(self):
+    return self * -1.0
+
+  def __call__(self, adjointer, timestep, dependencies, values):
+    return sum(term(adjointer, timestep, dependencies, values) for term in self.terms)
+
+  def derivative(self, adjointer, variable, dependencies, values):
+    out = adjlinalg.Vector(None)
+    for term in self._depending_terms(adjointer, variable):
+      out.axpy(1.0, term.derivative(adjointer, variable, dependencies, values))
+    return out
+
+  def second_derivative(self, adjointer, variable, dependencies, values, contraction):
+    out = adjlinalg.Vector(None)
+    for term in self._depending_terms(adjointer, variable):
+      out.axpy(1.0, term.second_derivative(adjointer, variable, dependencies, values, contraction))
+    return out
+
+  def dependencies(self, adjointer, timestep):
+    deps = {}
+    for term in self.terms:
+      for dep in term.dependencies(adjointer, timestep):
+        deps[str(dep)] = dep
+    return deps.values()
+
+  def get_form(self, adjointer, timestep):
+    form = None
+    for term in self.terms:
+      term_form = term.get_form(adjointer, timestep)
+      if term_form is not None:
+        form = term_form if form is None else form + term_form
+    return form
+
+  def _depending_terms(self, adjointer, variable):
+    # The derivative of a Functional complains if it does not depend on the variable
+    return [term for term in self.terms
+            if any(str(variable) in [str(dep) for dep in term.dependencies(adjointer, timestep)]
+                   for timestep in term._derivative_timesteps(adjointer, variable))]
+
+  def __str__(self):
+    if self.name is not None:
+      return "Functional:" + self.name
+    else:
+      return "Functional:" + hashlib.md5(" ".join(str(term) for term in self.terms)).hexdigest()
+
+def interpolation_matrix(V, points):
+  '''Return the sparse matrix that maps the degrees of freedom of a Function in the scalar
+  function space V to its values at the given points.'''
+
+  import scipy.sparse
+
+  if V.element().value_rank() != 0:
+    raise libadjoint.exceptions.LibadjointErrorNotImplemented("Observations are only implemented for scalar function spaces")
+
+  mesh = V.mesh()
+  tree = mesh.bounding_box_tree()
+  element = V.element()
+  dofmap = V.dofmap()
+
+  rows = []
+  cols = []
+  vals = []
+  for (i, x) in enumerate(points):
+    cell_index = tree.compute_first_entity_collision(backend.Point(*x))
+    if cell_index >= mesh.num_cells():
+      raise ValueError("Observation location %s is outside the mesh" % (x,))
+
+    cell = backend.Cell(mesh, cell_index)
+    basis = element.evaluate_basis_all(x, cell.get_vertex_coordinates(), cell.orientation())
+    dofs = dofmap.cell_dofs(cell_index)
+
+    rows += [i] * len(dofs)
+    cols += list(dofs)
+    vals += list(basis)
+
+  return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(points), V.dim()))
@@ -3,6 +3,7 @@ that can be used with different optimisation algorithms."""
 
 import numpy
 import backend
+from ..utils import gather
 if backend.__name__  == "dolfin":
   from backend import cpp
 
@@ -23,6 +24,33 @@ class Constraint(object):
 
     raise NotImplementedError, "Constraint.jacobian not implemented"
 
+  def sparse_jacobian(self, m):
+    """Returns the Jacobian of c(m) with respect to the parameter m as a sparse matrix with
+       one row per constraint component and one column per (global) control degree of freedom.
+
+       The matrix may be a scipy.sparse matrix (e.g. in COO or CSR format) or an assembled
+       dolfin GenericMatrix. Its sparsity pattern must not depend on m. If this is not
+       implemented, the dense Jacobian returned by jacobian is used instead."""
+
+    raise NotImplementedError, "Constraint.sparse_jacobian not implemented"
+
+  def coo_jacobian(self, m):
+    """Returns the gathered Jacobian in coordinate format, as a tuple (rows, cols, values)
+       of numpy arrays."""
+
+    try:
+      jac = self.sparse_jacobian(m)
+    except NotImplementedError:
+      jac = numpy.array(gather(self.jacobian(m)), dtype=float)
+      if jac.ndim == 1:
+        jac = jac.reshape(1, -1)
+      (nrows, ncols) = jac.shape
+      rows = numpy.repeat(numpy.arange(nrows), ncols)
+      cols = numpy.tile(numpy.arange(ncols), nrows)
+      return (rows, cols, jac.ravel())
+
+    return sparse_to_coo(jac)
+
   def jacobian_action(self, m, dm, result):
     """Computes the Jacobian action of c(m) in direction dm and stores the result in result. """
 
@@ -72,6 +100,35 @@ class InequalityConstraint(Constraint):
   for 0 <= i < n, where m is the parameter.
   """
 
+def sparse_to_coo(jac):
+  """Converts a scipy.sparse matrix or an assembled GenericMatrix into a gathered
+  coordinate representation (rows, cols, values)."""
+
+  if hasattr(jac, "tocoo"):
+    coo = jac.tocoo()
+    return (numpy.asarray(coo.row, dtype=int), numpy.asarray(coo.col, dtype=int),
+            numpy.asarray(coo.data, dtype=float))
+
+  if backend.__name__ == "dolfin" and isinstance(jac, cpp.GenericMatrix):
+    rows = []; cols = []; vals = []
+    (row_begin, row_end) = jac.local_range(0)
+    for row in range(row_begin, row_end):
+      (row_cols, row_vals) = jac.getrow(row)
+      rows += [row] * len(row_cols)
+      cols += list(row_cols)
+      vals += list(row_vals)
+
+    if backend.MPI.size(backend.mpi_comm_world()) > 1:
+      from mpi4py import MPI
+      comm = MPI.COMM_WORLD
+      rows = sum(comm.allgather(rows), [])
+      cols = sum(comm.allgather(cols), [])
+      vals = sum(comm.allgather(vals), [])
+
+    return (numpy.array(rows, dtype=int), numpy.array(cols, dtype=int), numpy.array(vals, dtype=float))
+
+  raise TypeError, "Unknown sparse Jacobian type %s" % jac.__class__
+
 numpify = lambda x: numpy.array(x) if isinstance(x, list) else x
 
 class MergedConstraints(Constraint):
@@ -84,6 +141,22 @@ class MergedConstraints(Constraint):
   def jacobian(self, m):
     return [c.jacobian(m) for c in self.constraints]
 
+  def coo_jacobian(self, m):
+    rows = []; cols = []; vals = []
+    offset = 0
+    for c in self.constraints:
+      (c_rows, c_cols, c_vals) = c.coo_jacobian(m)
+      rows.append(c_rows + offset)
+      cols.append(c_cols)
+      vals.append(c_vals)
+      offset += c._get_constraint_dim()
+
+    if len(rows) == 0:
+      empty = numpy.array([], dtype=int)
+      return (empty, empty, numpy.array([], dtype=float))
+
+    return (numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(vals))
+
   def jacobian_action(self, m, dm, result):
     [c.jacobian_action(m, dm, result[i]) for (i, c) in enumerate(self.constraints)]
 
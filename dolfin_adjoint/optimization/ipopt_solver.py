@@ -2,9 +2,9 @@ from optimization_solver import OptimizationSolver
 from optimization_problem import MaximizationProblem
 from ..reduced_functional_numpy import ReducedFunctionalNumPy
 import constraints
+from optimization_checkpoint import OptimizationCheckpoint
 from ..misc import rank
 from ..enlisting import delist
-from ..utils import gather
 
 import backend
 import numpy
@@ -33,11 +33,9 @@ class IPOPTSolver(OptimizationSolver):
         from functools import partial
 
         self.rfn = ReducedFunctionalNumPy(self.problem.reduced_functional)
-        ncontrols = len(self.rfn.get_controls())
 
         (lb, ub) = self.__get_bounds()
-        (nconstraints, fun_g, jac_g, clb, cub) = self.__get_constraints()
-        constraints_nnz = nconstraints * ncontrols
+        (nconstraints, constraints_nnz, fun_g, jac_g, clb, cub) = self.__get_constraints()
 
         # A callback that evaluates the functional and derivative.
         J  = self.rfn.__call__
@@ -126,6 +124,7 @@ class IPOPTSolver(OptimizationSolver):
         if constraint is None:
             # The length of the constraint vector
             nconstraints = 0
+            constraints_nnz = 0
 
             # The bounds for the constraint
             empty = numpy.array([], dtype=float)
@@ -145,7 +144,7 @@ class IPOPTSolver(OptimizationSolver):
                 else:
                     return empty
 
-            return (nconstraints, fun_g, jac_g, clb, cub)
+            return (nconstraints, constraints_nnz, fun_g, jac_g, clb, cub)
 
         else:
             # The length of the constraint vector
@@ -156,20 +155,30 @@ class IPOPTSolver(OptimizationSolver):
             def fun_g(x, user_data=None):
                 return numpy.array(constraint.function(x))
 
+            # The sparsity pattern of the constraint Jacobian. Constraints that
+            # implement sparse_jacobian report their true nonzeros, all others
+            # are treated as dense blocks.
+            (rows, cols, vals) = constraint.coo_jacobian(self.rfn.get_controls())
+            pattern = numpy.unique(rows * ncontrols + cols)
+            constraints_nnz = len(pattern)
+
             # The constraint Jacobian:
             # flag = True  means 'tell me the sparsity pattern';
             # flag = False means 'give me the damn Jacobian'.
             def jac_g(x, flag, user_data=None):
                 if flag:
-                    # FIXME: Don't have any sparsity information on constraints;
-                    # pass in a dense matrix (it usually is anyway).
-                    rows = []
-                    for i in range(nconstraints):
-                        rows += [i] * ncontrols
-                    cols = range(ncontrols) * nconstraints
-                    return (numpy.array(rows), numpy.array(cols))
+                    return (pattern // ncontrols, pattern % ncontrols)
                 else:
-                  return numpy.array(gather(constraint.jacobian(x)))
+                    (rows, cols, vals) = constraint.coo_jacobian(x)
+                    idx = numpy.searchsorted(pattern, rows * ncontrols + cols)
+                    if len(idx) > 0 and (idx.max() >= len(pattern) or
+                                         (pattern[idx] != rows * ncontrols + cols).any()):
+                        raise ValueError("The sparsity pattern of the constraint Jacobian must not change.")
+
+                    # Sum duplicate entries, as usual for the coordinate format
+                    jac = numpy.zeros(len(pattern))
+                    numpy.add.at(jac, idx, vals)
+                    return jac
 
             # The bounds for the constraint: by the definition of our
             # constraint type, the lower bound is always zero,
@@ -185,7 +194,7 @@ class IPOPTSolver(OptimizationSolver):
                     return [numpy.inf] * c._get_constraint_dim()
             cub = numpy.array(sum([constraint_ub(c) for c in constraint], []))
 
-            return (nconstraints, fun_g, jac_g, clb, cub)
+            return (nconstraints, constraints_nnz, fun_g, jac_g, clb, cub)
 
     def __set_parameters(self):
         """Set some basic parameters from the parameters dictionary that the user
@@ -219,10 +228,25 @@ class IPOPTSolver(OptimizationSolver):
         else:
             raise TypeError, 'Unknown control type %s.' % str(type(m))
 
-    def solve(self):
-        """Solve the optimization problem and return the optimized controls."""
+    def solve(self, checkpoint=None, resume=False, checkpoint_period=1, checkpoint_history=10):
+        """Solve the optimization problem and return the optimized controls.
+
+        If checkpoint is a filename, the optimizer state is checkpointed to that file
+        every checkpoint_period iterations, keeping the latest checkpoint_history
+        evaluations. If resume is True, the optimisation is restarted from that
+        checkpoint without repeating the forward and adjoint solves recorded in it."""
         guess = self.rfn.get_controls()
+
+        if checkpoint is not None:
+            self.rfn.checkpoint = OptimizationCheckpoint(checkpoint, resume=resume, period=checkpoint_period, history=checkpoint_history)
+            guess = self.rfn.checkpoint.start(guess)
+
         results = self.pyipopt_problem.solve(guess)
+
+        if checkpoint is not None:
+            self.rfn.checkpoint.save()
+            self.rfn.checkpoint = None
+
         new_params = [self.__copy_data(p.data()) for p in self.rfn.controls]
         self.rfn.set_local(new_params, results[0])
 
@@ -0,0 +1,203 @@
+import multiprocessing
+import Queue
+import os
+import time
+import traceback
+import numpy as np
+from backend import info, info_red
+from optimization import minimize
+from ..reduced_functional_numpy import ReducedFunctionalNumPy
+from ..reduced_functional import ReducedFunctional
+
+class MultistartCancelled(Exception):
+    ''' Raised inside a worker to abandon a run that has fallen behind the best run. '''
+    pass
+
+def minimize_multistart(setup, initial_guesses, processes=None, method='L-BFGS-B',
+                        callback=None, cancel_tolerance=None, cancel_after=5, timeout=None, **kwargs):
+    ''' Runs minimize from a number of initial guesses on a pool of worker processes.
+
+        The function arguments are as follows:
+        * 'setup' is a function without arguments that is called exactly once in each worker process.
+          It must run the forward model (and hence create the annotation) and return the ReducedFunctional
+          (or ReducedFunctionalNumPy) to be minimised.
+        * 'initial_guesses' is a list of numpy arrays, each containing the serialised control values of
+          one start point (as returned by ReducedFunctionalNumPy.get_controls).
+        * 'processes' is the number of worker processes (default: the number of cores).
+        * 'method' and any additional keyword arguments are passed to minimize.
+        * 'callback' is an optional function callback(i, j, best_j) that is called in the parent process
+          for every functional evaluation j of the run from start point i, with the best value found so far.
+        * If 'cancel_tolerance' is not None, a run is cancelled after 'cancel_after' functional evaluations
+          once its current value exceeds the best value of all runs by more than cancel_tolerance*|best value|.
+        * If 'timeout' is not None, the workers are terminated and an exception is raised when none of them
+          has reported anything for timeout seconds.
+
+        Each worker annotates the model once and then processes start points as they become available.
+        The start points are handed out to idle workers, so that fast runs do not wait for slow ones.
+        A run whose worker process dies (e.g. of a segmentation fault) is reported as failed.
+        This function must be called from a serial (non-MPI) run.
+
+        Returns a list with one entry per initial guess, in order. Each entry is a dictionary with the keys
+        "value" (the lowest functional value found), "controls" (the associated control array),
+        "evaluations", "status" and "message". The status is "converged" or "not converged" according to
+        the result of the optimisation algorithm (whose message is passed on), "finished" for algorithms
+        that do not report whether they converged, "cancelled" or "failed".
+        '''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(initial_guesses)))
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    best = multiprocessing.Value('d', np.inf)
+
+    for (i, m) in enumerate(initial_guesses):
+        tasks.put((i, np.array(m, dtype='d')))
+    for p in range(processes):
+        tasks.put(None)
+
+    workers = [multiprocessing.Process(target=_multistart_worker,
+                                       args=(setup, tasks, results, best, method, kwargs,
+                                             cancel_tolerance, cancel_after))
+               for p in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    out = [None] * len(initial_guesses)
+    remaining = len(initial_guesses)
+
+    # The start point each worker process is running, by process id
+    running = {}
+    # The runs of the workers found dead at the previous check of the workers
+    lost = set()
+    last_message = time.time()
+
+    while remaining > 0:
+        try:
+            msg = results.get(timeout=1.0)
+        except Queue.Empty:
+            if timeout is not None and time.time() - last_message > timeout:
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError("The multistart workers have not reported anything for %s seconds" % timeout)
+
+            # A run is only given up once its worker has been found dead twice in a row, so
+            # that the results it sent before it exited have been received
+            dead = set((worker.pid, running[worker.pid]) for worker in workers
+                       if not worker.is_alive() and worker.pid in running)
+            for (pid, i) in dead & lost:
+                del running[pid]
+                out[i] = {"value": np.inf, "controls": initial_guesses[i], "evaluations": 0, "status": "failed",
+                          "message": "The worker process exited", "error": "The worker process exited"}
+                remaining -= 1
+                info_red("Multistart run %d failed: its worker process exited" % i)
+            lost = dead
+
+            if remaining > 0 and not running and not any(worker.is_alive() for worker in workers):
+                raise RuntimeError("All multistart worker processes exited with %d runs unfinished" % remaining)
+            continue
+
+        last_message = time.time()
+        kind, i = msg[0], msg[1]
+
+        if kind == "start":
+            running[msg[2]] = i
+
+        elif kind == "eval":
+            if callback is not None:
+                callback(i, msg[2], best.value)
+
+        elif kind == "setup_failed":
+            for worker in workers:
+                worker.terminate()
+            raise RuntimeError("The multistart setup function failed in a worker process:\n%s" % msg[2])
+
+        else:
+            running.pop(msg[2].pop("pid"), None)
+            out[i] = msg[2]
+            remaining -= 1
+            if kind == "failed":
+                info_red("Multistart run %d failed:\n%s" % (i, msg[2]["error"]))
+            else:
+                info("Multistart run %d %s with J = %s (best so far: %s)" % (i, kind, msg[2]["value"], best.value))
+
+    for worker in workers:
+        worker.join()
+
+    return out
+
+def _multistart_worker(setup, tasks, results, best, method, kwargs, cancel_tolerance, cancel_after):
+    ''' The worker loop: annotate once, then minimise from each start point taken from the task queue. '''
+
+    try:
+        rf = setup()
+        if isinstance(rf, ReducedFunctionalNumPy):
+            rf_np = rf
+        elif isinstance(rf, ReducedFunctional):
+            rf_np = ReducedFunctionalNumPy(rf)
+        else:
+            raise TypeError("The multistart setup function must return a ReducedFunctional")
+    except:
+        results.put(("setup_failed", None, traceback.format_exc()))
+        return
+
+    user_eval_cb = rf_np.rf.eval_cb
+    state = {}
+
+    def eval_cb(j, m):
+        if user_eval_cb is not None:
+            user_eval_cb(j, m)
+
+        state["evaluations"] += 1
+        if j < state["value"]:
+            state["value"] = j
+            state["controls"] = rf_np.get_controls()
+
+        with best.get_lock():
+            if j < best.value:
+                best.value = j
+            best_value = best.value
+
+        results.put(("eval", state["index"], j))
+
+        if cancel_tolerance is not None and state["evaluations"] >= cancel_after:
+            if j - best_value > cancel_tolerance * abs(best_value):
+                raise MultistartCancelled
+
+    rf_np.rf.eval_cb = eval_cb
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        (i, m) = task
+        state.update(index=i, evaluations=0, value=np.inf, controls=m)
+        results.put(("start", i, os.getpid()))
+
+        message = ""
+        try:
+            rf_np.set_controls(m)
+            rf_np.optimization_result = None
+            minimize(rf_np, method=method, **kwargs)
+
+            # The outcome reported by the optimisation algorithm, if it reports one
+            result = rf_np.optimization_result
+            if result is not None and "success" in result:
+                status = "converged" if result["success"] else "not converged"
+                message = str(result.get("message", ""))
+            else:
+                status = "finished"
+        except MultistartCancelled:
+            status = "cancelled"
+        except:
+            error = traceback.format_exc()
+            results.put(("failed", i, {"value": state["value"], "controls": state["controls"],
+                                       "evaluations": state["evaluations"], "status": "failed",
+                                       "message": error, "error": error, "pid": os.getpid()}))
+            continue
+
+        results.put((status, i, {"value": state["value"], "controls": state["controls"],
+                                 "evaluations": state["evaluations"], "status": status,
+                                 "message": message, "pid": os.getpid()}))
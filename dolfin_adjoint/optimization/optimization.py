@@ -4,6 +4,7 @@ from ..reduced_functional_numpy import ReducedFunctionalNumPy, get_global
 from ..reduced_functional import ReducedFunctional
 from ..utils import gather
 from ..misc import rank
+from optimization_checkpoint import OptimizationCheckpoint
 
 def serialise_bounds(rf_np, bounds):
     ''' Converts bounds to an array of (min, max) tuples and serialises it in a parallel environment. '''
@@ -81,8 +82,9 @@ def minimize_scipy_generic(rf_np, method, bounds = None, **kwargs):
         kwargs["jac"] = dJ
 
     # For Hessian-based methods add the Hessian action function to the argument list
+    # (or the one given, e.g. a LowRankHessian)
     if method in ["Newton-CG"]:
-        kwargs["hessp"] = H
+        kwargs.setdefault("hessp", H)
 
     if "constraints" in kwargs:
       from constraints import canonicalise, InequalityConstraint, EqualityConstraint
@@ -127,6 +129,7 @@ def minimize_scipy_generic(rf_np, method, bounds = None, **kwargs):
     else:
         res = scipy_minimize(J, m_global, method=method, **kwargs)
 
+    rf_np.optimization_result = res
     rf_np.set_controls(np.array(res["x"]))
     m = [p.data() for p in rf_np.controls]
     return m
@@ -146,7 +149,7 @@ def minimize_custom(rf_np, bounds=None, **kwargs):
     dJ = lambda m: rf_np.derivative(m, taylor_test=dolfin.parameters["optimization"]["test_gradient"],
                                        seed=dolfin.parameters["optimization"]["test_gradient_seed"],
                                        forget=None)
-    H = rf_np.hessian
+    H = kwargs.pop("hessp", rf_np.hessian)
 
     if bounds != None:
         bounds = serialise_bounds(rf_np, bounds)
@@ -198,6 +201,9 @@ def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
         * 'method' specifies the optimization method to be used to solve the problem. The available methods can be listed with the print_optimization_methods function.
         * 'scale' is a factor to scale to problem (default: 1.0).
         * 'bounds' is an optional keyword parameter to support control constraints: bounds = (lb, ub). lb and ub must be of the same type than the parameters m.
+        * 'checkpoint' is an optional filename. If given, the optimizer state is checkpointed to this file every 'checkpoint_period' (default: 1) iterations.
+        * 'resume' (default: False) restarts the optimisation from the checkpoint file, without repeating any forward or adjoint solves recorded in it.
+        * 'checkpoint_history' (default: 10) is the number of functional values and gradients kept in the checkpoint. Once older ones are dropped, a resumed optimisation restarts from the best recorded controls.
 
         Additional arguments specific for the optimization algorithms can be added to the minimize functions (e.g. iprint = 2). These arguments will be passed to the underlying optimization algorithm. For detailed information about which arguments are supported for each optimization algorithm, please refer to the documentaton of the optimization algorithm.
         '''
@@ -221,8 +227,20 @@ def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
         # For scipy's generic inteface we need to pass the optimisation method as a parameter.
         kwargs["method"] = method
 
+    checkpoint = kwargs.pop("checkpoint", None)
+    resume = kwargs.pop("resume", False)
+    checkpoint_period = kwargs.pop("checkpoint_period", 1)
+    checkpoint_history = kwargs.pop("checkpoint_history", 10)
+    if checkpoint is not None:
+        rf_np.checkpoint = OptimizationCheckpoint(checkpoint, resume=resume, period=checkpoint_period, history=checkpoint_history)
+        rf_np.set_controls(rf_np.checkpoint.start(rf_np.get_controls()))
+
     opt = algorithm(rf_np, **kwargs)
 
+    if checkpoint is not None:
+        rf_np.checkpoint.save()
+        rf_np.checkpoint = None
+
     if len(opt) == 1:
         return opt[0]
     else:
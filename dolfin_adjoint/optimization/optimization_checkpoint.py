@@ -0,0 +1,163 @@
+import os
+import hashlib
+import collections
+import numpy
+from ..misc import rank
+
+__all__ = ['OptimizationCheckpoint']
+
+class OptimizationCheckpoint(object):
+    """Periodically saves the state of an optimisation to a compact binary file, so that
+    an interrupted optimisation can be resumed.
+
+    The file records the initial controls, the controls of the latest evaluation, the
+    iteration counter and a bounded history of the latest functional values and gradients,
+    together with the controls at which they were computed.
+
+    The optimisation algorithms we interface to keep their internal state (e.g. the
+    L-BFGS history or the trust region radius) to themselves. As long as the history holds
+    every evaluation, a resumed optimisation restarts the (deterministic) algorithm from the
+    recorded initial controls and answers its requests from the checkpoint for as long as
+    they match the recorded ones. This rebuilds the internal state of the algorithm exactly,
+    without repeating any of the forward or adjoint solves that have already been paid for.
+    Once older evaluations have been dropped, the optimisation is instead restarted from
+    the best recorded controls, with a fresh internal state."""
+
+    def __init__(self, filename, resume=False, period=1, history=10):
+
+        #: filename: the file the checkpoint is stored in.
+        self.filename = filename
+
+        #: period: the checkpoint is written after every period gradient evaluations.
+        self.period = period
+
+        #: history: the number of functional values and gradients that are kept.
+        self.history = history
+
+        #: iteration: the number of gradient evaluations so far.
+        self.iteration = 0
+
+        #: initial_controls: the controls at which the optimisation was started.
+        self.initial_controls = None
+
+        #: controls: the controls of the latest evaluation.
+        self.controls = None
+
+        #: truncated: whether evaluations have been dropped from the history.
+        self.truncated = False
+
+        # Maps from the keys of control arrays to the functional values, and to the
+        # controls and gradients, in the order they were recorded
+        self.functionals = collections.OrderedDict()
+        self.gradients = collections.OrderedDict()
+
+        #: hits: the number of requests answered from the checkpoint.
+        self.hits = 0
+
+        if resume and os.path.exists(filename):
+            self.load()
+
+    @staticmethod
+    def key(m_array):
+        """Returns the key of a control array."""
+        return hashlib.sha1(numpy.ascontiguousarray(m_array, dtype='d').tostring()).hexdigest()
+
+    def start(self, m_array):
+        """Returns the controls the optimisation should start from, recording m_array
+        as the initial controls if this is not a resumed optimisation."""
+
+        if self.initial_controls is None:
+            self.initial_controls = numpy.array(m_array, dtype='d')
+        if self.truncated:
+            return self.best_controls()
+        return self.initial_controls
+
+    def best_controls(self):
+        """Returns the recorded controls with the lowest functional value at which the
+        gradient is also recorded, or the controls of the latest evaluation."""
+
+        keys = [k for k in self.gradients if k in self.functionals]
+        if len(keys) == 0:
+            return self.controls
+        best = min(keys, key=lambda k: self.functionals[k])
+        return self.gradients[best][0]
+
+    def functional(self, m_array):
+        """Returns the recorded functional value at m_array, or None."""
+
+        try:
+            j = self.functionals[self.key(m_array)]
+        except KeyError:
+            return None
+
+        self.hits += 1
+        return j
+
+    def derivative(self, m_array):
+        """Returns the recorded gradient at m_array, or None."""
+
+        try:
+            dj = self.gradients[self.key(m_array)][1]
+        except KeyError:
+            return None
+
+        self.hits += 1
+        return numpy.array(dj)
+
+    def record_functional(self, m_array, j):
+        self.controls = numpy.array(m_array, dtype='d')
+        self._record(self.functionals, self.key(m_array), float(j))
+
+    def record_derivative(self, m_array, dj):
+        self.controls = numpy.array(m_array, dtype='d')
+        self._record(self.gradients, self.key(m_array), (self.controls, numpy.array(dj, dtype='d')))
+
+        self.iteration += 1
+        if self.iteration % self.period == 0:
+            self.save()
+
+    def _record(self, records, key, value):
+        records.pop(key, None)
+        records[key] = value
+        while len(records) > self.history:
+            records.popitem(last=False)
+            self.truncated = True
+
+    def save(self):
+        """Writes the checkpoint file. The file is replaced atomically, so that an
+        interrupted write never destroys the previous checkpoint."""
+
+        if rank() != 0:
+            return
+
+        n = len(self.initial_controls) if self.initial_controls is not None else 0
+        empty = numpy.zeros((0, n))
+        gradients = self.gradients.values()
+
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            numpy.savez(f,
+                        iteration=numpy.array(self.iteration),
+                        truncated=numpy.array(self.truncated),
+                        initial_controls=self.initial_controls if self.initial_controls is not None else numpy.zeros(0),
+                        controls=self.controls if self.controls is not None else numpy.zeros(0),
+                        functional_keys=numpy.array(self.functionals.keys(), dtype='S40'),
+                        functional_values=numpy.array(self.functionals.values(), dtype='d'),
+                        gradient_keys=numpy.array(self.gradients.keys(), dtype='S40'),
+                        gradient_controls=numpy.array([m for (m, dj) in gradients]) if gradients else empty,
+                        gradients=numpy.array([dj for (m, dj) in gradients]) if gradients else empty)
+        os.rename(tmp, self.filename)
+
+    def load(self):
+        """Reads the checkpoint file."""
+
+        data = numpy.load(self.filename)
+
+        self.iteration = int(data["iteration"])
+        self.truncated = bool(data["truncated"])
+        self.initial_controls = data["initial_controls"] if len(data["initial_controls"]) > 0 else None
+        self.controls = data["controls"] if len(data["controls"]) > 0 else None
+        self.functionals = collections.OrderedDict(zip([str(k) for k in data["functional_keys"]],
+                                                       data["functional_values"]))
+        self.gradients = collections.OrderedDict(zip([str(k) for k in data["gradient_keys"]],
+                                                     zip(data["gradient_controls"], data["gradients"])))
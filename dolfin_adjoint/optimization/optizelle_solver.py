@@ -4,6 +4,8 @@ import constraints
 import numpy
 import math
 from ..enlisting import enlist, delist
+from ..reduced_functional_numpy import get_global, set_local
+from optimization_checkpoint import OptimizationCheckpoint
 
 from backend import *
 
@@ -364,6 +366,11 @@ try:
             self.last_J = None
             self.scale = scale
 
+            # An optional OptimizationCheckpoint, and whether the latest
+            # evaluation was answered from it (i.e. without a forward run)
+            self.checkpoint = None
+            self.replayed = False
+
         @optizelle_callback
         def eval(self, x):
             if self.last_x is not None:
@@ -372,20 +379,53 @@ try:
                     return self.last_J
 
             self.last_x = DolfinVectorSpace.init(x)
+
+            if self.checkpoint is not None:
+                x_array = get_global(x)
+                j = self.checkpoint.functional(x_array)
+                if j is not None:
+                    self.replayed = True
+                    self.last_J = j
+                    return self.last_J
+
             self.rf(x)
             self.last_J = self.scale*self.rf(x)
+            self.replayed = False
+
+            if self.checkpoint is not None:
+                self.checkpoint.record_functional(x_array, self.last_J)
+
             return self.last_J
 
+        def __ensure_forward(self, x):
+            """Run the forward model at x if its evaluation was answered from the checkpoint."""
+            if self.replayed:
+                self.rf(x)
+                self.replayed = False
+
         @optizelle_callback
         def grad(self, x, grad):
             self.eval(x)
+
+            if self.checkpoint is not None:
+                x_array = get_global(x)
+                dj = self.checkpoint.derivative(x_array)
+                if dj is not None:
+                    set_local(grad, dj)
+                    return
+
+            self.__ensure_forward(x)
             out = self.rf.derivative(forget=False, project=True)
             DolfinVectorSpace.scal(self.scale, out)
             DolfinVectorSpace.copy(out, grad)
 
+            if self.checkpoint is not None:
+                self.checkpoint.record_derivative(x_array, get_global(grad))
+
         @optizelle_callback
         def hessvec(self, x, dx, H_dx):
             self.eval(x)
+            self.__ensure_forward(x)
             H = self.rf.hessian(dx, project=True)
             DolfinVectorSpace.scal(self.scale, H)
             DolfinVectorSpace.copy(H, H_dx)
@@ -628,8 +668,17 @@ class OptizelleSolver(OptimizationSolver):
                     print("Error: unknown optizelle option %s." % key)
                     raise
 
-    def solve(self):
-        """Solve the optimization problem and return the optimized parameters."""
+    def solve(self, checkpoint=None, resume=False, checkpoint_period=1, checkpoint_history=10):
+        """Solve the optimization problem and return the optimized parameters.
+
+        If checkpoint is a filename, the optimizer state is checkpointed to that file
+        every checkpoint_period iterations, keeping the latest checkpoint_history
+        evaluations. If resume is True, the optimisation is restarted from that
+        checkpoint without repeating the forward and adjoint solves recorded in it."""
+
+        if checkpoint is not None:
+            self.fns.f.checkpoint = OptimizationCheckpoint(checkpoint, resume=resume, period=checkpoint_period, history=checkpoint_history)
+            set_local(self.state.x, self.fns.f.checkpoint.start(get_global(self.state.x)))
 
         if self.problem.constraints is None:
             num_equality_constraints = 0
@@ -658,6 +707,10 @@ class OptizelleSolver(OptimizationSolver):
         # FIXME: Use logging
         print("The algorithm stopped due to: %s" % (Optizelle.StoppingCondition.to_string(self.state.opt_stop)))
 
+        if checkpoint is not None:
+            self.fns.f.checkpoint.save()
+            self.fns.f.checkpoint = None
+
         # Return the optimal control
         list_type = self.problem.reduced_functional.controls
         return delist(self.state.x, list_type)
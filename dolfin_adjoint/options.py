@@ -8,11 +8,24 @@ adj_params.add("fussy_replay", True)
 adj_params.add("stop_annotating", False)
 adj_params.add("cache_factorizations", False)
 adj_params.add("debug_cache", False)
+adj_params.add("assembly_cache_size", 64)
+# Replays of nonlinear solves can start from the solution of the previous replay
+# (warm_start_replay, one Function per solve) and keep the LU factorisation of the Jacobian
+# across Newton iterations and replays (reuse_jacobian, one sparse factorisation per solve).
+# Only the first replay_cache_size solves of the annotation get this memory.
+adj_params.add("warm_start_replay", False)
+adj_params.add("reuse_jacobian", False)
+adj_params.add("jacobian_reuse_contraction", 0.5)
+adj_params.add("replay_cache_size", 64)
+adj_params.add("free_dead_values", False)
+adj_params.add("adjoint_threads", 1)
 adj_params.add("symmetric_bcs", False)
+adj_params.add("record_tape", False)
 
 opt_params = Parameters("optimization")
 opt_params.add("test_gradient", False)
 opt_params.add("test_gradient_seed", 0.0001)
+opt_params.add("test_gradient_processes", 1)
 
 parameters.add(adj_params)
 parameters.add(opt_params)
@@ -9,6 +9,7 @@ import utils
 import caching
 import expressions
 import constant
+import liveness
 
 if dolfin.__version__ > '1.2.0':
   class PointIntegralSolver(dolfin.PointIntegralSolver):
@@ -32,6 +33,7 @@ if dolfin.__version__ > '1.2.0':
         next_var = adjglobals.adj_variables.next(var)
 
         eqn = libadjoint.Equation(next_var, blocks=[identity_block], targets=[next_var], rhs=rhs)
+        liveness.record(rhs.dependencies())
         cs  = adjglobals.adjointer.register_equation(eqn)
 
       super(PointIntegralSolver, self).step(dt)
@@ -100,71 +102,59 @@ if dolfin.__version__ > '1.2.0':
       return out
 
     def derivative_action(self, dependencies, values, variable, contraction_vector, hermitian):
-      expressions.update_expressions(self.frozen_expressions)
-      constant.update_constants(self.frozen_constants)
+      return self.derivative_actions(dependencies, values, variable, [contraction_vector], hermitian)[0]
 
-      if not hermitian:
-        if self.solver not in caching.pis_fwd_to_tlm:
-          dolfin.info_blue("No TLM solver, creating ... ")
-          creation_timer = dolfin.Timer("to_adm")
-          if contraction_vector.data is not None:
-            tlm_scheme = self.scheme.to_tlm(contraction_vector.data)
-          else:
-            tlm_scheme = self.scheme.to_tlm(dolfin.Function(self.fn_space))
+    def derivative_actions(self, dependencies, values, variable, contraction_vectors, hermitian):
+      '''Apply the tangent linear (or, if hermitian, the adjoint) step to several contraction
+      vectors at once, e.g. for several directions of a Hessian or a block of perturbations.
+      The frozen Expressions and Constants, the coefficients and the time of the derivative
+      scheme are set once for all directions, which are then stepped one after the other by
+      the cached solver.'''
 
-          creation_time = creation_timer.stop()
-          dolfin.info_red("TLM creation time: %s" % creation_time)
+      with caching.lock:
+        expressions.update_expressions(self.frozen_expressions)
+        constant.update_constants(self.frozen_constants)
 
-          tlm_solver = dolfin.PointIntegralSolver(tlm_scheme)
-          tlm_solver.parameters.update(self.solver.parameters)
-          caching.pis_fwd_to_tlm[self.solver] = tlm_solver
+        if not hermitian:
+          solver = self.derivative_solver(caching.pis_fwd_to_tlm, "TLM", self.scheme.to_tlm)
         else:
-          tlm_solver = caching.pis_fwd_to_tlm[self.solver]
-          tlm_scheme = tlm_solver.scheme()
-          if contraction_vector.data is not None:
-            tlm_scheme.contraction.assign(contraction_vector.data)
-          else:
-            tlm_scheme.contraction.vector().zero()
+          solver = self.derivative_solver(caching.pis_fwd_to_adj, "ADM", self.scheme.to_adm)
+        scheme = solver.scheme()
 
-        coeffs = [x for x in ufl.algorithms.extract_coefficients(tlm_scheme.rhs_form()) if hasattr(x, 'function_space')]
+        coeffs = [x for x in ufl.algorithms.extract_coefficients(scheme.rhs_form()) if hasattr(x, 'function_space')]
         for (coeff, value) in zip(coeffs, values):
           coeff.assign(value.data)
-        tlm_scheme.t().assign(self.time)
-
-        tlm_solver.step(self.dt)
-
-        return adjlinalg.Vector(tlm_scheme.solution())
 
-      else:
-        if self.solver not in caching.pis_fwd_to_adj:
-          dolfin.info_blue("No ADM solver, creating ... ")
-          creation_timer = dolfin.Timer("to_adm")
+        outs = []
+        for contraction_vector in contraction_vectors:
           if contraction_vector.data is not None:
-            adm_scheme = self.scheme.to_adm(contraction_vector.data)
+            scheme.contraction.assign(contraction_vector.data)
           else:
-            adm_scheme = self.scheme.to_adm(dolfin.Function(self.fn_space))
-          creation_time = creation_timer.stop()
-          dolfin.info_red("ADM creation time: %s" % creation_time)
+            scheme.contraction.vector().zero()
 
-          adm_solver = dolfin.PointIntegralSolver(adm_scheme)
-          adm_solver.parameters.update(self.solver.parameters)
-          caching.pis_fwd_to_adj[self.solver] = adm_solver
-        else:
-          adm_solver = caching.pis_fwd_to_adj[self.solver]
-          adm_scheme = adm_solver.scheme()
-          if contraction_vector.data is not None:
-            adm_scheme.contraction.assign(contraction_vector.data)
-          else:
-            adm_scheme.contraction.vector().zero()
+          scheme.t().assign(self.time)
+          solver.step(self.dt)
 
-        coeffs = [x for x in ufl.algorithms.extract_coefficients(adm_scheme.rhs_form()) if hasattr(x, 'function_space')]
-        for (coeff, value) in zip(coeffs, values):
-          coeff.assign(value.data)
-        adm_scheme.t().assign(self.time)
+          # The solver steps into the same Function each time
+          outs.append(adjlinalg.Vector(dolfin.Function(scheme.solution())))
+
+        return outs
+
+    def derivative_solver(self, cache, name, to_derivative):
+      '''Return the cached PointIntegralSolver for the derivative scheme, creating it if necessary.'''
+
+      if self.solver not in cache:
+        dolfin.info_blue("No %s solver, creating ... " % name)
+        creation_timer = dolfin.Timer("to_adm")
+        scheme = to_derivative(dolfin.Function(self.fn_space))
+        creation_time = creation_timer.stop()
+        dolfin.info_red("%s creation time: %s" % (name, creation_time))
 
-        adm_solver.step(self.dt)
+        solver = dolfin.PointIntegralSolver(scheme)
+        solver.parameters.update(self.solver.parameters)
+        cache[self.solver] = solver
 
-        return adjlinalg.Vector(adm_scheme.solution())
+      return cache[self.solver]
 
   __all__ = ['PointIntegralSolver']
 else:
@@ -7,6 +7,9 @@ import libadjoint
 import adjglobals
 import adjlinalg
 import utils
+import caching
+import scheduling
+from telemetry import telemetry
 
 def project_dolfin(v, V=None, bcs=None, mesh=None, solver_type="cg", preconditioner_type="default", form_compiler_parameters=None, annotate=None, name=None):
   '''The project call performs an equation solve, and so it too must be annotated so that the
@@ -25,31 +28,121 @@ def project_dolfin(v, V=None, bcs=None, mesh=None, solver_type="cg", preconditio
   if isinstance(v, backend.Constant) and (annotate is not True):
     to_annotate = False
 
-  out = backend.project(v=v, V=V, bcs=bcs, mesh=mesh, solver_type=solver_type, preconditioner_type=preconditioner_type, form_compiler_parameters=form_compiler_parameters)
+  if V is None:
+    V = backend.fem.projection._extract_function_space(v, mesh)
+  if bcs is None:
+    bcs = []
+  elif not isinstance(bcs, (list, tuple)):
+    bcs = [bcs]
+
+  # Define variational problem for projection
+  w = backend.TestFunction(V)
+  Pv = backend.TrialFunction(V)
+  a = backend.inner(w, Pv)*backend.dx
+  L = backend.inner(w, v)*backend.dx
+
+  out = backend.Function(V)
+  b = backend.assemble(L, form_compiler_parameters=form_compiler_parameters)
+  projection_operator(V, bcs).solve(out.vector(), b, bcs, solver_type, preconditioner_type)
 
   if name is not None:
     out.adj_name = name
     out.rename(name, "a Function from dolfin-adjoint")
 
   if to_annotate:
-    # reproduce the logic from project. This probably isn't future-safe, but anyway
-
-    if V is None:
-      V = backend.fem.projection._extract_function_space(v, mesh)
-
-    # Define variational problem for projection
-    w = backend.TestFunction(V)
-    Pv = backend.TrialFunction(V)
-    a = backend.inner(w, Pv)*backend.dx
-    L = backend.inner(w, v)*backend.dx
-
-    solving.annotate(a == L, out, bcs, solver_parameters={"linear_solver": solver_type, "preconditioner": preconditioner_type, "symmetric": True})
+    solving.annotate(a == L, out, bcs, solver_parameters={"linear_solver": solver_type, "preconditioner": preconditioner_type, "symmetric": True},
+                     matrix_class=ProjectionMatrix)
 
     if backend.parameters["adjoint"]["record_all"]:
       adjglobals.adjointer.record_variable(adjglobals.adj_variables[out], libadjoint.MemoryStorage(adjlinalg.Vector(out)))
 
   return out
 
+# The solver types of project that are direct solvers
+lu_methods = ["lu", "default", "mumps", "umfpack", "spooles", "superlu", "superlu_dist", "pastix", "petsc"]
+
+class ProjectionOperator(object):
+  '''The assembled mass matrix of a function space with Dirichlet boundary conditions, and the
+  solvers configured with it. It is shared by the forward, replay, tangent linear and adjoint
+  solves of all projections into that space. The solves use the solver_type and
+  preconditioner_type of the projection: a direct solver factorises the matrix once, and a
+  Krylov solver keeps its operator.'''
+
+  def __init__(self, V, bcs):
+    w = backend.TestFunction(V)
+    Pv = backend.TrialFunction(V)
+    self.matrix = backend.assemble(backend.inner(w, Pv)*backend.dx)
+    [bc.apply(self.matrix) for bc in bcs]
+
+    self.solvers = {}
+
+  def solver(self, solver_type, preconditioner_type):
+    key = (solver_type, preconditioner_type)
+    if key not in self.solvers:
+      if solver_type in lu_methods:
+        solver = backend.LUSolver(self.matrix, "default" if solver_type == "lu" else solver_type)
+        solver.parameters["reuse_factorization"] = True
+      else:
+        solver = backend.KrylovSolver(solver_type, preconditioner_type)
+        solver.set_operator(self.matrix)
+      self.solvers[key] = solver
+    return self.solvers[key]
+
+  def solve(self, x, b, bcs, solver_type="lu", preconditioner_type="default"):
+    [bc.apply(b) for bc in bcs]
+    with caching.lock:
+      solver = self.solver(solver_type, preconditioner_type)
+    scheduling.linear_solve(lambda: solver.solve(x, b), cached=True)
+
+def projection_operator(V, bcs):
+  '''Return the cached ProjectionOperator for the function space V and the boundary conditions bcs.
+  The boundary conditions only enter the mass matrix through the rows they constrain, so homogenised
+  (adjoint) boundary conditions share the operator of the original ones.'''
+
+  dofs = set()
+  for bc in bcs:
+    if isinstance(bc, backend.DirichletBC):
+      dofs.update(bc.get_boundary_values().keys())
+  key = (V.id(), tuple(sorted(dofs)))
+
+  with caching.lock:
+    if key not in caching.projection_operators:
+      if backend.parameters["adjoint"]["debug_cache"]:
+        backend.info_red("Got a projection operator cache miss")
+      caching.projection_operators[key] = ProjectionOperator(V, bcs)
+    else:
+      if backend.parameters["adjoint"]["debug_cache"]:
+        backend.info_green("Got a projection operator cache hit")
+      telemetry.count("cache_hits")
+
+    return caching.projection_operators[key]
+
+class ProjectionMatrix(adjlinalg.Matrix):
+  '''The mass matrix of an annotated projection. Its solves use the cached ProjectionOperator.'''
+
+  def solve(self, var, b):
+    test = self.test_function()
+    x = adjlinalg.Vector(backend.Function(test.function_space()))
+
+    if b.data is None:
+      backend.info_red("Warning: got zero RHS for the solve associated with variable %s" % var)
+      return x
+
+    if var.type in ['ADJ_TLM', 'ADJ_ADJOINT', 'ADJ_SOA']:
+      bcs = [backend.homogenize(bc) for bc in self.bcs if isinstance(bc, backend.DirichletBC)]
+    else:
+      bcs = self.bcs
+
+    if isinstance(b.data, backend.Function):
+      rhs = backend.Function(b.data).vector()
+    else:
+      rhs = adjlinalg.wrap_assemble(b.data, test)
+
+    solver_type = self.solver_parameters.get("linear_solver", "lu")
+    preconditioner_type = self.solver_parameters.get("preconditioner", "default")
+    projection_operator(test.function_space(), bcs).solve(x.data.vector(), rhs, bcs, solver_type, preconditioner_type)
+    return x
+
 # In Firedrake, project wraps an actual variational solve, so there is
 # no need for dolfin-adjoint to treat it specially. It is sufficient
 # that the inner solve is annotated.
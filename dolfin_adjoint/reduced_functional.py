@@ -8,6 +8,9 @@ from dolfin_adjoint.adjglobals import adjointer, mem_checkpoints, disk_checkpoin
 from functional import Functional
 from enlisting import enlist, delist
 from controls import DolfinAdjointControl, ListControl
+from telemetry import telemetry
+from inexactness import inexactness
+import liveness
 
 class ReducedFunctional(object):
     ''' This class provides access to the reduced functional for given
@@ -78,6 +81,10 @@ class ReducedFunctional(object):
         # Stores the functional value of the latest evaluation
         self.current_func_value = None
 
+        # The liveness analysis of the stored forward values, if
+        # parameters["adjoint"]["free_dead_values"] is set
+        self.liveness_analysis = None
+
         # Set up the Hessian driver
         # Note: drivers.hessian currently only supports one control
         try:
@@ -128,49 +135,13 @@ class ReducedFunctional(object):
             if hash in self._cache["functional_cache"]:
                 # Found a cache
                 info_green("Got a functional cache hit")
+                telemetry.count("cache_hits")
                 return self._cache["functional_cache"][hash]
 
         # Replay the annotation and evaluate the functional
-        func_value = 0.
-        for i in range(adjointer.equation_count):
-            (fwd_var, output) = adjointer.get_forward_solution(i)
-            if isinstance(output.data, Function):
-              output.data.rename(str(fwd_var), "a Function from dolfin-adjoint")
-
-            if self.replay_cb is not None:
-              self.replay_cb(fwd_var, output.data, delist(value, list_type=self.controls))
-
-            # Check if we checkpointing is active and if yes
-            # record the exact same checkpoint variables as
-            # in the initial forward run
-            if adjointer.get_checkpoint_strategy() != None:
-                if str(fwd_var) in mem_checkpoints:
-                    storage = libadjoint.MemoryStorage(output, cs = True)
-                    storage.set_overwrite(True)
-                    adjointer.record_variable(fwd_var, storage)
-                if str(fwd_var) in disk_checkpoints:
-                    storage = libadjoint.MemoryStorage(output)
-                    adjointer.record_variable(fwd_var, storage)
-                    storage = libadjoint.DiskStorage(output, cs = True)
-                    storage.set_overwrite(True)
-                    adjointer.record_variable(fwd_var, storage)
-                if not str(fwd_var) in mem_checkpoints and not str(fwd_var) in disk_checkpoints:
-                    storage = libadjoint.MemoryStorage(output)
-                    storage.set_overwrite(True)
-                    adjointer.record_variable(fwd_var, storage)
-
-            # No checkpointing, so we record everything
-            else:
-                storage = libadjoint.MemoryStorage(output)
-                storage.set_overwrite(True)
-                adjointer.record_variable(fwd_var, storage)
-
-            if i == adjointer.timestep_end_equation(fwd_var.timestep):
-                func_value += adjointer.evaluate_functional(self.functional, fwd_var.timestep)
-                if adjointer.get_checkpoint_strategy() != None:
-                    adjointer.forget_forward_equation(i)
+        inexactness.record("replay")
+        func_value = self.replay(value, self.replay_cb)
 
-        self.current_func_value = func_value
         if self.eval_cb:
             self.eval_cb(self.scale * func_value, delist(value,
                 list_type=self.controls))
@@ -182,6 +153,73 @@ class ReducedFunctional(object):
 
         return self.scale*func_value
 
+    def replay(self, value, replay_cb=None):
+        ''' Replays the annotation with the control values value, which must already be
+        set on the tape, and returns the (unscaled) functional value. Unlike __call__,
+        the functional cache and the eval_cb callback are not used. '''
+
+        telemetry.count("forward_replays")
+        func_value = 0.
+        analysis = None
+        if liveness.active() and adjointer.get_checkpoint_strategy() == None:
+            analysis = self.liveness()
+
+        with telemetry.phase("replay"):
+            for i in range(adjointer.equation_count):
+                (fwd_var, output) = adjointer.get_forward_solution(i)
+                if isinstance(output.data, Function):
+                  output.data.rename(str(fwd_var), "a Function from dolfin-adjoint")
+
+                if replay_cb is not None:
+                  replay_cb(fwd_var, output.data, delist(value, list_type=self.controls))
+
+                # Check if we checkpointing is active and if yes
+                # record the exact same checkpoint variables as
+                # in the initial forward run
+                if adjointer.get_checkpoint_strategy() != None:
+                    if str(fwd_var) in mem_checkpoints:
+                        storage = libadjoint.MemoryStorage(output, cs = True)
+                        storage.set_overwrite(True)
+                        adjointer.record_variable(fwd_var, storage)
+                    if str(fwd_var) in disk_checkpoints:
+                        storage = libadjoint.MemoryStorage(output)
+                        adjointer.record_variable(fwd_var, storage)
+                        storage = libadjoint.DiskStorage(output, cs = True)
+                        storage.set_overwrite(True)
+                        adjointer.record_variable(fwd_var, storage)
+                    if not str(fwd_var) in mem_checkpoints and not str(fwd_var) in disk_checkpoints:
+                        storage = libadjoint.MemoryStorage(output)
+                        storage.set_overwrite(True)
+                        adjointer.record_variable(fwd_var, storage)
+
+                # No checkpointing, so we record everything
+                else:
+                    storage = libadjoint.MemoryStorage(output)
+                    storage.set_overwrite(True)
+                    adjointer.record_variable(fwd_var, storage)
+
+                if i == adjointer.timestep_end_equation(fwd_var.timestep):
+                    with telemetry.phase("functional"):
+                        func_value += adjointer.evaluate_functional(self.functional, fwd_var.timestep)
+                    if adjointer.get_checkpoint_strategy() != None:
+                        adjointer.forget_forward_equation(i)
+
+                # Drop the values that neither the rest of the replay
+                # nor the adjoint will need
+                if analysis is not None:
+                    analysis.free_after_replay(i)
+
+        self.current_func_value = func_value
+        return func_value
+
+    def liveness(self):
+        ''' Returns the liveness analysis of the stored forward values for
+        this functional and controls. '''
+
+        if self.liveness_analysis is None or self.liveness_analysis.equation_count != adjointer.equation_count:
+            self.liveness_analysis = liveness.LivenessAnalysis(self.functional, self.controls)
+        return self.liveness_analysis
+
     def derivative(self, forget=True, project=False):
         ''' Evaluates the derivative of the reduced functional for the most
         recently evaluated control value. '''
@@ -195,9 +233,11 @@ class ReducedFunctional(object):
 
             if hash in self._cache["derivative_cache"]:
                 info_green("Got a derivative cache hit.")
+                telemetry.count("cache_hits")
                 return cache_load(self._cache["derivative_cache"][hash], fnspaces)
 
         # Compute the gradient by solving the adjoint equations
+        inexactness.record("adjoint")
         dfunc_value = drivers.compute_gradient(self.functional, self.controls, forget=forget, project=project)
         dfunc_value = enlist(dfunc_value)
 
@@ -238,11 +278,13 @@ class ReducedFunctional(object):
 
             if hash in self._cache["hessian_cache"]:
                 info_green("Got a Hessian cache hit.")
+                telemetry.count("cache_hits")
                 return cache_load(self._cache["hessian_cache"][hash], fnspaces)
             else:
                 info_red("Got a Hessian cache miss")
 
         # Compute the Hessian action by solving the second order adjoint equations
+        inexactness.record("tlm")
         if isinstance(m_dot, list):
           assert len(m_dot) == 1
           Hm = self.H(m_dot[0], project=project)
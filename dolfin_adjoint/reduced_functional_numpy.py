@@ -1,11 +1,20 @@
 import numpy as np
-from backend import info, info_red, Constant, Function, TestFunction, TrialFunction, assemble, inner, dx, info_red
+import multiprocessing
+import libadjoint
+from backend import info, info_red, Constant, Function, TestFunction, TrialFunction, assemble, inner, dx, info_red, parameters
 from dolfin_adjoint import constant, utils
 from dolfin_adjoint.adjglobals import adjointer, adj_reset_cache
 from reduced_functional import ReducedFunctional
+from controls import ListControl
 from utils import gather
+from telemetry import telemetry
+from inexactness import inexactness
 from functools import partial
+import adjlinalg
+import drivers
 import misc
+import solving
+from enlisting import enlist
 
 class ReducedFunctionalNumPy(ReducedFunctional):
     ''' This class implements the reduced functional for given functional and
@@ -29,11 +38,34 @@ class ReducedFunctionalNumPy(ReducedFunctional):
 
         self.rf = rf
 
+        #: An optional OptimizationCheckpoint. If set, all functional and gradient
+        #: evaluations are recorded in it, and evaluations it already holds are
+        #: answered without solving the forward or adjoint equations.
+        self.checkpoint = None
+
+        #: The result of the scipy optimisation algorithm in the latest call of minimize, or None.
+        self.optimization_result = None
+
+        # The control values the forward solution on the tape belongs to. Evaluations
+        # answered from the checkpoint do not change it.
+        self.__forward_point = self.get_controls()
 
     def __call__(self, m_array):
         ''' An implementation of the reduced functional evaluation
             that accepts the control values as an array of scalars '''
 
+        if self.checkpoint is not None:
+            j = self.checkpoint.functional(m_array)
+            if j is not None:
+                telemetry.count("cache_hits")
+                return j
+
+        return self.__replay(m_array)
+
+    def __replay(self, m_array):
+        ''' Runs the forward model at the control values m_array, whether or not
+            the checkpoint holds the functional value there. '''
+
         # In case the annotation is not reused, we need to reset any prior annotation of the adjointer before reruning the forward model.
         if not self.replays_annotation:
             solving.adj_reset()
@@ -45,13 +77,32 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         m = self.rf.controls.__class__([p.data() for p in self.controls])
         self.set_local(m, m_array)
 
-        return self.__base_call__(m)
+        j = self.__base_call__(m)
+        self.__forward_point = np.array(m_array, dtype='d')
+
+        if self.checkpoint is not None:
+            self.checkpoint.record_functional(m_array, j)
+
+        return j
+
+    def __ensure_forward(self, m_array):
+        ''' Reruns the forward model at m_array, unless the forward solution on the tape
+            already belongs to these control values. Returns whether it was rerun. '''
+
+        m = [p.data() for p in self.controls]
+        if (m_array != self.__forward_point).any() or (m_array != self.get_global(m)).any():
+            info_red("Rerunning forward model")
+            self.__replay(m_array)
+            return True
+        return False
 
     def set_local(self, m, m_array):
-        set_local(m, m_array)
+        with telemetry.phase("gather"):
+            set_local(m, m_array)
 
     def get_global(self, m):
-        return get_global(m)
+        with telemetry.phase("gather"):
+            return get_global(m)
 
     def derivative(self, m_array=None, taylor_test=False, seed=0.001, forget=True, project=False):
         ''' An implementation of the reduced functional derivative evaluation
@@ -60,35 +111,137 @@ class ReducedFunctionalNumPy(ReducedFunctional):
             If taylor_test = True, the derivative is automatically verified
             by the Taylor remainder convergence test. The perturbation direction
             is random and the perturbation size can be controlled with the seed argument.
+            The perturbed functionals are evaluated concurrently on
+            parameters["optimization"]["test_gradient_processes"] worker processes.
             '''
 
+        if self.checkpoint is not None and m_array is not None and not taylor_test:
+            dJdm_global = self.checkpoint.derivative(m_array)
+            if dJdm_global is not None:
+                telemetry.count("cache_hits")
+                telemetry.end_iteration()
+                return dJdm_global
+
         # In the case that the control values have changed since the last forward run,
         # we first need to rerun the forward model with the new controls to have the
         # correct forward solutions
         m = [p.data() for p in self.controls]
-        if m_array is not None and (m_array != self.get_global(m)).any():
-            info_red("Rerunning forward model before computing derivative")
-            self(m_array)
+        if m_array is not None:
+            self.__ensure_forward(m_array)
 
         dJdm = self.__base_derivative__(forget=forget, project=project)
 
         if project:
             dJdm_global = self.get_global(dJdm)
         else:
-            dJdm_global = get_global(dJdm)
+            with telemetry.phase("gather"):
+                dJdm_global = get_global(dJdm)
 
         # Perform the gradient test
         if taylor_test:
+            if m_array is None:
+                m_array = self.get_global(m)
+
+            # The forward state at m_array is needed afterwards. The workers of a
+            # concurrent test do not touch our tape; otherwise we restore the
+            # forward values from a snapshot instead of rerunning the model.
+            processes = parameters["optimization"]["test_gradient_processes"]
+            concurrent = processes > 1 and misc.size() == 1
+            snapshot = None
+            if not concurrent:
+                snapshot = snapshot_forward()
+
+            # self.__call__ returns the scaled functional value of the underlying ReducedFunctional
+            current_func_value = self.rf.current_func_value
+            Jm = None
+            if current_func_value is not None:
+                Jm = self.rf.scale * current_func_value
+
             minconv = utils.test_gradient_array(self.__call__, self.scale * dJdm_global, m_array,
-                                                seed = seed)
+                                                seed = seed, Jx = Jm, processes = processes)
             if minconv < 1.9:
                 raise RuntimeWarning, "A gradient test failed during execution."
             else:
                 info("Gradient test successful.")
-            self(m_array)
 
+            if not concurrent:
+                self.__restore(snapshot, m_array, current_func_value)
+
+        if self.checkpoint is not None and m_array is not None:
+            self.checkpoint.record_derivative(m_array, dJdm_global)
+
+        # Tighten or relax the solver tolerances according to the progress of the optimisation
+        inexactness.update(gradient_norm=np.linalg.norm(dJdm_global))
+
+        telemetry.end_iteration()
         return dJdm_global
 
+    def evaluate_batch(self, m_arrays, with_gradient=False, processes=None):
+        ''' Evaluates the reduced functional (and, if with_gradient is True, its derivative)
+            for each of the control arrays in m_arrays. Returns the list of the functional
+            values, or of the pairs (value, derivative array), in the order of m_arrays.
+
+            The evaluations are handed out one at a time to a pool of processes worker
+            processes (default: the number of cores), forked from this process so that each
+            holds a copy of the tape to replay. The tape and the forward state of this process
+            are left untouched. In parallel (MPI) runs, or with processes=1, the evaluations
+            are done one after another, and the forward state at the current control values
+            is restored afterwards.
+
+            The evaluations are not those of the optimisation algorithm: they are neither
+            recorded in the checkpoint nor passed to the callbacks, the telemetry iterations
+            or the inexactness control. '''
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        concurrent = processes > 1 and len(m_arrays) > 1 and misc.size() == 1
+
+        def evaluate(m_array):
+            adj_reset_cache()
+            m = self.rf.controls.__class__([p.data() for p in self.controls])
+            self.set_local(m, m_array)
+            if self.replays_annotation:
+                ListControl(self.controls).update(m)
+                j = self.scale * self.rf.replay(m)
+            else:
+                solving.adj_reset()
+                j = self.__base_call__(m)
+            if not with_gradient:
+                return j
+
+            dJdm = enlist(drivers.compute_gradient(self.functional, self.controls, forget=False))
+            adjointer.reset_revolve()
+            return (j, self.scale * get_global(dJdm))
+
+        if not concurrent:
+            m_array = self.get_controls()
+            current_func_value = self.rf.current_func_value
+            snapshot = snapshot_forward()
+
+        try:
+            out = utils.evaluate_concurrently(evaluate, [np.array(m, dtype='d') for m in m_arrays], processes)
+        finally:
+            if not concurrent:
+                self.__restore(snapshot, m_array, current_func_value)
+                self.__forward_point = np.array(m_array, dtype='d')
+
+        return out
+
+    def __restore(self, snapshot, m_array, current_func_value):
+        ''' Restores the forward state at the control values m_array after other control
+            values have been evaluated, from a snapshot_forward if there is one, and by
+            rerunning the forward model otherwise. '''
+
+        if snapshot is not None:
+            restore_forward(snapshot)
+            m = self.rf.controls.__class__([p.data() for p in self.controls])
+            self.set_local(m, m_array)
+            ListControl(self.controls).update(m)
+            self.rf.current_func_value = current_func_value
+            self.__forward_point = np.array(m_array, dtype='d')
+        else:
+            self.__replay(m_array)
+
     def hessian(self, m_array, m_dot_array):
         ''' An implementation of the reduced functional hessian action evaluation
             that accepts the controls as an array of scalars. If m_array is None,
@@ -102,9 +255,7 @@ class ReducedFunctionalNumPy(ReducedFunctional):
             # In case the control values have changed since the last forward run,
             # we first need to rerun the forward model with the new controls to have the
             # correct forward solutions
-            if (m_array != self.get_global(m)).any():
-                self(m_array)
-
+            if self.__ensure_forward(m_array):
                 # Clear the adjoint solution as we need to recompute them
                 for i in range(adjointer.equation_count):
                     adjointer.forget_adjoint_values(i)
@@ -131,9 +282,13 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         m = [p.data() for p in self.controls]
         return self.set_local(m, array)
 
-    def pyopt_problem(self, constraints=None, bounds=None, name="Problem", ignore_model_errors=False):
+    def pyopt_problem(self, constraints=None, bounds=None, name="Problem", ignore_model_errors=False, sparse=False):
       '''Return a pyopt problem class that can be used with the PyOpt package,
       http://www.pyopt.org/
+
+      If sparse is True, the constraint Jacobian is returned as a scipy.sparse
+      CSR matrix instead of a dense array, for optimizers that accept sparse
+      constraint sensitivities.
       '''
       import pyOpt
       import optimization.constraints
@@ -175,7 +330,14 @@ class ReducedFunctionalNumPy(ReducedFunctional):
                   fail = True
 
           if constraints is not None:
-              gJac = np.concatenate([gather(c.jacobian(x)) for c in constraints])
+              (rows, cols, vals) = constraints.coo_jacobian(x)
+              shape = (constraints._get_constraint_dim(), len(x))
+              if sparse:
+                  import scipy.sparse
+                  gJac = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=shape)
+              else:
+                  gJac = np.zeros(shape)
+                  np.add.at(gJac, (rows, cols), vals)
           else:
               gJac = np.zeros(len(x))  # SNOPT fails if no constraints are given, hence add a dummy constraint
 
@@ -221,6 +383,35 @@ class ReducedFunctionalNumPy(ReducedFunctional):
       return opt_prob, grad
 
 
+def snapshot_forward():
+    ''' Returns copies of the recorded values of all forward variables, or None
+    if some of them are not available (e.g. when checkpointing). '''
+
+    if adjointer.get_checkpoint_strategy() is not None:
+        return None
+
+    snapshot = []
+    for i in range(adjointer.equation_count):
+        fwd_var = adjointer.get_forward_variable(i)
+        try:
+            value = adjointer.get_variable_value(fwd_var)
+        except (libadjoint.exceptions.LibadjointErrorHashFailed, libadjoint.exceptions.LibadjointErrorNeedValue):
+            return None
+
+        if not isinstance(value.data, Function):
+            return None
+        snapshot.append((fwd_var, adjlinalg.Vector(Function(value.data))))
+
+    return snapshot
+
+def restore_forward(snapshot):
+    ''' Records the forward values of a snapshot_forward on the tape again. '''
+
+    for (fwd_var, value) in snapshot:
+        storage = libadjoint.MemoryStorage(value)
+        storage.set_overwrite(True)
+        adjointer.record_variable(fwd_var, storage)
+
 def copy_data(m):
     ''' Returns a deep copy of the given Function/Constant. '''
     if hasattr(m, "vector"):
@@ -0,0 +1,122 @@
+"""
+Concurrent execution of independent adjoint equations.
+
+The adjoint equation of the variable solved for by equation i needs the adjoint solutions of
+the equations that depend on that variable, and nothing else. Equations whose adjoints do not
+need each other, e.g. those of the fields of a segregated scheme within a timestep or of
+independent diagnostic fields, can be solved at the same time. From the dependencies recorded
+for each equation, the adjoint equations are grouped into levels: the adjoint equations of a
+level only need the adjoint solutions of the earlier levels.
+
+When parameters["adjoint"]["adjoint_threads"] is greater than one, :py:func:`compute_gradient`
+solves the adjoint equations of each level concurrently on a pool of threads (the linear
+algebra of the backend releases the interpreter lock). The adjoint equations of a level are
+first assembled one after the other in the main thread: the assembly callbacks set the values
+of the Expressions and Constants of each equation, and libadjoint is not reentrant. The linear
+solves that the assembly queues with :py:func:`linear_solve` then run on the threads; the
+solves that assemble as they go, such as the matrix-free ones, run during the assembly. Recording
+the adjoint solutions, their contributions to the gradient, the callbacks and the forgetting of
+the values that are no longer needed all happen in the main thread, in the order of the
+sequential reverse sweep, so that the gradient is identical to the sequential one. The solves
+that use a cached operator or solver hold caching.lock, so that they run one after the other.
+In parallel and with checkpointing the adjoint equations are always solved one after the other.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+import backend
+
+import adjglobals
+import caching
+import liveness
+import misc
+
+# The linear solves queued while the adjoint equations of a level are assembled, or None
+queue = None
+
+def linear_solve(solve, cached=False):
+  '''Run solve(), the linear algebra of a solve whose operator and right-hand side have been
+  assembled. If cached, solve uses a cached operator or solver, and holds caching.lock. While
+  the adjoint equations of a level are assembled, the solve is queued instead, to run
+  concurrently with the other solves of the level.'''
+  if queue is None:
+    with caching.lock_if(cached):
+      solve()
+  else:
+    queue.append((solve, cached))
+
+def threads():
+  '''The number of threads to solve independent adjoint equations with, or 1 if the reverse
+  sweep has to be sequential.'''
+  n = backend.parameters["adjoint"]["adjoint_threads"]
+  if n <= 1 or misc.size() > 1:
+    return 1
+  if adjglobals.adjointer.get_checkpoint_strategy() is not None:
+    return 1
+  return n
+
+def adjoint_levels():
+  '''Group the adjoint equations into levels that can be solved concurrently. Returns a list
+  of lists of equation indices, in the order the levels have to be solved in and with the
+  indices of each level in descending order, or None if the dependencies of some equation
+  are not known.'''
+  adjointer = adjglobals.adjointer
+  n = adjointer.equation_count
+  if len(liveness.equations) != n:
+    return None
+
+  index = {}
+  for i in range(n):
+    index[str(adjointer.get_forward_variable(i))] = i
+
+  # needs[i]: the equations whose adjoint solutions the adjoint equation i needs
+  needs = [set() for i in range(n)]
+  for j in range(n):
+    for dep in liveness.equations[j]:
+      i = index.get(str(dep))
+      if i is not None and i < j:
+        needs[i].add(j)
+
+  level = [0] * n
+  for i in reversed(range(n)):
+    if needs[i]:
+      level[i] = 1 + max(level[j] for j in needs[i])
+
+  levels = [[] for l in range(max(level) + 1)] if n > 0 else []
+  for i in reversed(range(n)):
+    levels[level[i]].append(i)
+
+  return levels
+
+class AdjointScheduler(object):
+  '''Solves the linear systems of the adjoint equations of each level on a pool of threads.'''
+
+  def __init__(self, threads):
+    self.pool = ThreadPool(threads)
+
+  def assemble(self, f, equations):
+    '''Call f on each of the equations in turn, queueing the linear solves it asks for, and
+    then run the queued solves concurrently. Returns the results of f, which are complete
+    once the solves have run.'''
+    global queue
+    queue = []
+    try:
+      results = [f(i) for i in equations]
+      solves = queue
+    finally:
+      queue = None
+
+    def run(item):
+      (solve, cached) = item
+      with caching.lock_if(cached):
+        solve()
+
+    if len(solves) > 1:
+      self.pool.map(run, solves)
+    else:
+      [run(item) for item in solves]
+    return results
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
@@ -27,6 +27,9 @@ if backend.__name__ == "dolfin":
   import lusolver
 import utils
 import caching
+import formtable
+import tape
+import liveness
 
 def annotate(*args, **kwargs):
   '''This routine handles all of the annotation, recording the solves as they
@@ -49,6 +52,10 @@ def annotate(*args, **kwargs):
     replace_map = kwargs['replace_map']
     del kwargs['replace_map']
 
+  # Whether to cache the assembled operator of this block on the way backwards
+  # (True or False), or None to cache it if the user assembled it in the forward model
+  cache_assembly = kwargs.pop('cache_assembly', None)
+
   if isinstance(args[0], ufl.classes.Equation):
     # annotate !
 
@@ -73,19 +80,17 @@ def annotate(*args, **kwargs):
 
   elif isinstance(args[0], compatibility.matrix_types()):
     linear = True
-    try:
-      eq_lhs = args[0].form
-    except (KeyError, AttributeError) as e:
+    eq_lhs = formtable.get(args[0], 'form')
+    if eq_lhs is None:
       raise libadjoint.exceptions.LibadjointErrorInvalidInputs("dolfin_adjoint did not assemble your form, and so does not recognise your matrix. Did you from dolfin_adjoint import *?")
 
-    try:
-      eq_rhs = args[2].form
-    except (KeyError, AttributeError) as e:
+    eq_rhs = formtable.get(args[2], 'form')
+    if eq_rhs is None:
       raise libadjoint.exceptions.LibadjointErrorInvalidInputs("dolfin_adjoint did not assemble your form, and so does not recognise your right-hand side. Did you from dolfin_adjoint import *?")
 
-    u = args[1]
-    u = u.function
+    u = formtable.get(args[1], 'function')
 
+    J = None
     solver_parameters = {}
 
     try:
@@ -98,11 +103,7 @@ def annotate(*args, **kwargs):
     except IndexError:
       pass
 
-    try:
-      eq_bcs = misc.uniq(args[0].bcs + args[2].bcs)
-    except AttributeError:
-      assert not hasattr(args[0], 'bcs') and not hasattr(args[2], 'bcs')
-      eq_bcs = []
+    eq_bcs = misc.uniq(formtable.get(args[0], 'bcs', []) + formtable.get(args[2], 'bcs', []))
   else:
     print "args[0].__class__: ", args[0].__class__
     raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to annotate your equation, sorry!")
@@ -184,7 +185,11 @@ def annotate(*args, **kwargs):
     constant.update_constants(frozen_constants)
     eq_l = backend.replace(eq_lhs, dict(zip(diag_coeffs, value_coeffs)))
 
-    kwargs = {"cache": eq_l in caching.assembled_fwd_forms} # should we cache our matrices on the way backwards?
+    # should we cache our matrices on the way backwards?
+    if cache_assembly is None:
+      kwargs = {"cache": caching.assembly_cache.assembled_in_forward(eq_l)}
+    else:
+      kwargs = {"cache": cache_assembly}
 
     if hermitian:
       # Homogenise the adjoint boundary conditions. This creates the adjoint
@@ -326,6 +331,12 @@ def annotate(*args, **kwargs):
 
   eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
 
+  if linear:
+    tape.record_solve(linear, eq_lhs, eq_rhs, u, eq_bcs, None, solver_parameters, initial_guess, var, frozen_expressions, frozen_constants)
+  else:
+    tape.record_solve(linear, F, None, u, bcs, J, solver_parameters, initial_guess, var, frozen_expressions, frozen_constants)
+  liveness.record(diag_deps + rhs.dependencies(), nonlinear_block=len(diag_deps) > 0)
+
   cs = adjglobals.adjointer.register_equation(eqn)
   do_checkpoint(cs, var, rhs)
 
@@ -339,12 +350,16 @@ def solve(*args, **kwargs):
   To disable the annotation, just pass :py:data:`annotate=False` to this routine, and it acts exactly like the
   Dolfin solve call. This is useful in cases where the solve is known to be irrelevant or diagnostic
   for the purposes of the adjoint computation (such as projecting fields to other function spaces
-  for the purposes of visualisation).'''
+  for the purposes of visualisation).
+
+  Pass :py:data:`cache_assembly=True` (or False) to force (or prevent) the caching of the assembled
+  operator of this solve in the adjoint and tangent linear models.'''
 
   # First, decide if we should annotate or not.
   to_annotate = utils.to_annotate(kwargs.pop("annotate", None))
+  cache_assembly = kwargs.pop("cache_assembly", None)
   if to_annotate:
-    linear = annotate(*args, **kwargs)
+    linear = annotate(*args, cache_assembly=cache_assembly, **kwargs)
 
   # Avoid recursive annotation
   flag = misc.pause_annotation()
@@ -365,7 +380,7 @@ def solve(*args, **kwargs):
         u  = unpacked_args[1]
         adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
       elif isinstance(args[0], compatibility.matrix_types()):
-        u = args[1].function
+        u = formtable.get(args[1], 'function')
         adjglobals.adjointer.record_variable(adjglobals.adj_variables[u], libadjoint.MemoryStorage(adjlinalg.Vector(u)))
       else:
         raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Don't know how to record, sorry")
@@ -426,6 +441,8 @@ def register_initial_condition(coeff, dep):
 
   rhs = adjrhs.RHS(init_rhs)
   initial_eq = libadjoint.Equation(dep, blocks=[identity_block], targets=[dep], rhs=rhs)
+  tape.record_initial(coeff, dep, init_rhs.data)
+  liveness.record(rhs.dependencies())
   cs = adjglobals.adjointer.register_equation(initial_eq)
   assert adjglobals.adjointer.variable_known(dep)
   do_checkpoint(cs, dep, rhs)
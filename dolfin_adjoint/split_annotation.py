@@ -6,6 +6,7 @@ import solving
 import assignment
 import expressions
 import adjrhs
+import liveness
 
 import hashlib
 import random
@@ -48,6 +49,7 @@ def annotate_split(bigfn, idx, smallfn, bcs):
   rhs = SplitRHS(test, bigfn, idx)
 
   eqn = libadjoint.Equation(var, blocks=[diag_block], targets=[var], rhs=rhs)
+  liveness.record(diag_deps + rhs.dependencies())
 
   cs = adjglobals.adjointer.register_equation(eqn)
   solving.do_checkpoint(cs, var, rhs)
@@ -0,0 +1,594 @@
+"""
+Export of the annotation to a file, and its import into another process.
+
+The equations of the annotation are held by the in-process :py:data:`adjointer` as closures
+over forms and Functions, which cannot be moved to another process. To make the tape portable,
+when parameters["adjoint"]["record_tape"] is set, every annotation that goes through the
+ordinary dolfin-adjoint entry points (:py:func:`solve` and the solver classes built on it,
+:py:meth:`Function.assign`, copying a Function and the registration of initial conditions) is
+also logged here. The log holds references to the forms, Functions and initial values of every
+equation for as long as the annotation, so it is off by default. :py:func:`adj_export_tape` writes the
+log to a compact binary file: for every equation the forms (as their UFL representation, with
+the coefficients bound to a table of Functions and Constants), the boundary conditions, the
+solver parameters, the time level information and the forward values libadjoint holds for the
+equation, and optionally a functional and the control bindings. :py:func:`adj_import_tape`
+rebuilds an equivalent annotation in a fresh process that has the same mesh(es), by replaying
+the logged annotation calls (not the forward model) on Functions in rebuilt function spaces:
+
+.. code-block:: python
+
+  # in the process that runs the forward model, before annotating it
+  parameters["adjoint"]["record_tape"] = True
+  ...
+  adj_export_tape("tape.bin", functional=J, controls=Control(m))
+
+  # in a worker process
+  tape = adj_import_tape("tape.bin", mesh)
+  rf = ReducedFunctional(tape.functional, tape.controls)
+
+Expressions are stored as their interpolant into their own element at each annotated solve,
+which is also how they are assembled. Equations annotated by other means (e.g. point integral
+solvers, matrix-free operators or FunctionAssigners) cannot be exported. In parallel, each
+process writes (and reads) its own file, with the rank appended to the filename.
+"""
+
+import copy
+import cPickle as pickle
+import numpy
+
+import ufl
+import ufl.classes
+import ufl.algorithms
+import backend
+import libadjoint
+import libadjoint.exceptions
+
+import adjglobals
+import adjlinalg
+import expressions
+import constant
+import misc
+
+version = 1
+
+# The log of the annotation calls, in the order of the equations they registered
+entries = []
+
+def active():
+  '''Whether the annotation calls are logged.'''
+  return backend.parameters["adjoint"]["record_tape"]
+
+def record_initial(coeff, dep, value):
+  '''Log the registration of the initial condition dep of coeff, whose value is the Function value.'''
+  if not active():
+    return
+  entries.append({"kind": "initial", "function": coeff, "var": dep, "value": value,
+                  "timestep": adjglobals.adj_variables.libadjoint_timestep})
+
+def record_solve(linear, lhs, rhs, u, bcs, J, solver_parameters, initial_guess, var, frozen_expressions, frozen_constants):
+  '''Log a solve registered by :py:func:`solving.annotate`. For nonlinear solves, lhs is the residual
+  form and rhs is None.'''
+  if not active():
+    return
+  entries.append({"kind": "solve", "linear": linear, "lhs": lhs, "rhs": rhs, "u": u, "bcs": list(bcs or []),
+                  "J": J, "solver_parameters": solver_parameters, "initial_guess": initial_guess, "var": var,
+                  "expressions": frozen_expressions, "constants": frozen_constants,
+                  "timestep": adjglobals.adj_variables.libadjoint_timestep})
+
+def record_assign(target, functions, weights, var):
+  '''Log the assignment of a linear combination of Functions.'''
+  if not active():
+    return
+  entries.append({"kind": "assign", "function": target, "functions": list(functions),
+                  "weights": [float(w) for w in weights], "var": var,
+                  "timestep": adjglobals.adj_variables.libadjoint_timestep})
+
+def record_copy(target, source, var):
+  '''Log the copy of the Function source into target.'''
+  if not active():
+    return
+  entries.append({"kind": "copy", "function": target, "source": source, "var": var,
+                  "timestep": adjglobals.adj_variables.libadjoint_timestep})
+
+def clear():
+  del entries[:]
+
+def _filename(filename):
+  if misc.size() > 1:
+    return "%s.%d" % (filename, misc.rank())
+  return filename
+
+def _var_key(var):
+  return (var.name, var.timestep, var.iteration)
+
+def _form_mesh(form):
+  for arg in ufl.algorithms.extract_arguments(form):
+    return arg.function_space().mesh()
+  for coeff in ufl.algorithms.extract_coefficients(form):
+    if hasattr(coeff, "function_space"):
+      return coeff.function_space().mesh()
+  raise libadjoint.exceptions.LibadjointErrorNotImplemented("Cannot export a form without arguments or Functions")
+
+class SubdomainData(object):
+  '''A placeholder for the subdomain data of an integral in an exported form.'''
+  def __init__(self, index):
+    self.index = index
+
+  def __repr__(self):
+    return "SubdomainData(%d)" % self.index
+
+class FrozenExpression(backend.Expression):
+  '''An Expression that evaluates to an interpolant of an exported Expression.'''
+  def __init__(self, snapshot, **kwargs):
+    # Bypass the recording of the Expression attributes in expressions.py
+    self.__dict__["snapshot"] = snapshot
+
+  def eval(self, values, x):
+    self.snapshot.eval(values, x)
+
+  def value_shape(self):
+    return self.snapshot.shape()
+
+class _Exporter(object):
+  '''Translates the logged annotation into picklable descriptions.'''
+
+  def __init__(self):
+    self.meshes = []
+    self.functions = []
+    self.constants = []
+    self.constant_objects = []
+    self.meshfunctions = []
+    self.function_index = {}
+    self.constant_index = {}
+    self.meshfunction_index = {}
+
+  def mesh(self, mesh):
+    label = mesh.ufl_domain().label()
+    if label not in self.meshes:
+      self.meshes.append(label)
+    return label
+
+  def function(self, f):
+    if id(f) not in self.function_index:
+      V = f.function_space()
+      self.mesh(V.mesh())
+      self.function_index[id(f)] = len(self.functions)
+      self.functions.append({"name": str(f), "adj_name": getattr(f, "adj_name", None),
+                             "element": repr(V.ufl_element())})
+    return self.function_index[id(f)]
+
+  def constant(self, c):
+    if id(c) not in self.constant_index:
+      named = any(obj is c for obj in constant.constant_objects.values())
+      self.constant_index[id(c)] = len(self.constants)
+      self.constant_objects.append(c)
+      self.constants.append({"name": c.adj_name if named else None, "value": c.values().copy(),
+                             "shape": c.shape()})
+    return self.constant_index[id(c)]
+
+  def meshfunction(self, mf):
+    if id(mf) not in self.meshfunction_index:
+      self.meshfunction_index[id(mf)] = len(self.meshfunctions)
+      self.meshfunctions.append({"mesh": self.mesh(mf.mesh()), "dim": mf.dim(), "values": mf.array().copy()})
+    return self.meshfunction_index[id(mf)]
+
+  def form(self, form):
+    '''Describe a form by its representation and the bindings of its coefficients.'''
+    if form is None:
+      return None
+    if not isinstance(form, ufl.Form):
+      raise libadjoint.exceptions.LibadjointErrorNotImplemented("Can only export UFL forms, not %s" % form.__class__.__name__)
+
+    integrals = []
+    for integral in form.integrals():
+      data = integral.subdomain_data()
+      if data is not None:
+        integral = integral.reconstruct(subdomain_data=SubdomainData(self.meshfunction(data)))
+      integrals.append(integral)
+    form = ufl.Form(integrals)
+
+    bindings = {}
+    for coeff in ufl.algorithms.extract_coefficients(form):
+      if isinstance(coeff, backend.Function):
+        bindings[coeff.count()] = ("function", self.function(coeff))
+      elif isinstance(coeff, backend.Constant):
+        bindings[coeff.count()] = ("constant", self.constant(coeff))
+      elif isinstance(coeff, backend.Expression):
+        # Expressions are assembled through their interpolant into their own element
+        mesh = _form_mesh(form)
+        element = coeff.element()
+        if element.domain() is None:
+          element = element.reconstruct(domain=mesh.ufl_domain())
+        V = backend.FunctionSpaceBase(mesh, element)
+        snapshot = backend.interpolate(coeff, V)
+        bindings[coeff.count()] = ("expression", repr(element), snapshot.vector().array())
+      else:
+        raise libadjoint.exceptions.LibadjointErrorNotImplemented("Cannot export a coefficient of type %s" % coeff.__class__.__name__)
+
+    return {"repr": repr(form), "bindings": bindings}
+
+  def bc(self, bc):
+    '''Describe a DirichletBC by its boundary facets and values.'''
+    if not isinstance(bc, backend.DirichletBC):
+      raise libadjoint.exceptions.LibadjointErrorNotImplemented("Can only export DirichletBCs")
+    if bc.method() == "pointwise":
+      raise libadjoint.exceptions.LibadjointErrorNotImplemented("Cannot export pointwise DirichletBCs")
+
+    values = bc.get_boundary_values()
+    dofs = sorted(values.keys())
+    return {"component": [int(c) for c in bc.function_space().component()],
+            "facets": [int(f) for f in bc.markers()],
+            "method": bc.method(),
+            "dofs": dofs,
+            "values": [values[dof] for dof in dofs]}
+
+  def value(self, var):
+    '''The forward value libadjoint holds for var, or None.'''
+    try:
+      return adjglobals.adjointer.get_variable_value(var).data.vector().array()
+    except libadjoint.exceptions.LibadjointErrorNeedValue:
+      return None
+
+  def entry(self, entry):
+    kind = entry["kind"]
+    out = {"kind": kind, "var": _var_key(entry["var"]), "timestep": entry["timestep"]}
+
+    if kind == "initial":
+      out["function"] = self.function(entry["function"])
+      out["value"] = entry["value"].vector().array()
+      return out
+
+    out["value"] = self.value(entry["var"])
+    if kind == "assign":
+      out["function"] = self.function(entry["function"])
+      out["functions"] = [self.function(f) for f in entry["functions"]]
+      out["weights"] = entry["weights"]
+    elif kind == "copy":
+      out["function"] = self.function(entry["function"])
+      out["source"] = self.function(entry["source"])
+    else:
+      # Restore the state of the Expressions and Constants at annotation time
+      expressions.update_expressions(entry["expressions"])
+      constant.update_constants(entry["constants"])
+      u = entry["u"]
+      out["linear"] = entry["linear"]
+      out["u"] = self.function(u)
+      out["lhs"] = self.form(entry["lhs"])
+      out["rhs"] = self.form(entry["rhs"])
+      out["J"] = self.form(entry["J"])
+      out["bcs"] = [self.bc(bc) for bc in entry["bcs"]]
+      out["solver_parameters"] = copy.deepcopy(entry["solver_parameters"])
+      out["initial_guess"] = entry["initial_guess"]
+      out["constants"] = dict((c.adj_name, constant_value(value)) for (c, value) in entry["constants"].items())
+    return out
+
+  def control(self, control):
+    import controls
+    if isinstance(control, controls.ListControl):
+      return ("list", [self.control(c) for c in control.controls])
+    elif isinstance(control, controls.FunctionControl):
+      coeff = control.coeff
+      if isinstance(coeff, str):
+        coeff = adjglobals.adj_variables.str_to_coeff[coeff]
+      return ("function", self.function(coeff))
+    elif isinstance(control, controls.ConstantControl):
+      return ("constant", self.constant(constant.get_constant(control.a)), control.coeff)
+    raise libadjoint.exceptions.LibadjointErrorNotImplemented("Cannot export a control of type %s" % control.__class__.__name__)
+
+  def functional(self, functional):
+    import functional as functional_module
+    if functional.__class__ is not functional_module.Functional:
+      raise libadjoint.exceptions.LibadjointErrorNotImplemented("Can only export Functionals of forms")
+    return {"name": functional.name,
+            "terms": [(self.form(term.form), term.time) for term in functional.timeform.terms]}
+
+def adj_export_tape(filename, functional=None, controls=None):
+  '''Write the annotation, and optionally a :py:class:`Functional` and its controls, to filename.
+  See :py:func:`adj_import_tape` for reading it back.'''
+
+  adjointer = adjglobals.adjointer
+  if not active():
+    raise libadjoint.exceptions.LibadjointErrorInvalidInputs("The annotation calls are not logged: set parameters[\"adjoint\"][\"record_tape\"] "
+                                                             "before annotating the forward model to export it.")
+  if len(entries) != adjointer.equation_count:
+    raise libadjoint.exceptions.LibadjointErrorNotImplemented("Only annotations made with solve, the solver classes, Function.assign "
+                                                              "and Function copies while parameters[\"adjoint\"][\"record_tape\"] is set "
+                                                              "can be exported. %d of the %d equations were not."
+                                                              % (adjointer.equation_count - len(entries), adjointer.equation_count))
+
+  times = []
+  for timestep in range(adjointer.timestep_count):
+    try:
+      times.append(adjointer.get_times(timestep))
+    except Exception:
+      times = None
+      break
+
+  # Keep the current state of the Expressions and Constants, as the export steps through their
+  # values at annotation time
+  frozen_expressions = expressions.freeze_dict()
+  frozen_constants = constant.freeze_dict()
+
+  exporter = _Exporter()
+  try:
+    tape = {"version": version,
+            "entries": [exporter.entry(entry) for entry in entries],
+            "times": times,
+            "timestep": adjglobals.adj_variables.libadjoint_timestep,
+            "finished": bool(getattr(adjointer.time, "finished", False))}
+  finally:
+    expressions.update_expressions(frozen_expressions)
+    constant.update_constants(frozen_constants)
+
+  tape["functional"] = exporter.functional(functional) if functional is not None else None
+
+  if controls is None:
+    tape["controls"] = None
+  elif isinstance(controls, (list, tuple)):
+    tape["controls"] = ("sequence", [exporter.control(c) for c in controls])
+  else:
+    tape["controls"] = exporter.control(controls)
+
+  # The Constants end up with their current values
+  for (desc, c) in zip(exporter.constants, exporter.constant_objects):
+    desc["value"] = c.values().copy()
+
+  tape.update({"meshes": exporter.meshes, "functions": exporter.functions,
+               "constants": exporter.constants, "meshfunctions": exporter.meshfunctions})
+
+  with open(_filename(filename), "wb") as f:
+    pickle.dump(tape, f, pickle.HIGHEST_PROTOCOL)
+
+class ImportedTape(object):
+  '''The result of :py:func:`adj_import_tape`.'''
+
+  def __init__(self, functional, controls, functions, constants):
+    #: functional: the imported :py:class:`Functional`, or None.
+    self.functional = functional
+    #: controls: the imported controls, or None.
+    self.controls = controls
+    #: functions: the Functions of the tape, by name.
+    self.functions = functions
+    #: constants: the named Constants of the tape, by name.
+    self.constants = constants
+
+class _Importer(object):
+  '''Rebuilds the objects described by an exported tape.'''
+
+  def __init__(self, tape, meshes):
+    if isinstance(meshes, backend.Mesh):
+      meshes = [meshes]
+    if len(meshes) != len(tape["meshes"]):
+      raise libadjoint.exceptions.LibadjointErrorInvalidInputs("The tape was exported with %d meshes, but %d were given"
+                                                               % (len(tape["meshes"]), len(meshes)))
+
+    self.domains = dict((label, mesh.ufl_domain()) for (label, mesh) in zip(tape["meshes"], meshes))
+    self.spaces = {}
+    self.bindings = {}
+
+    self.namespace = dict(vars(ufl))
+    self.namespace.update(vars(ufl.classes))
+    self.namespace.update({"Domain": self.domain, "Coefficient": self.coefficient,
+                           "Argument": self.argument, "SubdomainData": self.subdomain_data})
+
+    self.meshfunctions = []
+    for desc in tape["meshfunctions"]:
+      mf = backend.MeshFunction("size_t", self.domains[desc["mesh"]].data(), desc["dim"])
+      mf.array()[:] = desc["values"]
+      self.meshfunctions.append(mf)
+
+    self.functions = []
+    for desc in tape["functions"]:
+      f = backend.Function(self.space(desc["element"]))
+      if desc["adj_name"] is not None:
+        f.adj_name = desc["adj_name"]
+      f.rename(desc["name"], "a Function imported by dolfin-adjoint")
+      self.functions.append(f)
+
+    self.constants = []
+    for desc in tape["constants"]:
+      value = desc["value"].reshape(desc["shape"]) if desc["shape"] != () else float(desc["value"][0])
+      if desc["name"] is not None:
+        self.constants.append(constant.Constant(value, name=desc["name"]))
+      else:
+        self.constants.append(backend.Constant(value))
+
+  def domain(self, *args, **kwargs):
+    label = kwargs.get("label")
+    if label in self.domains:
+      return self.domains[label]
+    if len(self.domains) == 1:
+      return self.domains.values()[0]
+    raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Unknown domain %s in the tape" % label)
+
+  def coefficient(self, element, count):
+    return self.bindings[count]
+
+  def argument(self, element, number, part=None):
+    return backend.Argument(self.space(element), number, part)
+
+  def subdomain_data(self, index):
+    return self.meshfunctions[index]
+
+  def element(self, element):
+    if isinstance(element, str):
+      return eval(element, self.namespace)
+    return element
+
+  def space(self, element):
+    element = self.element(element)
+    key = repr(element)
+    if key not in self.spaces:
+      self.spaces[key] = backend.FunctionSpaceBase(element.domain().data(), element)
+    return self.spaces[key]
+
+  def form(self, desc):
+    if desc is None:
+      return None
+
+    self.bindings = {}
+    for (count, binding) in desc["bindings"].items():
+      if binding[0] == "function":
+        self.bindings[count] = self.functions[binding[1]]
+      elif binding[0] == "constant":
+        self.bindings[count] = self.constants[binding[1]]
+      else:
+        element = self.element(binding[1])
+        snapshot = backend.Function(self.space(element))
+        set_value(snapshot, binding[2])
+        self.bindings[count] = FrozenExpression(snapshot, element=element)
+
+    return eval(desc["repr"], self.namespace)
+
+  def bc(self, desc, u):
+    V = u.function_space()
+    mesh = V.mesh()
+
+    facets = backend.MeshFunction("size_t", mesh, mesh.topology().dim() - 1, 0)
+    facets.array()[desc["facets"]] = 1
+
+    g = backend.Function(V)
+    values = g.vector().array()
+    values[desc["dofs"]] = desc["values"]
+    set_value(g, values)
+
+    for c in desc["component"]:
+      V = V.sub(c)
+      g = g.sub(c)
+
+    return backend.DirichletBC(V, g, facets, 1, desc["method"])
+
+  def control(self, desc):
+    import controls
+    if desc[0] == "sequence":
+      return [self.control(c) for c in desc[1]]
+    elif desc[0] == "list":
+      return controls.ListControl([self.control(c) for c in desc[1]])
+    elif desc[0] == "function":
+      return controls.FunctionControl(self.functions[desc[1]])
+    else:
+      return controls.ConstantControl(self.constants[desc[1]], coeff=desc[2])
+
+  def functional(self, desc):
+    import functional
+    import timeforms
+    terms = [timeforms.TimeTerm(self.form(form), time) for (form, time) in desc["terms"]]
+    return functional.Functional(timeforms.TimeForm(terms), name=desc["name"])
+
+def constant_value(value):
+  if isinstance(value, backend.Constant):
+    return value.values()
+  return numpy.array(value, dtype='d')
+
+def assign_constant(c, value):
+  if c.shape() == ():
+    c.assign(float(value.flat[0]))
+  else:
+    c.assign(backend.Constant(value.reshape(c.shape())))
+
+def set_value(f, values):
+  f.vector().set_local(values)
+  f.vector().apply("insert")
+
+def _check(var, key):
+  if _var_key(var) != key:
+    raise libadjoint.exceptions.LibadjointErrorInvalidInputs("The imported tape does not match: expected variable %s:%d:%d, got %s"
+                                                             % (key + (str(var),)))
+
+def _record(f, var, value):
+  if value is not None:
+    set_value(f, value)
+    adjglobals.adjointer.record_variable(var, libadjoint.MemoryStorage(adjlinalg.Vector(f)))
+
+def adj_import_tape(filename, meshes):
+  '''Replace the current annotation with the one exported to filename by :py:func:`adj_export_tape`.
+  meshes is the mesh (or the list of meshes, in the order they were exported) the tape was
+  annotated on. Returns an :py:class:`ImportedTape`, which holds the imported functional,
+  controls and Functions.'''
+
+  import solving
+  import function
+  import assignment
+
+  with open(_filename(filename), "rb") as f:
+    tape = pickle.load(f)
+
+  if tape["version"] != version:
+    raise libadjoint.exceptions.LibadjointErrorInvalidInputs("Unknown tape version %s" % tape["version"])
+
+  adjglobals.adj_reset()
+  importer = _Importer(tape, meshes)
+  functions = importer.functions
+  times = tape["times"]
+
+  if times:
+    adjglobals.adj_start_timestep(times[0][0])
+
+  def advance(timestep, finished=False):
+    while adjglobals.adj_variables.libadjoint_timestep < timestep:
+      current = adjglobals.adj_variables.libadjoint_timestep
+      time = times[current][1] if times and current < len(times) else None
+      adjglobals.adj_inc_timestep(time, finished=finished and current == timestep - 1)
+
+  # The forward values are recorded explicitly below, where the tape has them
+  record_all = backend.parameters["adjoint"]["record_all"]
+  backend.parameters["adjoint"]["record_all"] = False
+
+  try:
+    for entry in tape["entries"]:
+      advance(entry["timestep"])
+      kind = entry["kind"]
+
+      if kind == "initial":
+        f = functions[entry["function"]]
+        set_value(f, entry["value"])
+        var = adjglobals.adj_variables[f]
+        _check(var, entry["var"])
+        solving.register_initial_condition(f, var)
+        _record(f, var, entry["value"])
+        continue
+
+      if kind == "assign":
+        f = functions[entry["function"]]
+        if entry["value"] is None:
+          value = sum(w * functions[i].vector().array() for (i, w) in zip(entry["functions"], entry["weights"]))
+          set_value(f, value)
+        function.annotate_assign(f, [functions[i] for i in entry["functions"]], entry["weights"])
+      elif kind == "copy":
+        f = functions[entry["function"]]
+        set_value(f, functions[entry["source"]].vector().array())
+        assignment.register_assign(f, functions[entry["source"]])
+      else:
+        f = functions[entry["u"]]
+        for c in importer.constants:
+          if hasattr(c, "adj_name") and c.adj_name in entry["constants"]:
+            assign_constant(c, entry["constants"][c.adj_name])
+
+        bcs = [importer.bc(bc, f) for bc in entry["bcs"]]
+        if entry["linear"]:
+          eq = importer.form(entry["lhs"]) == importer.form(entry["rhs"])
+        else:
+          eq = importer.form(entry["lhs"]) == 0
+        solving.annotate(eq, f, bcs, J=importer.form(entry["J"]), solver_parameters=entry["solver_parameters"],
+                         initial_guess=entry["initial_guess"])
+
+      var = adjglobals.adj_variables[f]
+      _check(var, entry["var"])
+      _record(f, var, entry["value"])
+
+    advance(tape["timestep"], finished=tape["finished"])
+    if tape["finished"] and not getattr(adjglobals.adjointer.time, "finished", True):
+      adjglobals.adjointer.time.finish()
+  finally:
+    backend.parameters["adjoint"]["record_all"] = record_all
+
+  for (desc, c) in zip(tape["constants"], importer.constants):
+    if desc["name"] is not None:
+      assign_constant(c, desc["value"])
+
+  functional = importer.functional(tape["functional"]) if tape["functional"] is not None else None
+  controls = importer.control(tape["controls"]) if tape["controls"] is not None else None
+
+  return ImportedTape(functional, controls,
+                      dict((str(f), f) for f in functions),
+                      dict((c.adj_name, c) for c in importer.constants if hasattr(c, "adj_name")))
@@ -0,0 +1,119 @@
+"""
+Structured telemetry for optimisation runs.
+
+When telemetry is active, dolfin-adjoint counts the forward replays, adjoint, tangent linear
+and second-order adjoint sweeps and cache hits, and splits the wall time into the phases
+replay, functional (evaluation and assembly of the functional), adjoint, tlm, soa, gather
+(serialisation of controls and gradients) and optimizer (everything else, i.e. the
+overhead of the optimisation algorithm and the user code).
+
+One record is kept per optimisation iteration. Iterations are delimited by the gradient
+evaluations of :py:class:`ReducedFunctionalNumPy`, or by explicit calls to
+:py:meth:`Telemetry.end_iteration`. The records can be exported as JSON lines:
+
+.. code-block:: python
+
+  start_telemetry("telemetry.jsonl")
+  minimize(rf)
+  stop_telemetry()
+"""
+
+import json
+import time
+from contextlib import contextmanager
+import misc
+
+counters = ["forward_replays", "adjoint_sweeps", "tlm_sweeps", "soa_sweeps", "cache_hits"]
+phases = ["replay", "functional", "adjoint", "tlm", "soa", "gather", "optimizer"]
+
+class Telemetry(object):
+  '''Collects per-iteration solve counts and phase timings.'''
+
+  def __init__(self):
+    self.active = False
+    self.filename = None
+    self.records = []
+    self.iteration = 0
+    self._stack = []
+    self.__reset_record()
+
+  def __reset_record(self):
+    self.counts = dict((c, 0) for c in counters)
+    self.times = dict((p, 0.0) for p in phases)
+    self.record_start = time.time()
+
+  def start(self, filename=None):
+    '''Start recording. If filename is given, every record is appended to it as a line of JSON.'''
+    self.active = True
+    self.filename = filename
+    self.records = []
+    self.iteration = 0
+    self._stack = []
+    self.__reset_record()
+
+  def stop(self):
+    '''Finish the current record and stop recording.'''
+    if not self.active:
+      return
+    if any(self.counts.values()):
+      self.end_iteration()
+    self.active = False
+
+  def count(self, counter, n=1):
+    if self.active:
+      self.counts[counter] += n
+
+  @contextmanager
+  def phase(self, name):
+    '''Charge the wall time spent in the block to the given phase. Phases nest, and
+    the time of a nested phase is not charged to the enclosing one.'''
+    if not self.active:
+      yield
+      return
+
+    now = time.time()
+    if self._stack:
+      (outer, since) = self._stack[-1]
+      self.times[outer] += now - since
+    self._stack.append((name, now))
+    try:
+      yield
+    finally:
+      now = time.time()
+      (name, since) = self._stack.pop()
+      self.times[name] += now - since
+      if self._stack:
+        self._stack[-1] = (self._stack[-1][0], now)
+
+  def end_iteration(self):
+    '''Close the record of the current iteration and start a new one.'''
+    if not self.active:
+      return
+
+    wall = time.time() - self.record_start
+    times = dict(self.times)
+    times["optimizer"] = max(0.0, wall - sum(self.times[p] for p in phases if p != "optimizer"))
+
+    record = {"iteration": self.iteration, "wall": wall, "time": times}
+    record.update(self.counts)
+    self.records.append(record)
+
+    if self.filename is not None and misc.rank() == 0:
+      with open(self.filename, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    self.iteration += 1
+    self.__reset_record()
+
+telemetry = Telemetry()
+
+def start_telemetry(filename=None):
+  '''Start recording optimisation telemetry, optionally exporting it to filename as JSON lines.
+  Returns the :py:class:`Telemetry` object, whose records attribute holds the records as dictionaries.'''
+  telemetry.start(filename)
+  return telemetry
+
+def stop_telemetry():
+  '''Stop recording optimisation telemetry and return the records.'''
+  telemetry.stop()
+  return telemetry.records
@@ -12,11 +12,14 @@ from controls import ConstantControls
 
 from solving import solve, adj_checkpointing, annotate, record
 from adjglobals import adj_start_timestep, adj_inc_timestep, adjointer, adj_check_checkpoints, adj_html, adj_reset
-from gst import compute_gst, compute_propagator_matrix, perturbed_replay
+from gst import compute_gst, compute_gst_randomized, compute_propagator_matrix, perturbed_replay, perturbed_replay_batch
 from utils import convergence_order, DolfinAdjointVariable
 from utils import test_initial_condition_adjoint, test_initial_condition_adjoint_cdiff, test_initial_condition_tlm, test_scalar_parameter_adjoint, test_scalar_parameters_adjoint, taylor_test
 from utils import taylor_test_expression
+from telemetry import start_telemetry, stop_telemetry
+from inexactness import start_inexactness_control, stop_inexactness_control, InexactnessController
 from drivers import replay_dolfin, compute_adjoint, compute_tlm, compute_gradient, hessian, compute_gradient_tlm
+from scheduling import adjoint_levels
 
 from variational_solver import NonlinearVariationalSolver, NonlinearVariationalProblem, LinearVariationalSolver, LinearVariationalProblem
 from projection import project
@@ -38,9 +41,13 @@ if backend.__name__ == "dolfin":
   from lusolver import LUSolver
   from localsolver import LocalSolver
   from reduced_functional import ReducedFunctional
+  from observation import ObservationFunctional
+  from tape import adj_export_tape, adj_import_tape
   from reduced_functional_numpy import ReducedFunctionalNumPy, ReducedFunctionalNumpy
+  from lowrank import LowRankHessian, ControlMassMatrix
   from optimization.optimization import minimize, maximize, print_optimization_methods, minimise, maximise
   from optimization.multistage_optimization import minimize_multistage
+  from optimization.multistart import minimize_multistart
   from optimization.constraints import InequalityConstraint, EqualityConstraint
   from pointintegralsolver import *
   if hasattr(backend, 'FunctionAssigner'):
@@ -11,6 +11,7 @@ import projection
 import functional
 import drivers
 import math
+import misc
 from controls import ListControl, Control
 if backend.__name__  == "dolfin":
   from backend import cpp
@@ -79,6 +80,34 @@ def randomise(x):
         numpy.random.seed(seed=21)
         x[:] = numpy.random.random(len(x))
 
+# The functional and inputs of the current evaluate_concurrently call, inherited by the forked workers
+_concurrent_evaluation = None
+
+def _evaluate_concurrent_input(i):
+  (J, inputs) = _concurrent_evaluation
+  return J(inputs[i])
+
+def evaluate_concurrently(J, inputs, processes=1):
+  """Returns [J(x) for x in inputs]. If processes > 1, the evaluations are distributed over a pool
+     of forked worker processes. Each worker evaluates J on its own copy-on-write snapshot of the tape,
+     so the tape (and hence the forward state) of the calling process is left untouched.
+     In parallel (MPI) runs, the evaluations are always done one after another."""
+
+  global _concurrent_evaluation
+
+  if processes <= 1 or len(inputs) <= 1 or misc.size() > 1:
+    return [J(x) for x in inputs]
+
+  import multiprocessing
+  _concurrent_evaluation = (J, inputs)
+  pool = multiprocessing.Pool(min(processes, len(inputs)))
+  try:
+    return pool.map(_evaluate_concurrent_input, range(len(inputs)), chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+    _concurrent_evaluation = None
+
 def convergence_order(errors, base = 2):
   import math
 
@@ -387,11 +416,13 @@ def test_scalar_parameters_adjoint(J, a, dJda, seed=0.1):
 
   return min(convergence_order(with_gradient))
 
-def test_gradient_array(J, dJdx, x, seed = 0.01, perturbation_direction = None, random_seed = 118):
+def test_gradient_array(J, dJdx, x, seed = 0.01, perturbation_direction = None, random_seed = 118, Jx = None, processes = 1):
   '''Checks the correctness of the derivative dJ.
      x must be an array that specifies at which point in the parameter space
      the gradient is to be checked, and dJdx must be an array containing the gradient.
      The function J(x) must return the functional value.
+     If the functional value Jx at x is already known, it can be passed in to save an evaluation.
+     If processes > 1, the perturbed functionals are evaluated concurrently (see evaluate_concurrently).
 
      This function returns the order of convergence of the Taylor
      series remainder, which should be 2 if the gradient is correct.'''
@@ -401,7 +432,10 @@ def test_gradient_array(J, dJdx, x, seed = 0.01, perturbation_direction = None,
   info("Running Taylor remainder convergence analysis to check the gradient ... ")
 
   # First run the problem unperturbed
-  j_direct = J(x)
+  if Jx is None:
+    j_direct = J(x)
+  else:
+    j_direct = Jx
 
   # Randomise the perturbation direction:
   if perturbation_direction is None:
@@ -409,15 +443,15 @@ def test_gradient_array(J, dJdx, x, seed = 0.01, perturbation_direction = None,
     randomise(perturbation_direction)
 
   # Run the forward problem for various perturbed initial conditions
-  functional_values = []
   perturbations = []
+  perturbed_xs = []
   perturbation_sizes = [seed/(2**i) for i in range(5)]
   for perturbation_size in perturbation_sizes:
     perturbation = perturbation_direction.copy() * perturbation_size
     perturbations.append(perturbation)
+    perturbed_xs.append(x.copy() + perturbation)
 
-    perturbed_x = x.copy() + perturbation
-    functional_values.append(J(perturbed_x))
+  functional_values = evaluate_concurrently(J, perturbed_xs, processes)
 
   # First-order Taylor remainders (not using adjoint)
   no_gradient = [abs(perturbed_j - j_direct) for perturbed_j in functional_values]
@@ -438,7 +472,7 @@ def test_gradient_array(J, dJdx, x, seed = 0.01, perturbation_direction = None,
 
   return min(convergence_order(with_gradient))
 
-def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None, value=None):
+def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None, value=None, processes=1):
   '''J must be a function that takes in a parameter value m and returns the value
      of the functional:
 
@@ -456,7 +490,10 @@ def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None
      direction and returns the Hessian of the functional in that direction
      (i.e., takes in a vector and returns a vector). In that case, an additional
      Taylor remainder is computed, which should converge at order 3 if the Hessian
-     is correct.'''
+     is correct.
+
+     If processes > 1, the perturbed functionals are evaluated concurrently
+     in a pool of worker processes (see evaluate_concurrently).'''
 
   info_blue("Running Taylor remainder convergence test ... ")
   import controls
@@ -471,7 +508,7 @@ def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None
     if value is None:
       value = [None] * len(m.controls)
 
-    return min(taylor_test(J, m[i], Jm, dJdm[i], HJm, seed, perturbation_direction[i], value[i]) for i in range(len(m.controls)))
+    return min(taylor_test(J, m[i], Jm, dJdm[i], HJm, seed, perturbation_direction[i], value[i], processes) for i in range(len(m.controls)))
 
   def get_const(val):
     if isinstance(val, str):
@@ -569,10 +606,7 @@ def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None
       HJm_values.append(HJmp)
 
   # At last: the common bit!
-  functional_values = []
-  for pinput in pinputs:
-    Jp = J(pinput)
-    functional_values.append(Jp)
+  functional_values = evaluate_concurrently(J, pinputs, processes)
 
   # First-order Taylor remainders (not using adjoint)
   no_gradient = [abs(perturbed_J - Jm) for perturbed_J in functional_values]
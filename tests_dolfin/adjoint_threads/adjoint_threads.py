@@ -0,0 +1,64 @@
+"""
+Solving the independent adjoint equations concurrently gives the same gradient as the
+sequential reverse sweep, also when the equations share cached operators and solvers, and
+when the equations of a level use different values of the same Constants and Expressions.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(16, 16)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=False):
+
+    # Two fields that diffuse the same initial condition independently, with diffusivities
+    # and a source that change from field to field and from timestep to timestep
+    u_ = Function(ic, name="Temperature")
+    p_ = Function(ic, name="Tracer")
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    timestep = Constant(0.05)
+    kappa = Constant(0.1)
+    weight = Constant(0.0)
+    source = Expression("t*x[0]*x[1]", t=0.0)
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.2
+    while (t < end):
+        for (field, k, w) in ((u_, 0.1 + t, 0.0), (p_, 0.2 + 2*t, 1.0)):
+            kappa.assign(k)
+            weight.assign(w)
+            F = ((u - field)/timestep*v + kappa*inner(grad(u), grad(v)) - weight*source*v)*dx
+            solve(lhs(F) == rhs(F), field, bc, annotate=annotate)
+
+        t += float(timestep)
+        source.t = t
+        adj_inc_timestep()
+
+    return (u_, p_)
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(pi*x[0])*sin(pi*x[1])"), V)
+    (u, p) = main(ic, annotate=True)
+
+    J = Functional(u*u*p*dx*dt[FINISH_TIME])
+    m = Control(ic)
+
+    levels = adjoint_levels()
+    assert max(len(level) for level in levels) > 1
+
+    for cache in [False, True]:
+        parameters["adjoint"]["cache_factorizations"] = cache
+
+        parameters["adjoint"]["adjoint_threads"] = 1
+        dJdm = compute_gradient(J, m, forget=False)
+
+        parameters["adjoint"]["adjoint_threads"] = 2
+        dJdm_threaded = compute_gradient(J, m, forget=False)
+
+        info("|dJ/dm| = %s, %s" % (norm(dJdm), norm(dJdm_threaded)))
+        assert (dJdm.vector() - dJdm_threaded.vector()).norm("l2") == 0.0
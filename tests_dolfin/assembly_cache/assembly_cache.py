@@ -0,0 +1,67 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic):
+  u = TrialFunction(V)
+  v = TestFunction(V)
+  bc = DirichletBC(V, 0.0, "on_boundary")
+
+  u_old = Function(ic, name="Temperature")
+  u_new = Function(V, name="TemperatureNext")
+
+  # The operator is assembled by the user, so its adjoint is cached on the way backwards
+  A = assemble(inner(u, v)*dx + 0.1*inner(grad(u), grad(v))*dx)
+  bc.apply(A)
+
+  for i in range(5):
+    b = assemble(inner(u_old, v)*dx)
+    bc.apply(b)
+    solve(A, u_new.vector(), b)
+    u_old.assign(u_new)
+
+  return u_old
+
+if __name__ == "__main__":
+  ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])"), V)
+  u = main(ic)
+
+  J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+
+  caching.assembly_cache.hits = caching.assembly_cache.misses = 0
+  dJdic = compute_gradient(J, Control(ic), forget=False)
+
+  # The adjoint operator is the same in every timestep: it is assembled once
+  stats = caching.assembly_cache.statistics()
+  info("Assembly cache statistics: %s" % stats)
+  assert stats["misses"] == 1
+  assert stats["hits"] >= 4
+
+  # Replays of the forward model do not assemble the operator again, but it is still
+  # cached on the way backwards in every evaluation of the reduced functional
+  rf_np = ReducedFunctionalNumPy(ReducedFunctional(J, Control(ic)))
+  ic_array = rf_np.get_controls()
+  for x in [ic_array, 0.5*ic_array]:
+    rf_np(x)
+    caching.assembly_cache.hits = caching.assembly_cache.misses = 0
+    rf_np.derivative(x, forget=False)
+    assert caching.assembly_cache.statistics()["misses"] == 1
+    assert caching.assembly_cache.statistics()["hits"] >= 4
+
+  # The cache can be bounded
+  parameters["adjoint"]["assembly_cache_size"] = 0
+  caching.assembly_cache.tensors.clear()
+  dJdic = compute_gradient(J, Control(ic), forget=False)
+  assert caching.assembly_cache.statistics()["size"] == 0
+  assert caching.assembly_cache.statistics()["evictions"] > 0
+
+  # The digest of a Function is kept until the values of its vector change
+  f = Function(ic)
+  digest = caching.coefficient_digest(f)
+  assert caching.coefficient_digest(f) == digest
+  f.vector()[:] = 2.0*f.vector()
+  assert caching.coefficient_digest(f) != digest
+  assert caching.bc_digest(DirichletBC(V, 1.0, "on_boundary")) == caching.bc_digest(DirichletBC(V, 0.0, "on_boundary"))
@@ -0,0 +1,56 @@
+"""
+Batch evaluations of a ReducedFunctionalNumPy on a pool of worker processes agree with
+the evaluations one after another, and leave the current forward state alone.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(m):
+    u = Function(V, name="State")
+    w = TestFunction(V)
+
+    F = inner(grad(u), grad(w))*dx + u**3*w*dx - m*w*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+    return u
+
+if __name__ == "__main__":
+
+    m = interpolate(Constant(1.0), V, name="Control")
+    u = main(m)
+
+    J = Functional(u*u*dx)
+    calls = []
+    eval_cb = lambda j, m: calls.append("eval")
+    derivative_cb = lambda j, dj, m: calls.append("derivative")
+    rf_np = ReducedFunctionalNumPy(ReducedFunctional(J, Control(m), eval_cb=eval_cb, derivative_cb=derivative_cb))
+    m0 = rf_np.get_controls()
+    j0 = rf_np(m0)
+    dj0 = rf_np.derivative(m0, forget=False)
+    del calls[:]
+
+    batch = [m0 * scale for scale in (0.5, 1.0, 2.0, 4.0)]
+    concurrent = rf_np.evaluate_batch(batch, with_gradient=True, processes=2)
+    sequential = rf_np.evaluate_batch(batch, with_gradient=True, processes=1)
+    assert (rf_np.get_controls() == m0).all()
+    assert abs(rf_np.rf.current_func_value - j0) < 1.0e-12
+
+    # The batch evaluations do not go through the callbacks of the optimisation
+    assert calls == []
+
+    # The gradient at the current controls is unchanged
+    assert numpy.linalg.norm(rf_np.derivative(m0, forget=False) - dj0) < 1.0e-12
+
+    for ((j, dj), (j_seq, dj_seq), m_array) in zip(concurrent, sequential, batch):
+        info("J = %s, %s" % (j, j_seq))
+        assert abs(j - j_seq) < 1.0e-12
+        assert numpy.linalg.norm(dj - dj_seq) < 1.0e-12
+        assert abs(j - rf_np(m_array)) < 1.0e-12
+
+    values = rf_np.evaluate_batch(batch, processes=2)
+    assert numpy.allclose(values, [j for (j, dj) in concurrent])
@@ -0,0 +1,48 @@
+""" Assign a list of functions to a subfunction of a nested mixed function. The other
+components of the receiving function keep their previous values, so the functional depends
+on all of them. """
+
+from dolfin import *
+from dolfin_adjoint import *
+
+if not hasattr(dolfin, "FunctionAssigner"):
+  info_red("Need dolfin.FunctionAssigner for this test.")
+  import sys
+  sys.exit(0)
+
+mesh = UnitIntervalMesh(4)
+P = FunctionSpace(mesh, "CG", 1)
+Q = FunctionSpace(mesh, "CG", 2)
+W = MixedFunctionSpace([MixedFunctionSpace([P, Q]), P])
+
+def main(w0, p, annotate=False):
+  assigner = FunctionAssigner(W.sub(0), [P, Q])
+
+  w = Function(w0, name="Output", annotate=annotate)
+  q = interpolate(Expression("x[0]*x[0]"), Q)
+  assigner.assign(w.sub(0), [p, q], annotate=annotate)
+
+  return w
+
+form = lambda w: inner(w, w)**2*dx
+
+if __name__ == "__main__":
+  w0 = interpolate(Expression(("x[0] + 1.0", "sin(x[0])", "cos(x[0])")), W, name="Background")
+  p = interpolate(Expression("x[0]*(1.0 - x[0])"), P, name="Giving")
+  w = main(w0, p, annotate=True)
+
+  success = replay_dolfin(tol=0.0, stop=True)
+  assert success
+
+  J = Functional(form(w)*dt[FINISH_TIME])
+  Jm = assemble(form(w))
+
+  for (m, Jhat) in [(Control(w0, value=w0), lambda w0: assemble(form(main(w0, p)))),
+                    (Control(p, value=p), lambda p: assemble(form(main(w0, p))))]:
+    dJdm = compute_gradient(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm, seed=1.0e-2)
+    assert minconv > 1.8
+
+    dJdm = compute_gradient_tlm(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm, seed=1.0e-2)
+    assert minconv > 1.8
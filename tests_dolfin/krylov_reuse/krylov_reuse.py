@@ -0,0 +1,56 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True):
+  u = TrialFunction(V)
+  v = TestFunction(V)
+  bc = DirichletBC(V, 0.0, "on_boundary")
+
+  u_0 = Function(V, name="Solution")
+  u_0.assign(ic, annotate=False)
+  u_1 = Function(V, name="NextSolution")
+
+  dt = Constant(0.1)
+  A = assemble(u*v*dx + dt*inner(grad(u), grad(v))*dx)
+  bc.apply(A)
+
+  solver = KrylovSolver("cg", "ilu")
+  solver.parameters["relative_tolerance"] = 1.0e-12
+  solver.parameters["absolute_tolerance"] = 1.0e-14
+  solver.set_operator(A)
+
+  for i in range(5):
+    b = assemble(u_0*v*dx)
+    bc.apply(b)
+    solver.solve(u_1.vector(), b, annotate=annotate)
+    u_0.assign(u_1, annotate=annotate)
+
+  return u_0
+
+if __name__ == "__main__":
+  ic = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])"), V)
+  u = main(ic)
+
+  J = Functional(u*u*dx*dt[FINISH_TIME])
+  m = Control(ic)
+  Jm = assemble(u*u*dx)
+
+  telemetry = start_telemetry()
+  dJdm = compute_gradient(J, m, forget=False)
+  records = stop_telemetry()
+
+  # The adjoint operator is the same in every timestep, so that one solver is
+  # configured and reused for all of the adjoint solves
+  assert len(caching.krylov_solvers) == 1
+  assert sum(record["cache_hits"] for record in records) >= 4
+
+  def J(ic):
+    u = main(ic, annotate=False)
+    return assemble(u*u*dx)
+
+  minconv = taylor_test(J, m, Jm, dJdm, seed=0.1)
+  assert minconv > 1.9
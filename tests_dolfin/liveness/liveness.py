@@ -0,0 +1,96 @@
+"""
+Freeing the stored forward values after their last use on the replay and on the
+reverse sweep does not change the functional value or its gradient.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+import libadjoint
+
+n = 30
+mesh = UnitIntervalMesh(n)
+V = FunctionSpace(mesh, "CG", 2)
+
+def Dt(u, u_, timestep):
+    return (u - u_)/timestep
+
+def main(ic, annotate=False):
+
+    u_ = Function(ic, name="Velocity")
+    u = Function(V, name="VelocityNext")
+    v = TestFunction(V)
+
+    # A diagnostic field that neither the functional nor the adjoint need
+    energy = Function(V, name="Energy")
+
+    nu = Constant(0.0001)
+
+    timestep = Constant(1.0/n)
+
+    F = (Dt(u, u_, timestep)*v
+         + u*u.dx(0)*v + nu*u.dx(0)*v.dx(0))*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.2
+    while (t <= end):
+        solve(F == 0, u, bc, annotate=annotate)
+        u_.assign(u, annotate=annotate)
+        solve(energy*v*dx == 0.5*u_*u_*v*dx, energy, annotate=annotate)
+
+        t += float(timestep)
+        adj_inc_timestep()
+
+    return u_
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(2*pi*x[0])"),  V)
+    forward = main(ic, annotate=True)
+
+    J = Functional(forward*forward*dx*dt[FINISH_TIME])
+    m = Control(ic)
+    rf = ReducedFunctional(J, m)
+
+    Jm = rf(ic)
+    dJdm = rf.derivative()[0]
+
+    parameters["adjoint"]["free_dead_values"] = True
+    Jm_freed = rf(ic)
+    dJdm_freed = rf.derivative()[0]
+
+    # The diagnostic energy field is dropped on the replay, and its adjoint is not solved for
+    analysis = rf.liveness()
+    assert analysis.valid
+    freed = [var for values in analysis.replay_frees.values() for var in values]
+    energies = [var for var in freed if var.name == "Energy"]
+    assert len(energies) > 0
+    for i in range(adjointer.equation_count):
+        if adjointer.get_forward_variable(i).name == "Energy":
+            assert analysis.zero_adjoint(i)
+        else:
+            assert not analysis.zero_adjoint(i)
+
+    rf(ic)
+    for var in energies:
+        try:
+            adjointer.get_variable_value(var).data
+            assert False, "%s was not freed" % var
+        except libadjoint.exceptions.LibadjointErrorNeedValue:
+            pass
+
+    # The adjoint sweep skips the zero adjoints whether or not it forgets
+    dJdm_kept = rf.derivative(forget=False)[0]
+    assert (dJdm.vector() - dJdm_kept.vector()).norm("l2") < 1.0e-12
+
+    # The concurrent reverse sweep skips them as well, so it does not ask for the freed values
+    parameters["adjoint"]["adjoint_threads"] = 2
+    assert max(len(level) for level in adjoint_levels()) > 1
+    rf(ic)
+    dJdm_threaded = rf.derivative()[0]
+    parameters["adjoint"]["adjoint_threads"] = 1
+    assert (dJdm.vector() - dJdm_threaded.vector()).norm("l2") < 1.0e-12
+
+    info("J = %s, %s; |dJ/dm| = %s, %s" % (Jm, Jm_freed, norm(dJdm), norm(dJdm_freed)))
+    assert abs(Jm - Jm_freed) < 1.0e-12
+    assert (dJdm.vector() - dJdm_freed.vector()).norm("l2") < 1.0e-12
@@ -0,0 +1,57 @@
+""" Projections into a DG space with a LocalSolver, whose operator depends on a Function and a
+Constant that changes from timestep to timestep. The element matrices are factorized by dolfin's
+LocalSolver, again when the coefficients change, with one cache entry per form and adjoint form. """
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(4, 4)
+U = FunctionSpace(mesh, "DG", 1)
+
+def main(k, annotate=False):
+    u0 = interpolate(Expression("sin(x[0])*x[1] + 1.0"), U, name="u0")
+    u_ls = Function(U, name="u_ls")
+
+    v = TestFunction(U)
+    u = TrialFunction(U)
+    c = Constant(1.0)
+
+    a = (c + k*k)*u*v*dx
+    L = u0*v*dx
+    local_solver = LocalSolver(a, solver_type=LocalSolver.LU, factorize=True)
+
+    b = None
+    for i in range(3):
+        c.assign(1.0 + i)
+        b = assemble(L, tensor=b)
+        local_solver.solve_local(u_ls.vector(), b, U.dofmap(), annotate=annotate)
+        u0.assign(u_ls, annotate=annotate)
+
+    return u_ls
+
+if __name__ == "__main__":
+    k = interpolate(Expression("1.0 + x[0]*x[1]"), U, name="k")
+    u = main(k, annotate=True)
+
+    assert replay_dolfin(forget=False, tol=1.0e-12, stop=True)
+
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+    m = Control(k)
+    Jm = assemble(inner(u, u)*dx)
+
+    def Jhat(k):
+        u = main(k)
+        return assemble(inner(u, u)*dx)
+
+    dJdm = compute_gradient_tlm(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm, seed=1.0e-2)
+    assert minconv > 1.8
+
+    dJdm = compute_gradient(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm, seed=1.0e-2)
+    assert minconv > 1.8
+
+    # The factorizations of the three timesteps share one entry per operator
+    assert 1 <= len(caching.localsolvers) <= 2
+    assert all(key[0] == "dolfin" for key in caching.localsolvers)
@@ -0,0 +1,52 @@
+"""
+The low-rank Hessian reproduces the Hessian actions, its inverse and the posterior
+covariance when its rank is that of the Hessian, and can be used by Newton-CG.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+mesh = UnitIntervalMesh(20)
+V = FunctionSpace(mesh, "CG", 1)
+d = interpolate(Expression("x[0]*(1 - x[0])"), V)
+
+def main(m):
+    u = Function(V, name="State")
+    w = TestFunction(V)
+
+    F = inner(grad(u), grad(w))*dx + u*w*dx - m*w*dx
+    solve(F == 0, u)
+    return u
+
+if __name__ == "__main__":
+
+    m = interpolate(Constant(1.0), V, name="Control")
+    u = main(m)
+
+    J = Functional(0.5*inner(u - d, u - d)*dx + 0.5*1.0e-4*inner(m, m)*dx)
+    rf = ReducedFunctional(J, Control(m))
+    rf_np = ReducedFunctionalNumPy(rf)
+    j0 = rf_np(rf_np.get_controls())
+
+    n = V.dim()
+    H = LowRankHessian(rf_np, rank=n, oversampling=0)
+
+    x = numpy.random.RandomState(1).standard_normal(n)
+    Hx = rf_np.hessian(None, x)
+    error = numpy.linalg.norm(H.apply(x) - Hx)/numpy.linalg.norm(Hx)
+    info("Relative error of the low-rank Hessian action: %s" % error)
+    assert error < 1.0e-8
+
+    # The posterior covariance is the inverse of H + R
+    b = Hx + H.prior.apply(x)
+    assert numpy.linalg.norm(H.solve(b, shift=1.0) - x)/numpy.linalg.norm(x) < 1.0e-8
+
+    # S R^{-1} S = H
+    Sx = H.sqrt(x)
+    assert numpy.linalg.norm(H.sqrt(H.prior.solve(Sx)) - Hx)/numpy.linalg.norm(Hx) < 1.0e-8
+
+    assert len(H.posterior_sample()) == n
+
+    m_opt = minimize(rf, method="Newton-CG", hessp=H, options={"xtol": 1.0e-12})
+    assert rf(m_opt) < j0
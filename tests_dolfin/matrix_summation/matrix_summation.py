@@ -2,6 +2,7 @@ import sys
 
 from dolfin import *
 from dolfin_adjoint import *
+from dolfin_adjoint import formtable
 
 n = 3
 mesh = UnitIntervalMesh(n)
@@ -19,17 +20,17 @@ def main(ic, annotate=False):
     v = TestFunction(V)
 
     mass = assemble(inner(u, v) * dx)
-    if annotate: assert hasattr(mass, 'form')
+    if annotate: assert formtable.has(mass, 'form')
 
     advec = assemble(u_*u.dx(0)*v * dx)
-    if annotate: assert hasattr(advec, 'form')
+    if annotate: assert formtable.has(advec, 'form')
 
     rhs = assemble(inner(u_, v) * dx)
-    if annotate: assert hasattr(rhs, 'form')
+    if annotate: assert formtable.has(rhs, 'form')
 
     L = mass + advec
 
-    if annotate: assert hasattr(L, 'form')
+    if annotate: assert formtable.has(L, 'form')
     solve(L, u_.vector(), rhs, 'lu', annotate=annotate)
 
     return u_
@@ -0,0 +1,87 @@
+"""
+Assimilate gauge time series of a diffusion problem with an
+ObservationFunctional, and check its value and gradient.
+"""
+
+import numpy
+
+from dolfin import *
+from dolfin_adjoint import *
+
+dolfin.parameters["adjoint"]["record_all"] = True
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+gauges = numpy.array([[0.25, 0.25], [0.5, 0.5], [0.8, 0.3]])
+times = [0.05, 0.125, 0.2]
+nsteps = 4
+timestep = 0.05
+
+def main(m, annotate=False):
+  u_ = Function(m, name="State", annotate=annotate)
+  u = Function(V, name="NextState")
+  v = TestFunction(V)
+  w = TrialFunction(V)
+
+  k = Constant(timestep)
+  a = inner(w, v)*dx + k*inner(grad(w), grad(v))*dx
+  L = inner(u_, v)*dx
+
+  t = 0.0
+  adj_start_timestep(t)
+  for n in range(nsteps):
+    solve(a == L, u, annotate=annotate)
+    u_.assign(u, annotate=annotate)
+    t += timestep
+    adj_inc_timestep(t, finished=n == nsteps-1)
+
+  return u_
+
+def gauge_values(m):
+  '''Run the model and sample the gauges directly.'''
+  u_ = Function(m)
+  u = Function(V)
+  v = TestFunction(V)
+  w = TrialFunction(V)
+  k = Constant(timestep)
+
+  states = [Function(u_)]
+  for n in range(nsteps):
+    solve(inner(w, v)*dx + k*inner(grad(w), grad(v))*dx == inner(u_, v)*dx, u, annotate=False)
+    u_.assign(u, annotate=False)
+    states.append(Function(u_))
+
+  out = []
+  for t in times:
+    n = int(t/timestep)
+    theta = (n + 1) - t/timestep
+    values = []
+    for x in gauges:
+      values.append(theta*states[n](Point(*x)) + (1 - theta)*states[min(n+1, nsteps)](Point(*x)))
+    out.append(values)
+  return numpy.array(out)
+
+if __name__ == "__main__":
+
+  truth = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])"), V)
+  data = gauge_values(truth)
+
+  m = interpolate(Expression("x[0]*(1 - x[0])"), V, name="Initial")
+  u = main(m, annotate=True)
+
+  J = ObservationFunctional(u, gauges, times, data)
+  rf = ReducedFunctional(J, Control(m))
+
+  expected = 0.5*((gauge_values(m) - data)**2).sum()
+  Jm = rf(m)
+  print "Functional value: %s, expected: %s" % (Jm, expected)
+  assert abs(Jm - expected) < 1.0e-10
+
+  dJdm = compute_gradient(J, Control(m), forget=False)
+
+  def Jhat(m):
+    return 0.5*((gauge_values(m) - data)**2).sum()
+
+  minconv = taylor_test(Jhat, Control(m), Jm, dJdm, seed=1.0e-2)
+  assert minconv > 1.9
@@ -0,0 +1,64 @@
+"""
+The tangent linear and adjoint steps of an ODE model with several coefficients, which
+libadjoint differentiates with respect to one after the other with the same values.
+"""
+
+try:
+  from dolfin import BackwardEuler
+except ImportError:
+  from dolfin import info_red
+  info_red("Need dolfin > 1.2.0 for ode_coefficients test.")
+  import sys; sys.exit(0)
+
+from dolfin import *
+from dolfin_adjoint import *
+
+if not hasattr(MultiStageScheme, "to_tlm"):
+  info_red("Need dolfin > 1.2.0 for ode_coefficients test.")
+  import sys; sys.exit(0)
+
+mesh = UnitIntervalMesh(4)
+R = FunctionSpace(mesh, "CG", 1)
+timestep = 0.1
+
+def main(c, annotate=False):
+  u = interpolate(Expression("1.0 + x[0]"), R, name="Solution")
+  d = interpolate(Expression("0.5*x[0]"), R, name="Decay")
+  v = TestFunction(R)
+  time = Constant(0.0)
+
+  scheme = RK4(inner(c*time*u - d*u*u, v)*dP, u, time)
+  solver = PointIntegralSolver(scheme)
+  solver.parameters.reset_stage_solutions = True
+  solver.parameters.newton_solver.reset_each_step = True
+
+  for i in range(5):
+    solver.step(timestep, annotate=annotate)
+
+  return u
+
+if __name__ == "__main__":
+  c = interpolate(Expression("1.0 + x[0]*x[0]"), R, name="GrowthRate")
+  u = main(c, annotate=True)
+
+  assert replay_dolfin(tol=1.0e-15, stop=True)
+
+  J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+  m = Control(c)
+  Jm = assemble(inner(u, u)*dx)
+
+  def Jhat(c):
+    u = main(c)
+    return assemble(inner(u, u)*dx)
+
+  dJdm_tlm = compute_gradient_tlm(J, m, forget=False)
+  minconv = taylor_test(Jhat, m, Jm, dJdm_tlm, seed=1.0e-2)
+  assert minconv > 1.8
+
+  dJdm = compute_gradient(J, m, forget=False)
+  minconv = taylor_test(Jhat, m, Jm, dJdm, seed=1.0e-2)
+  assert minconv > 1.8
+
+  # A second reverse sweep starts from coefficients the first one left behind
+  dJdm_again = compute_gradient(J, m, forget=False)
+  assert (dJdm.vector() - dJdm_again.vector()).norm("l2") == 0.0
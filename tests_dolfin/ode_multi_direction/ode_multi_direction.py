@@ -0,0 +1,54 @@
+try:
+  from dolfin import BackwardEuler
+except ImportError:
+  from dolfin import info_red
+  info_red("Need dolfin > 1.2.0 for ode_multi_direction test.")
+  import sys; sys.exit(0)
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjlinalg
+from dolfin_adjoint.pointintegralsolver import PointIntegralRHS
+
+if not hasattr(MultiStageScheme, "to_tlm"):
+  info_red("Need dolfin > 1.2.0 for ode_multi_direction test.")
+  import sys; sys.exit(0)
+
+mesh = UnitIntervalMesh(4)
+R = FunctionSpace(mesh, "CG", 1)
+
+if __name__ == "__main__":
+  u = interpolate(Expression("1.0 + x[0]"), R, name="Solution")
+  v = TestFunction(R)
+  time = Constant(0.0)
+  dt = 0.1
+
+  scheme = RK4(inner(time*u*u, v)*dP, u, time)
+  solver = PointIntegralSolver(scheme)
+  solver.parameters.reset_stage_solutions = True
+  solver.parameters.newton_solver.reset_each_step = True
+
+  rhs = PointIntegralRHS(solver, dt, adjglobals.adj_variables[u], {}, {})
+  values = [adjlinalg.Vector(Function(u))]
+  directions = [adjlinalg.Vector(interpolate(Expression(e), R)) for e in ("1.0", "x[0]", "x[0]*x[0]")]
+
+  for hermitian in (False, True):
+    separate = [Function(rhs.derivative_action(rhs.deps, values, None, d, hermitian).data) for d in directions]
+    together = rhs.derivative_actions(rhs.deps, values, None, directions, hermitian)
+
+    for (a, b) in zip(separate, together):
+      err = (a.vector() - b.data.vector()).norm("l2")
+      print "Difference between separate and multi-direction steps: ", err
+      assert err < 1.0e-14
+
+    # The directions are distinct, so the multi-direction outputs must be too
+    assert (together[0].data.vector() - together[1].data.vector()).norm("l2") > 0.0
+
+    # A value that is modified in place is assigned again on the next call
+    before = Function(rhs.derivative_action(rhs.deps, values, None, directions[1], hermitian).data)
+    values[0].data.vector()[:] *= 2.0
+    after = rhs.derivative_action(rhs.deps, values, None, directions[1], hermitian).data
+    fresh = rhs.derivative_action(rhs.deps, [adjlinalg.Vector(Function(values[0].data))], None, directions[1], hermitian).data
+    assert (after.vector() - before.vector()).norm("l2") > 0.0
+    assert (after.vector() - fresh.vector()).norm("l2") == 0.0
+    values[0].data.vector()[:] *= 0.5
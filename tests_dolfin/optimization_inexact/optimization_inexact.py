@@ -0,0 +1,51 @@
+""" Runs an optimisation with relaxed solver tolerances in the early iterations,
+and checks that the tolerances are tightened as it converges and that the
+result agrees with the exact optimisation. """
+
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+dolfin.set_log_level(ERROR)
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+W = FunctionSpace(mesh, "DG", 0)
+
+m = Function(W, name="Control")
+u = Function(V, name="State")
+v = TestFunction(V)
+w = TrialFunction(V)
+
+bc = DirichletBC(V, 0.0, "on_boundary")
+solve(inner(grad(w), grad(v))*dx == m*v*dx, u, bc,
+      solver_parameters={"linear_solver": "cg", "preconditioner": "amg",
+                         "krylov_solver": {"relative_tolerance": 1.0e-12}})
+
+x = SpatialCoordinate(mesh)
+d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+J = Functional(0.5*inner(u-d, u-d)*dx + Constant(1e-6)/2*m**2*dx)
+rf = ReducedFunctional(J, Control(m))
+
+if __name__ == "__main__":
+  m_exact = minimize(rf, options={"gtol": 1.0e-10, "maxiter": 30, "disp": False})
+
+  m.vector().zero()
+  start_inexactness_control(kappa=0.1, max_tolerance=1.0e-2)
+  m_inexact = minimize(rf, options={"gtol": 1.0e-10, "maxiter": 30, "disp": False})
+  history = stop_inexactness_control()
+
+  # The tolerances start relaxed and are tightened as the gradient decreases
+  targets = [record["target_tolerance"] for record in history]
+  assert targets[0] == 1.0e-2
+  assert targets[-1] < 1.0e-4
+
+  # The solves used the target tolerance, or the annotated 1.0e-12 if that is looser
+  assert any(len(record["solves"]) > 0 for record in history)
+  for record in history:
+    for solve in record["solves"]:
+      assert solve["krylov_solver"] == max(record["target_tolerance"], 1.0e-12)
+
+  error = errornorm(m_exact, m_inexact)/norm(m_exact)
+  info("Relative difference of the exact and inexact optima: %s" % error)
+  assert error < 1.0e-3
@@ -0,0 +1,59 @@
+""" Minimises a Poisson optimal control problem from several initial guesses
+on a pool of worker processes. """
+
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+import os
+
+dolfin.set_log_level(ERROR)
+
+def setup():
+    mesh = UnitSquareMesh(8, 8)
+    V = FunctionSpace(mesh, "CG", 1)
+    W = FunctionSpace(mesh, "DG", 0)
+
+    m = Function(W, name="Control")
+    u = Function(V, name="State")
+    v = TestFunction(V)
+
+    F = (inner(grad(u), grad(v)) - m*v)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    x = SpatialCoordinate(mesh)
+    d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+    J = Functional(0.5*inner(u-d, u-d)*dx + Constant(1e-6)/2*m**2*dx)
+
+    # A start point that makes the worker process die
+    def eval_cb(j, m):
+        if m.vector().max() == 7.0:
+            os._exit(1)
+
+    return ReducedFunctional(J, Control(m), eval_cb=eval_cb)
+
+if __name__ == "__main__":
+    ndofs = 2*8*8
+    guesses = [c*numpy.ones(ndofs) for c in [0.0, 1.0, -1.0, 5.0, 7.0]]
+
+    evaluations = []
+    def callback(i, j, best_j):
+        evaluations.append((i, j, best_j))
+
+    results = minimize_multistart(setup, guesses, processes=2, callback=callback, timeout=600,
+                                  options={"maxiter": 200, "disp": False})
+
+    assert len(results) == len(guesses)
+    assert len(evaluations) > 0
+    for result in results[:-1]:
+        assert result["status"] == "converged"
+        assert len(result["controls"]) == ndofs
+    assert results[-1]["status"] == "failed"
+
+    best = min(result["value"] for result in results[:-1])
+    print "Best functional value: ", best
+    assert best < 1.0e-5
+
+    # The status is the one reported by the optimisation algorithm
+    truncated = minimize_multistart(setup, guesses[1:2], processes=1, options={"maxiter": 1, "disp": False})
+    assert truncated[0]["status"] == "not converged"
@@ -0,0 +1,67 @@
+""" Solves an optimal control problem constrained by the Poisson equation
+with a pointwise lower bound on the control, expressed as a constraint with
+a sparse Jacobian and solved with the pyipopt Python bindings to IPOPT."""
+
+import sys
+
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+try:
+  import pyipopt
+  import scipy.sparse
+except ImportError:
+  info_blue("pyipopt bindings unavailable, skipping test")
+  sys.exit(0)
+
+set_log_level(ERROR)
+
+n = 20
+mesh = UnitSquareMesh(n, n)
+V = FunctionSpace(mesh, "CG", 1)
+W = FunctionSpace(mesh, "DG", 0)
+
+m = interpolate(Constant(0.5), W, name="Control")
+u = Function(V, name="State")
+v = TestFunction(V)
+
+F = (inner(grad(u), grad(v)) - m*v)*dx
+bc = DirichletBC(V, 0.0, "on_boundary")
+solve(F == 0, u, bc)
+
+x = SpatialCoordinate(mesh)
+d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+
+J = Functional(0.5*inner(u-d, u-d)*dx + Constant(1e-6)/2*m**2*dx)
+rf = ReducedFunctional(J, Control(m))
+
+lower = 0.2
+
+class PointwiseConstraint(InequalityConstraint):
+  """The pointwise constraint c_i(m) = m_i - lower >= 0, with an identity Jacobian."""
+  def __init__(self, ndofs):
+    self.ndofs = ndofs
+
+  def function(self, m):
+    return numpy.array(m) - lower
+
+  def sparse_jacobian(self, m):
+    return scipy.sparse.identity(self.ndofs, format="csr")
+
+  def output_workspace(self):
+    return numpy.zeros(self.ndofs)
+
+ndofs = W.dim()
+constraint = PointwiseConstraint(ndofs)
+
+# The sparse Jacobian has one nonzero per control degree of freedom
+(rows, cols, vals) = constraint.coo_jacobian(numpy.zeros(ndofs))
+assert len(vals) == ndofs
+assert (rows == cols).all()
+
+problem = MinimizationProblem(rf, constraints=constraint)
+solver = IPOPTSolver(problem, parameters={"maximum_iterations": 50})
+m_opt = solver.solve()
+
+assert m_opt.vector().min() >= lower - 1.0e-6
@@ -0,0 +1,104 @@
+""" Interrupts an optimisation after a few iterations and resumes it from
+its checkpoint, checking that no recorded evaluation is repeated and that the
+resumed optimisation finds the same optimum as an uninterrupted one. """
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint.optimization.optimization_checkpoint import OptimizationCheckpoint
+import numpy
+import os
+
+dolfin.set_log_level(ERROR)
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+W = FunctionSpace(mesh, "DG", 0)
+
+m = Function(W, name="Control")
+u = Function(V, name="State")
+v = TestFunction(V)
+
+F = (inner(grad(u), grad(v)) - m*v)*dx
+bc = DirichletBC(V, 0.0, "on_boundary")
+solve(F == 0, u, bc)
+
+x = SpatialCoordinate(mesh)
+d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+J = Functional(0.5*inner(u-d, u-d)*dx + Constant(1e-6)/2*m**2*dx)
+
+evaluations = [0]
+def eval_cb(j, m):
+  evaluations[0] += 1
+
+rf = ReducedFunctional(J, Control(m), eval_cb=eval_cb)
+m0 = Function(m)
+
+def run(**kwargs):
+  evaluations[0] = 0
+  m.assign(m0, annotate=False)
+  m_opt = minimize(rf, options={"maxiter": kwargs.pop("maxiter", 20), "disp": False}, **kwargs)
+  return (evaluations[0], rf(m_opt), m_opt.vector().array())
+
+if __name__ == "__main__":
+  filename = "optimization_resume.npz"
+  truncated = "optimization_resume_truncated.npz"
+  for f in [filename, truncated, "optimization_resume_hit.npz"]:
+    if os.path.exists(f):
+      os.remove(f)
+
+  (full_evaluations, full_value, full_m) = run()
+  (first_evaluations, first_value, first_m) = run(maxiter=3, checkpoint=filename)
+  (resumed_evaluations, resumed_value, resumed_m) = run(checkpoint=filename, resume=True)
+
+  # The history holds every evaluation of the interrupted run, so the resumed run retraces
+  # the full one exactly
+  print "Evaluations: full %d, interrupted %d, resumed %d" % (full_evaluations, first_evaluations, resumed_evaluations)
+  assert resumed_evaluations < full_evaluations
+  assert abs(resumed_value - full_value) < 1.0e-12
+  assert abs(resumed_m - full_m).max() < 1.0e-12
+
+  # With a history too short for that, the resumed run restarts from the best recorded
+  # controls and converges to the same optimum
+  (converged_evaluations, converged_value, converged_m) = run(maxiter=200, tol=1.0e-12)
+  run(maxiter=3, checkpoint=truncated, checkpoint_history=2)
+  checkpoint = OptimizationCheckpoint(truncated, resume=True)
+  assert checkpoint.truncated
+  assert len(checkpoint.gradients) <= 2 and len(checkpoint.functionals) <= 2
+  (resumed_evaluations, resumed_value, resumed_m) = run(maxiter=200, tol=1.0e-12, checkpoint=truncated, resume=True)
+  print "Optimum difference after a truncated resume: %e" % abs(resumed_m - converged_m).max()
+  assert abs(resumed_value - converged_value) < 1.0e-6*abs(converged_value)
+  assert abs(resumed_m - converged_m).max() < 1.0e-3*abs(converged_m).max()
+
+  # Gradients and Hessian actions requested after a functional value was answered from
+  # the checkpoint are computed at the requested controls, as in a cold run
+  m.assign(m0, annotate=False)
+  rf_np = ReducedFunctionalNumPy(rf)
+  m0_array = rf_np.get_controls()
+  x = m0_array + 1.0
+  direction = numpy.ones(len(x))
+
+  cold_j = rf_np(x)
+  cold_dj = rf_np.derivative(x, forget=False)
+  cold_H = rf_np.hessian(x, direction)
+
+  def hit(m_array, j):
+    # Leave the tape at the initial controls and answer the evaluation at m_array from
+    # a checkpoint, as a resumed optimisation does
+    rf_np.checkpoint = None
+    rf_np(m0_array)
+    rf_np.checkpoint = OptimizationCheckpoint("optimization_resume_hit.npz")
+    rf_np.checkpoint.record_functional(m_array, j)
+    assert rf_np(m_array) == j
+    assert rf_np.checkpoint.hits == 1
+
+  hit(x, cold_j)
+  warm_dj = rf_np.derivative(x, forget=False)
+  print "Gradient difference after a checkpoint hit: %e" % abs(warm_dj - cold_dj).max()
+  assert abs(warm_dj - cold_dj).max() < 1.0e-12
+
+  hit(x, cold_j)
+  warm_H = rf_np.hessian(x, direction)
+  print "Hessian action difference after a checkpoint hit: %e" % abs(warm_H - cold_H).max()
+  assert abs(warm_H - cold_H).max() < 1.0e-12
+
+  rf_np.checkpoint = None
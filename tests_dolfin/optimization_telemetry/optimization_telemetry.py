@@ -0,0 +1,46 @@
+""" Records the telemetry of a short optimisation and checks the
+per-iteration solve counts and the JSON lines export. """
+
+from dolfin import *
+from dolfin_adjoint import *
+import json
+import os
+
+dolfin.set_log_level(ERROR)
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+W = FunctionSpace(mesh, "DG", 0)
+
+m = Function(W, name="Control")
+u = Function(V, name="State")
+v = TestFunction(V)
+
+F = (inner(grad(u), grad(v)) - m*v)*dx
+bc = DirichletBC(V, 0.0, "on_boundary")
+solve(F == 0, u, bc)
+
+x = SpatialCoordinate(mesh)
+d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+J = Functional(0.5*inner(u-d, u-d)*dx + Constant(1e-6)/2*m**2*dx)
+rf = ReducedFunctional(J, Control(m))
+
+if __name__ == "__main__":
+  filename = "telemetry.jsonl"
+  if os.path.exists(filename):
+    os.remove(filename)
+
+  start_telemetry(filename)
+  minimize(rf, options={"maxiter": 5, "disp": False})
+  records = stop_telemetry()
+
+  assert len(records) > 0
+  for record in records[:-1]:
+    assert record["adjoint_sweeps"] == 1
+    assert record["forward_replays"] >= 1
+    assert record["time"]["replay"] >= 0.0
+    assert record["time"]["optimizer"] >= 0.0
+
+  if MPI.rank(mpi_comm_world()) == 0:
+    lines = [json.loads(line) for line in open(filename)]
+    assert lines == json.loads(json.dumps(records))
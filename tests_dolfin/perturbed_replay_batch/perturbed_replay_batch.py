@@ -0,0 +1,60 @@
+"""
+Replay a diffusion problem once for several perturbation directions and
+compare the growths with separate perturbed forward runs.
+"""
+
+import numpy
+
+from dolfin import *
+from dolfin_adjoint import *
+
+dolfin.parameters["adjoint"]["record_all"] = True
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=False):
+  u_ = Function(ic, name="State")
+  u = TrialFunction(V)
+  v = TestFunction(V)
+
+  timestep = Constant(0.05)
+  kappa = Constant(0.1)
+  a = inner(u, v)*dx + timestep*kappa*inner(grad(u), grad(v))*dx
+  bc = DirichletBC(V, 0.0, "on_boundary")
+
+  u_new = Function(V, name="NextState")
+  for t in range(5):
+    solve(a == inner(u_, v)*dx, u_new, bc, annotate=annotate)
+    u_.assign(u_new, annotate=annotate)
+    adj_inc_timestep()
+
+  return u_
+
+if __name__ == "__main__":
+
+  ic = project(Expression("sin(pi*x[0])*sin(pi*x[1])"), V, annotate=True)
+  forward = Function(main(ic, annotate=True))
+  parameters["adjoint"]["stop_annotating"] = True
+
+  directions = [interpolate(Expression("sin(%d*pi*x[0])*sin(pi*x[1])" % k), V, annotate=False) for k in (1, 2, 3)]
+  scale = 1.0e-3
+
+  growths = perturbed_replay_batch(Control(ic), directions, scale, "State")
+  print "Growths: ", growths
+  assert growths.shape[0] == len(directions)
+
+  mass = assemble(inner(TrialFunction(V), TestFunction(V))*dx)
+  def norm(x):
+    y = x.copy()
+    mass.mult(x, y)
+    return sqrt(x.inner(y))
+
+  for (j, p) in enumerate(directions):
+    perturbed_ic = Function(ic)
+    perturbed_ic.vector().axpy(scale/norm(p.vector()), p.vector())
+    perturbed = main(perturbed_ic, annotate=False)
+
+    growth = norm(perturbed.vector() - forward.vector())/scale
+    print "Direction %d: replayed growth %s, direct growth %s" % (j, growths[j, -1], growth)
+    assert abs(growths[j, -1] - growth) < 1.0e-8 * max(growth, 1.0)
@@ -0,0 +1,45 @@
+""" Projections with a direct and with an iterative solver. The replay, tangent linear and
+adjoint solves use the solver the projection asked for, and share the cached mass matrix. """
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 2)
+
+def main(ic, solver_type, annotate=False):
+  u = Function(ic, name="Solution")
+  bc = DirichletBC(V, 0.0, "on_boundary")
+  for i in range(3):
+    u = project(u*u + ic, V, bcs=bc, solver_type=solver_type, preconditioner_type="default", annotate=annotate)
+  return u
+
+if __name__ == "__main__":
+  ic = interpolate(Expression("x[0]*(x[0]-1)*x[1]*(x[1]-1)"), V, name="InitialCondition")
+
+  for solver_type in ["lu", "cg"]:
+    adj_reset()
+    u = main(ic, solver_type, annotate=True)
+    assert replay_dolfin(forget=False, tol=1.0e-12, stop=True)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    m = Control(ic, value=ic)
+    Jm = assemble(u*u*dx)
+
+    def Jhat(ic):
+      u = main(ic, solver_type)
+      return assemble(u*u*dx)
+
+    dJdm = compute_gradient_tlm(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm)
+    assert minconv > 1.8
+
+    dJdm = compute_gradient(J, m, forget=False)
+    minconv = taylor_test(Jhat, m, Jm, dJdm)
+    assert minconv > 1.8
+
+    # All solves shared one mass matrix, with one solver of the requested type
+    assert len(caching.projection_operators) == 1
+    operator = caching.projection_operators.values()[0]
+    assert operator.solvers.keys() == [(solver_type, "default")]
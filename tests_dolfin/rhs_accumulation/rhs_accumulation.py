@@ -0,0 +1,55 @@
+import numpy
+import ufl
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjlinalg
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+if __name__ == "__main__":
+  v = TestFunction(V)
+  w = TestFunction(V)
+  f = interpolate(Expression("x[0]*x[1]"), V)
+  g = interpolate(Expression("x[0] + x[1]"), V)
+  F = inner(f, v)*dx
+  G = inner(g, w)*dx
+
+  # Repeated contributions of the same form are merged into one term
+  b = adjlinalg.Vector(None)
+  for i in range(5):
+    b.axpy(1.0, adjlinalg.Vector(F))
+  b.axpy(-2.0, adjlinalg.Vector(G))
+  assert len(b.terms) == 2
+
+  # also when they are rebuilt, but not forms with the same structure and other coefficients
+  b.axpy(1.0, adjlinalg.Vector(inner(f, v)*dx))
+  b.axpy(-1.0, adjlinalg.Vector(inner(f, v)*dx))
+  assert len(b.terms) == 2
+  k = interpolate(Expression("x[0]"), V)
+  b.axpy(1.0, adjlinalg.Vector(inner(k, v)*dx))
+  assert len(b.terms) == 3
+
+  # Terms that cancel are dropped
+  b.axpy(-1.0, adjlinalg.Vector(inner(k, v)*dx))
+  assert len(b.terms) == 2
+  assert isinstance(b.data, ufl.Form)
+  assert numpy.allclose(assemble(b.data).array(), 5.0*assemble(F).array() - 2.0*assemble(G).array())
+
+  # Function contributions are added in vector space, and the form terms are
+  # assembled once when the data is requested
+  h = Function(V)
+  h.vector()[:] = 1.0
+  b.axpy(3.0, adjlinalg.Vector(h))
+  b.axpy(1.0, adjlinalg.Vector(F))
+  assert len(b.terms) == 2
+  assert isinstance(b.data, Function)
+  assert numpy.allclose(b.data.vector().array(), 6.0*assemble(F).array() - 2.0*assemble(G).array() + 3.0)
+  assert len(b.terms) == 0
+
+  # A sum whose terms all cancel is zero
+  c = adjlinalg.Vector(None)
+  c.axpy(1.0, adjlinalg.Vector(F))
+  c.axpy(-1.0, adjlinalg.Vector(F))
+  assert c.zero and c.data is None
@@ -0,0 +1,87 @@
+"""
+Compute the singular value decomposition of the propagator of Burgers'
+equation with the randomized block method, and check it against the
+tangent linear model.
+"""
+
+import sys
+import numpy
+import random
+
+from dolfin import *
+from dolfin_adjoint import *
+
+dolfin.parameters["adjoint"]["record_all"] = True
+dolfin.parameters["adjoint"]["fussy_replay"] = False
+
+n = 10
+mesh = UnitIntervalMesh(n)
+V = FunctionSpace(mesh, "CG", 1)
+
+def Dt(u, u_, timestep):
+    return (u - u_)/timestep
+
+def main(ic, annotate=False):
+
+    u_ = Function(ic, name="State")
+    u = Function(V, name="NextState")
+    v = TestFunction(V)
+
+    nu = Constant(0.0001)
+
+    timestep = Constant(1.0/n)
+
+    F = (Dt(u, u_, timestep)*v
+         + u*u.dx(0)*v + nu*u.dx(0)*v.dx(0))*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.2
+    while (t <= end):
+        solve(F == 0, u, bc, annotate=annotate)
+        u_.assign(u, annotate=annotate)
+
+        t += float(timestep)
+        adj_inc_timestep()
+
+    return u_
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(2*pi*x[0])"),  V)
+    forward = main(ic, annotate=True)
+
+    perturbation = Function(V)
+    vec = perturbation.vector()
+    for i in range(len(vec)):
+      vec[i] = random.random()
+
+    info_blue("Computing the TLM the direct way ... ")
+    param = Control("State", perturbation=perturbation)
+    for (tlm, var) in compute_tlm(param, forget=False):
+      pass
+    final_tlm = tlm
+
+    # With a block as large as the space, the low-rank propagator is exact
+    ndof = V.dim()
+    info_blue("Computing the TLM the randomized SVD way ... ")
+    svd = compute_gst_randomized("State", "State", nsv=ndof, ic_norm=None, final_norm=None, oversampling=0, seed=0)
+
+    sigmas = [svd.get_gst(i) for i in range(svd.ncv)]
+    print "Singular values: ", sigmas
+    assert all(sigmas[i] >= sigmas[i+1] for i in range(len(sigmas)-1))
+
+    tlm_output = svd.action(perturbation)
+    norm = numpy.linalg.norm(final_tlm.vector().array() - tlm_output.vector().array())
+    print "Error norm: ", norm
+    assert norm < 1.0e-7
+
+    # The leading triplets of a smaller block in the mass-matrix norms
+    svd = compute_gst_randomized("State", "State", nsv=2, seed=0)
+    (sigma, u, v, residual) = svd.get_gst(0, return_vectors=True, return_residual=True)
+    print "Maximal singular value: ", (sigma, residual)
+
+    v_l2 = assemble(inner(v, v)*dx)
+    print "L2 norm of v: %.16e" % v_l2
+    assert abs(v_l2 - 1.0) < 1.0e-10
+    assert residual < 1.0e-3 * sigma
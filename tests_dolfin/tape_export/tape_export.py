@@ -0,0 +1,64 @@
+"""
+A tape exported to a file and imported again (as in a fresh process) gives the same
+functional value and gradient as the original annotation.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+parameters["adjoint"]["record_tape"] = True
+
+def main(ic):
+    u_ = Function(ic, name="Temperature")
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    kappa = Constant(0.1, name="Diffusivity")
+    timestep = Constant(0.05)
+    source = Expression("t*x[0]*x[1]", t=0.0, degree=2)
+    g = Expression("t", t=0.0, degree=0)
+    bc = DirichletBC(V, g, "on_boundary && x[0] < DOLFIN_EPS")
+
+    a = u*v*dx + timestep*kappa*inner(grad(u), grad(v))*dx
+    L = u_*v*dx + timestep*source*v*dx
+
+    u_next = Function(V, name="TemperatureNext")
+    t = 0.0
+    adj_start_timestep(t)
+    for i in range(4):
+        t += float(timestep)
+        source.t = t
+        g.t = t
+        solve(a == L, u_next, bc)
+        u_.assign(u_next)
+        adj_inc_timestep(t, finished=(i == 3))
+
+    return u_
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V)
+    u = main(ic)
+
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME] + inner(u, u)*dx*dt)
+    m = Control(ic)
+    Jm = ReducedFunctional(J, m)(ic)
+    dJdm = compute_gradient(J, m, forget=False)
+
+    adj_export_tape("tape.bin", functional=J, controls=m)
+
+    # Forget everything, and rebuild the annotation from the file
+    adj_reset()
+    tape = adj_import_tape("tape.bin", mesh)
+
+    ic_imported = tape.functions[str(ic)]
+    rf = ReducedFunctional(tape.functional, tape.controls)
+    Jm_imported = rf(ic_imported)
+    dJdm_imported = compute_gradient(tape.functional, tape.controls, forget=False)
+
+    info("Original: J = %s, |dJ/dm| = %s; imported: J = %s, |dJ/dm| = %s" % (Jm, norm(dJdm), Jm_imported, norm(dJdm_imported)))
+    assert abs(Jm - Jm_imported) < 1.0e-12
+    assert (dJdm.vector() - dJdm_imported.vector()).norm("l2") < 1.0e-12
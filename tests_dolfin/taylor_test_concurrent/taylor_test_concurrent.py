@@ -0,0 +1,41 @@
+""" Checks a gradient with the perturbed functionals of the Taylor test
+evaluated concurrently, and that the forward state on the tape survives. """
+
+from dolfin import *
+from dolfin_adjoint import *
+
+dolfin.set_log_level(ERROR)
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+W = FunctionSpace(mesh, "DG", 0)
+
+m = interpolate(Constant(1.0), W, name="Control")
+u = Function(V, name="State")
+v = TestFunction(V)
+
+F = (inner(grad(u), grad(v)) + u**3*v - m*v)*dx
+bc = DirichletBC(V, 0.0, "on_boundary")
+solve(F == 0, u, bc)
+
+J = Functional(u**2*dx)
+rf = ReducedFunctional(J, Control(m))
+rf_np = ReducedFunctionalNumPy(rf)
+
+if __name__ == "__main__":
+  m_array = rf_np.get_controls()
+  j = rf_np(m_array)
+
+  parameters["optimization"]["test_gradient_processes"] = 4
+  dj = rf_np.derivative(m_array, taylor_test=True, seed=0.1, forget=False)
+
+  # The concurrent Taylor test must not have disturbed the forward state
+  assert rf.current_func_value*rf.scale == j
+  assert (rf_np.derivative(m_array, forget=False) == dj).all()
+
+  # The Taylor test of utils also supports concurrent evaluation
+  def Jhat(m):
+    return rf(m)
+
+  minconv = taylor_test(Jhat, Control(m), j, rf.derivative(forget=False)[0], processes=4)
+  assert minconv > 1.9
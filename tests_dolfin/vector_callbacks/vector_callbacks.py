@@ -0,0 +1,49 @@
+import numpy
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjlinalg
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+if __name__ == "__main__":
+  # Random fills are reproducible once the generator is reseeded
+  adjlinalg.random_state.seed(42)
+  x = adjlinalg.Vector(None, fn_space=V)
+  x.set_random()
+  adjlinalg.random_state.seed(42)
+  y = adjlinalg.Vector(Function(V))
+  y.set_random()
+  assert (x.data.vector().array() == y.data.vector().array()).all()
+
+  # ... and successive fills differ
+  y.set_random()
+  assert (x.data.vector().array() != y.data.vector().array()).any()
+
+  # Each process draws only the blocks of its own range, and the values are those of the
+  # whole vector drawn block by block, however it is partitioned
+  adjlinalg.random_block_size = 5
+  adjlinalg.random_state.seed(7)
+  seed = numpy.random.RandomState(7).randint(2**31 - 1)
+  x.set_random()
+  (start, end) = x.data.vector().local_range()
+  blocks = [numpy.random.RandomState([seed, block]).random_sample(5) for block in range(end // 5 + 1)]
+  assert (x.data.vector().array() == numpy.concatenate(blocks)[start:end]).all()
+  adjlinalg.random_block_size = 4096
+
+  # Form-valued vectors know their size without assembly, and get_values
+  # agrees with the assembled form
+  v = TestFunction(V)
+  f = interpolate(Expression("x[0]*x[1]"), V)
+  z = adjlinalg.Vector(inner(f, v)*dx)
+  assert z.size() == V.dofmap().ownership_range()[1] - V.dofmap().ownership_range()[0]
+
+  values = numpy.zeros(z.size())
+  z.get_values(values)
+  assert numpy.allclose(values, assemble(inner(f, v)*dx).array())
+
+  # Setting the values of a form-valued vector replaces the form
+  z.set_values(numpy.ones(z.size()))
+  assert isinstance(z.data, Function)
+  assert (z.data.vector().array() == 1.0).all()
@@ -0,0 +1,75 @@
+"""
+Replays of Burgers' equation, warm started from the previous replay and
+reusing the Jacobian factorisations, agree with the cold replays.
+"""
+
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+n = 30
+mesh = UnitIntervalMesh(n)
+V = FunctionSpace(mesh, "CG", 2)
+
+def Dt(u, u_, timestep):
+    return (u - u_)/timestep
+
+def main(ic, annotate=False):
+
+    u_ = Function(ic, name="Velocity")
+    u = Function(V, name="VelocityNext")
+    v = TestFunction(V)
+
+    nu = Constant(0.0001)
+
+    timestep = Constant(1.0/n)
+
+    F = (Dt(u, u_, timestep)*v
+         + u*u.dx(0)*v + nu*u.dx(0)*v.dx(0))*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.2
+    while (t <= end):
+        solve(F == 0, u, bc, annotate=annotate, solver_parameters={"newton_solver": {"relative_tolerance": 1.0e-12, "absolute_tolerance": 1.0e-14}})
+        u_.assign(u, annotate=annotate)
+
+        t += float(timestep)
+        adj_inc_timestep()
+
+    return u_
+
+if __name__ == "__main__":
+
+    ic = project(Expression("sin(2*pi*x[0])"),  V)
+    forward = main(ic, annotate=True)
+
+    J = Functional(forward*forward*dx*dt[FINISH_TIME])
+    rf = ReducedFunctional(J, Control(ic))
+
+    perturbation = interpolate(Expression("0.01*x[0]*(1 - x[0])"), V)
+    perturbed = Function(ic)
+    perturbed.vector().axpy(1.0, perturbation.vector())
+
+    cold = [rf(ic), rf(perturbed)]
+
+    parameters["adjoint"]["warm_start_replay"] = True
+    parameters["adjoint"]["reuse_jacobian"] = True
+    warm = [rf(ic), rf(perturbed), rf(ic)]
+
+    info("Cold replays: %s; warm replays: %s" % (cold, warm))
+    assert abs(warm[0] - cold[0]) < 1.0e-10
+    assert abs(warm[1] - cold[1]) < 1.0e-10
+    assert abs(warm[2] - cold[0]) < 1.0e-10
+
+    # Only the first replay_cache_size solves keep their solution and factorisation
+    parameters["adjoint"]["replay_cache_size"] = 2
+    caching.replay_cache.clear()
+    bounded = [rf(ic), rf(perturbed)]
+    assert len(caching.replay_cache.entries) == 2
+    assert abs(bounded[0] - cold[0]) < 1.0e-10
+    assert abs(bounded[1] - cold[1]) < 1.0e-10
+
+    # Resetting the annotation releases them
+    adj_reset()
+    assert len(caching.replay_cache.entries) == 0
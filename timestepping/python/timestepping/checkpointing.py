@@ -19,14 +19,17 @@
 from collections import OrderedDict
 import cPickle
 import copy
+import mmap
 import os
 
 import dolfin
+import numpy
 
 from exceptions import *
 
 __all__ = \
   [
+    "BinaryDiskCheckpointer",
     "Checkpointer",
     "DiskCheckpointer",
     "MemoryCheckpointer"
@@ -397,4 +400,235 @@ class DiskCheckpointer(Checkpointer):
           del(self.__filenames[key])
           del(self.__id_map[key])
 
-    return
\ No newline at end of file
+    return
+
+class BinaryDiskCheckpointer(Checkpointer):
+  """
+  Constant and Function storage on disk, in a single binary container file per
+  process. The file is preallocated and data is appended to it, with an index
+  mapping (key, Constant or Function id) to the (offset, length) of the data in
+  the file. Data is restored by memory mapping the file, reading only the
+  requested Constant s and Function s. The space of removed keys is recycled.
+  All keys handled by a BinaryDiskCheckpointer are internally cast to strings.
+
+  Constructor arguments:
+    dirname: The directory in which data is to be stored.
+    size: The size, in bytes, to which the file is initially preallocated. The
+      file is grown as required.
+  """
+
+  __count = 0
+
+  def __init__(self, dirname = "checkpoints~", size = 2 ** 20):
+    if not isinstance(dirname, str):
+      raise InvalidArgumentException("dirname must be a string")
+    if not isinstance(size, int) or size <= 0:
+      raise InvalidArgumentException("size must be a positive integer")
+
+    Checkpointer.__init__(self)
+
+    if dolfin.MPI.process_number() == 0:
+      if not os.path.exists(dirname):
+        os.mkdir(dirname)
+    dolfin.MPI.barrier()
+
+    # Each BinaryDiskCheckpointer has its own file
+    self.__filename = os.path.join(dirname, "checkpoint_container_%i_%i" % (BinaryDiskCheckpointer.__count, dolfin.MPI.process_number()))
+    BinaryDiskCheckpointer.__count += 1
+    self.__handle = open(self.__filename, "w+b")
+    self.__size = 0
+    self.__mmap = None
+    self.__resize(size)
+
+    self.__index = {}
+    self.__id_map = {}
+    # Sorted list of free (offset, length) extents before the end of the data
+    self.__free = []
+    self.__end = 0
+
+    return
+
+  def __resize(self, size):
+    if not self.__mmap is None:
+      self.__mmap.flush()
+      self.__mmap.close()
+    self.__handle.truncate(size)
+    self.__handle.flush()
+    self.__mmap = mmap.mmap(self.__handle.fileno(), size)
+    self.__size = size
+
+    return
+
+  def __allocate(self, length):
+    # First fit in the recycled space
+    for i, (offset, free_length) in enumerate(self.__free):
+      if free_length >= length:
+        if free_length == length:
+          del(self.__free[i])
+        else:
+          self.__free[i] = (offset + length, free_length - length)
+        return offset
+
+    # Otherwise append
+    offset = self.__end
+    self.__end += length
+    if self.__end > self.__size:
+      self.__resize(max(2 * self.__size, self.__end))
+    return offset
+
+  def __deallocate(self, offset, length):
+    if length == 0:
+      return
+    free = self.__free + [(offset, length)]
+    free.sort()
+
+    merged = []
+    for offset, length in free:
+      if len(merged) > 0 and merged[-1][0] + merged[-1][1] == offset:
+        merged[-1] = (merged[-1][0], merged[-1][1] + length)
+      else:
+        merged.append((offset, length))
+    if len(merged) > 0 and merged[-1][0] + merged[-1][1] == self.__end:
+      self.__end = merged.pop()[0]
+    self.__free = merged
+
+    return
+
+  def __view(self, offset, length):
+    n = length // numpy.dtype(numpy.float64).itemsize
+    if n == 0:
+      return numpy.empty(0, dtype = numpy.float64)
+    return numpy.ndarray(shape = (n,), dtype = numpy.float64, buffer = self.__mmap, offset = offset)
+
+  def __read(self, c, offset, length):
+    c_c = self.__view(offset, length)
+    if isinstance(c, dolfin.Constant):
+      c_c = float(c_c[0])
+    return c_c
+
+  def checkpoint(self, key, cs):
+    """
+    Store, with the supplied key, the supplied Constant s and Function s. The
+    key is internally cast to a string.
+    """
+
+    key = str(key)
+    if key in self.__index:
+      raise CheckpointException("Attempting to overwrite checkpoint with key %s" % key)
+    cs = self._Checkpointer__check_cs(cs)
+
+    index = OrderedDict()
+    id_map = {}
+    for c in cs:
+      c_id = c.id()
+      c_c = numpy.asarray(self._Checkpointer__pack(c), dtype = numpy.float64).reshape(-1)
+      length = c_c.nbytes
+      offset = self.__allocate(length)
+      self.__view(offset, length)[:] = c_c
+      index[c_id] = (offset, length)
+      id_map[c_id] = c
+
+    self.__index[key] = index
+    self.__id_map[key] = id_map
+
+    return
+
+  def restore(self, key, cs = None):
+    """
+    Restore Constant s and Function s with the given key. If cs is supplied,
+    only restore Constant s and Function s found in cs. The key is internally
+    cast to a string.
+    """
+
+    key = str(key)
+    if not key in self.__index:
+      raise CheckpointException("Missing checkpoint with key %s" % key)
+    if not cs is None:
+      cs = self._Checkpointer__check_cs(cs)
+      cs = [c.id() for c in cs]
+
+    index = self.__index[key]
+    if cs is None:
+      cs = index.keys()
+
+    id_map = self.__id_map[key]
+    for c_id in cs:
+      c = id_map[c_id]
+      offset, length = index[c_id]
+      self._Checkpointer__unpack(c, self.__read(c, offset, length))
+
+    return
+
+  def has_key(self, key):
+    """
+    Return whether any data is associated with the given key. The key is
+    internally cast to a string.
+    """
+
+    key = str(key)
+    return key in self.__index
+
+  def verify(self, key, tolerance = 0.0):
+    """
+    Verify data associated with the given key, with the specified tolerance. The
+    key is internally cast to a string.
+    """
+
+    key = str(key)
+    if not key in self.__index:
+      raise CheckpointException("Missing checkpoint with key %s" % key)
+    if not isinstance(tolerance, float) or tolerance < 0.0:
+      raise InvalidArgumentException("tolerance must be a non-negative float")
+
+    try:
+      index = self.__index[key]
+      id_map = self.__id_map[key]
+      for c_id in index:
+        c = id_map[c_id]
+        offset, length = index[c_id]
+        self._Checkpointer__verify(c, self.__read(c, offset, length), tolerance = tolerance)
+      dolfin.info("Verified checkpoint with key %s" % key)
+    except CheckpointException as e:
+      dolfin.info(str(e))
+      raise CheckpointException("Failed to verify checkpoint with key %s" % key)
+
+    return
+
+  def remove(self, key):
+    """
+    Remove data associated with the given key. The key is internally cast to a
+    string.
+    """
+
+    key = str(key)
+    if not key in self.__index:
+      raise CheckpointException("Missing checkpoint with key %s" % key)
+
+    for offset, length in self.__index[key].values():
+      self.__deallocate(offset, length)
+    del(self.__index[key])
+    del(self.__id_map[key])
+
+    return
+
+  def clear(self, keep = []):
+    """
+    Clear all stored data, except for those with keys in keep. The keys are
+    internally cast to strings.
+    """
+
+    if not isinstance(keep, list):
+      raise InvalidArgumentException("keep must be a list")
+
+    if len(keep) == 0:
+      self.__index = {}
+      self.__id_map = {}
+      self.__free = []
+      self.__end = 0
+    else:
+      keep = [str(key) for key in keep]
+      for key in copy.copy(self.__index.keys()):
+        if not key in keep:
+          self.remove(key)
+
+    return
@@ -961,9 +961,13 @@ class ManagedModel(object):
     initialise: Whether the initialise method is to be called.
     reassemble: Whether the reassemble methods of solvers defined by the
       TimeSystem should be called.
+    disk_format: The format in which data is written to disk. "pickle" (the
+      default) writes one file per storage point using a DiskCheckpointer.
+      "binary" writes to a single binary container file per process using a
+      BinaryDiskCheckpointer.
   """
   
-  def __init__(self, tsystem, functional = None, disk_period = None, initialise = True, reassemble = False):
+  def __init__(self, tsystem, functional = None, disk_period = None, initialise = True, reassemble = False, disk_format = "pickle"):
     if not isinstance(tsystem, TimeSystem):
       raise InvalidArgumentException("tsystem must be a TimeSystem")
     if not functional is None and not isinstance(functional, (ufl.form.Form, TimeFunctional)):
@@ -971,6 +975,8 @@ class ManagedModel(object):
     if not disk_period is None:
       if not isinstance(disk_period, int) or disk_period <= 0:
         raise InvalidArgumentException("disk_period must be a positive integer")
+    if not disk_format in ["pickle", "binary"]:
+      raise InvalidArgumentException("disk_format must be \"pickle\" or \"binary\"")
       
     forward = assemble(tsystem, adjoint = False, initialise = False, reassemble = reassemble)
     adjoint = AdjointModel(forward)
@@ -1018,6 +1024,8 @@ class ManagedModel(object):
     self.__memory_checkpointer = MemoryCheckpointer()
     if disk_period is None:
       self.__disk_checkpointer = None
+    elif disk_format == "binary":
+      self.__disk_checkpointer = BinaryDiskCheckpointer()
     else:
       self.__disk_checkpointer = DiskCheckpointer()
     self.__disk_period = disk_period